@@ -0,0 +1,217 @@
+'''
+Native Python equivalent of abbyy2hocr.xsl.
+
+The stylesheet instantiates a template for every single charParams element and
+wraps each low confidence character in a span of its own.  Here we build the
+hOCR tree from the ABBYY page in a single pass, and (by default) merge runs of
+adjacent characters with the same confidence class into one span, which makes
+the output considerably smaller.
+
+With merge=False the output is identical to that of the stylesheet, which is
+what test_equivalence() checks.
+
+Usage:
+    python abbyy2hocr.py input/oed01arch_abbyy.gz [page[-page]]
+'''
+import gzip
+import lxml.etree as ET
+import sys
+
+SKELETON = '''<!DOCTYPE html PUBLIC "-//W3C//DTD HTML 4.0 Transitional//EN" "http://www.w3.org/TR/REC-html40/loose.dtd">
+<html><head><meta name="ocr-system" content="ABBYY-FineReader 6"/><meta name="ocr-capabilities" content="ocr_line ocr_page"/><meta name="ocr-langs" content="en"/><meta name="ocr-scripts" content="Latn"/><meta name="ocr-microformats" content=""/><link rel="stylesheet" type="text/css" href="3column.css"/><title>A New English Dictionary (1888) - OCR output</title></head><body/></html>'''
+
+HEADER = '''<div id="header"><span><a id="prev">Previous Page </a></span><b>     A New English Dictionary (1888)  </b><a id="orig" target="_blank">Source Image</a><a id="next"> Next Page</a></div>'''
+
+# Character confidence classes, same thresholds as the stylesheet
+VERYLOW = 45
+LOW = 50
+
+
+def number(value):
+    '''
+    XPath style conversion of an attribute value to a number (NaN if missing)
+    '''
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+def confidence(char):
+    '''
+    Return the CSS class for a low confidence character or None.
+    '''
+    if char.get('wordFromDictionary') != 'false':
+        return None
+    conf = number(char.get('charConfidence'))
+    if conf < VERYLOW:
+        return 'very_low_confidence'
+    if conf < LOW:
+        return 'low_confidence'
+    return None
+
+
+def appendtext(parent, text):
+    if len(parent):
+        last = parent[-1]
+        last.tail = (last.tail or '') + text
+    else:
+        parent.text = (parent.text or '') + text
+
+
+def addchars(parent, chars, merge):
+    '''
+    Add the text of a run of charParams to parent, wrapping low confidence
+    characters in spans.
+    '''
+    run = []
+    runclass = None
+    for char in chars:
+        cls = confidence(char)
+        if run and (cls != runclass or (cls and not merge)):
+            if runclass:
+                ET.SubElement(parent, 'span', {'class': runclass}).text = ''.join(run)
+            else:
+                appendtext(parent, ''.join(run))
+            run = []
+        runclass = cls
+        run.append(char.text or '')
+    if run:
+        if runclass:
+            ET.SubElement(parent, 'span', {'class': runclass}).text = ''.join(run)
+        else:
+            appendtext(parent, ''.join(run))
+
+
+def addformatting(line, formatting, merge):
+    span = ET.SubElement(line, 'span',
+                         style='font-size:%s0pt' % formatting.get('fs', ''))
+    if formatting.get('bold') == 'true' and formatting.get('italic') == 'true':
+        parent = ET.SubElement(ET.SubElement(span, 'b'), 'em')
+    elif formatting.get('bold') == 'true':
+        parent = ET.SubElement(span, 'b')
+    elif formatting.get('italic') == 'true':
+        parent = ET.SubElement(span, 'em')
+    elif formatting.get('smallcaps') == 'true':
+        parent = ET.SubElement(span, 'span', style='font-variant:small-caps;')
+    elif formatting.get('superscript') == 'true':
+        parent = ET.SubElement(span, 'sup')
+    elif formatting.get('subscript') == 'true':
+        parent = ET.SubElement(span, 'sub')
+    else:
+        parent = span
+    addchars(parent, formatting.iterchildren('charParams'), merge)
+
+
+def bbox(el):
+    return 'bbox %s %s %s %s' % (el.get('l', ''), el.get('t', ''),
+                                 el.get('r', ''), el.get('b', ''))
+
+
+def blockclass(block, left, right):
+    l = number(block.get('l'))
+    if l < left:
+        return 'ocr_carea column col_left'
+    if l > right:
+        return 'ocr_carea column col_right'
+    return 'ocr_carea column col_center'
+
+
+def addpage(body, page, merge):
+    body.append(ET.fromstring(HEADER))
+    width = number(page.get('width'))
+    # Compute column boundaries - we may need something fancier
+    left = width / 4
+    right = width * 55 / 100
+    resolution = page.get('resolution', '')
+    container = ET.SubElement(body, 'div')
+    container.set('class', 'ocr_page')
+    container.set('id', 'container')
+    container.set('scan_res', '%s %s' % (resolution, resolution))
+    container.set('title', 'bbox 0 0 %s %s; ' % (page.get('width', ''),
+                                                 page.get('height', '')))
+    for block in page.iterchildren('block'):
+        div = ET.SubElement(container, 'div')
+        div.set('title', 'blockType: %s %s' % (block.get('blockType', ''),
+                                                bbox(block)))
+        div.set('class', blockclass(block, left, right))
+        for par in block.iterfind('text/par'):
+            p = ET.SubElement(div, 'p', {'class': 'ocr_par'})
+            for line in par.iterchildren('line'):
+                span = ET.SubElement(p, 'span')
+                span.set('class', 'ocr_line')
+                span.set('title', bbox(line))
+                span.tail = ' '
+                for formatting in line.iterchildren('formatting'):
+                    addformatting(span, formatting, merge)
+    footer = ET.SubElement(body, 'div', id='footer')
+    footer.text = 'footer placeholder'
+
+
+def transform(page, merge=True):
+    '''
+    Transform an ABBYY <page> element (or a document containing pages)
+    to an hOCR document.
+    '''
+    if isinstance(page, ET._ElementTree):
+        page = page.getroot()
+    root = ET.fromstring(SKELETON)
+    body = root.find('body')
+    pages = [page] if page.tag == 'page' else page.iter('page')
+    for p in pages:
+        addpage(body, p, merge)
+    return root.getroottree()
+
+
+def _pages(localfile, start, limit):
+    import oedabby
+    with gzip.open(localfile, 'rb') as f:
+        for pagenum, linenum, page in oedabby.iterpages(f, start, limit):
+            yield pagenum, page
+
+
+def test_equivalence(localfile, start=26, limit=30):
+    '''
+    Check the native transform against the stylesheet.  Unmerged output
+    must be byte for byte identical and merged output must have the same
+    text and the same characters flagged as low confidence.
+    '''
+    xslt = ET.XSLT(ET.parse('abbyy2hocr.xsl'))
+
+    def flagged(dom):
+        # (line, offset, class) for each low confidence character
+        result = set()
+        for i, line in enumerate(dom.iterfind(".//span[@class='ocr_line']")):
+            offset = 0
+            for node in line.xpath('.//text()'):
+                cls = node.getparent().get('class') if node.is_text else None
+                if cls in ('low_confidence', 'very_low_confidence'):
+                    result.update((i, offset + j, cls) for j in range(len(node)))
+                offset += len(node)
+        return result
+
+    count = 0
+    for pagenum, page in _pages(localfile, start, limit):
+        expected = xslt(page)
+        assert ET.tostring(transform(page, merge=False)) == ET.tostring(expected), \
+            'page %d differs from stylesheet output' % pagenum
+        merged = transform(page)
+        assert merged.xpath('string()') == expected.xpath('string()'), \
+            'page %d text differs' % pagenum
+        assert flagged(merged) == flagged(expected), \
+            'page %d confidence markup differs' % pagenum
+        count += 1
+    print 'Native transform matches stylesheet on %d pages' % count
+
+
+def main():
+    localfile = sys.argv[1] if len(sys.argv) > 1 else 'input/oed01arch_abbyy.gz'
+    start, limit = 26, 30
+    if len(sys.argv) > 2:
+        first, _, last = sys.argv[2].partition('-')
+        start = int(first)
+        limit = int(last or first)
+    test_equivalence(localfile, start, limit)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+'''
+Random access to the pages of a gzipped ABBYY FineReader volume.
+
+A deflate stream can only be decoded from the beginning, so reaching page 900
+of oed01arch_abbyy.gz normally means inflating the 899 pages in front of it.
+zran gets around this by saving the inflate state (bit offset plus the 32KB
+window) at checkpoints, but the zlib bindings don't give us inflatePrime, so we
+can't restart at arbitrary bit positions from Python.  Instead the one-time
+indexing pass writes every page out as its own gzip member, which gives us a
+byte aligned restart point at the start of each page:
+
+  oed01arch_abbyy.gz       original volume from the Internet Archive
+  oed01arch_abbyy.pages    one gzip member per page (still a valid gzip file)
+  oed01arch_abbyy.idx      page table - one line per page with
+                           page number, line number of </page>, uncompressed
+                           offset & length in the original, offset & length of
+                           the gzip member in the .pages file and the MD5 of
+                           the page's XML
+
+Extracting a page is then a seek, a read and a zlib.decompress of a few
+hundred KB.  The price is the .pages file, which is about the same size as
+the volume.  Indexing with --no-pages only writes the page table, which is
+enough for the page digests & line numbers incremental builds need; pages
+are then read by inflating the volume up to them, which is cheap for a run
+of consecutive pages but not for jumping about.  --remove deletes both.
+
+Usage:
+    python abbyyindex.py [--no-pages] input/oed01arch_abbyy.gz [page[-page]]
+    python abbyyindex.py --remove input/oed01arch_abbyy.gz
+'''
+import gzip
+import hashlib
+import os
+import re
+import sys
+import zlib
+
+VERSION = 2
+CHUNKSIZE = 4 * 1024 * 1024
+PAGESTART = re.compile(r'<page[\s>]')
+PAGEEND = '</page>'
+
+
+def sidecars(localfile):
+    '''
+    Return the names of the page data and index files for a volume.
+    '''
+    base = localfile
+    if base.endswith('.gz'):
+        base = base[:-3]
+    return base + '.pages', base + '.idx'
+
+
+def signature(localfile):
+    st = os.stat(localfile)
+    return '%d %d' % (st.st_size, int(st.st_mtime))
+
+
+def isindexed(localfile):
+    '''
+    Returns True if there's an up to date index for the given volume, with
+    or without its .pages file.
+    '''
+    pagesfile, indexfile = sidecars(localfile)
+    if not os.path.exists(indexfile):
+        return False
+    with open(indexfile) as f:
+        header = f.readline().split(None, 2)
+    return (len(header) == 3 and header[0] == '#%d' % VERSION
+            and header[2].strip() == signature(localfile))
+
+
+def buildindex(localfile, pages=True):
+    '''
+    Scan a gzipped ABBYY volume once, writing the page data (unless pages
+    is False) & index sidecars.  Returns the number of pages found.
+    '''
+    pagesfile, indexfile = sidecars(localfile)
+    entries = []
+    buf = ''
+    offset = 0  # uncompressed offset of buf[0]
+    lines = 0   # number of newlines before buf[0]
+    removeindex(localfile)
+    with gzip.open(localfile, 'rb') as f, open(pagesfile + '.tmp', 'wb') as out:
+        eof = False
+        while not eof:
+            chunk = f.read(CHUNKSIZE)
+            eof = not chunk
+            buf += chunk
+            pos = 0
+            while True:
+                m = PAGESTART.search(buf, pos)
+                if not m:
+                    # keep enough for a start tag split across chunks
+                    keep = max(pos, len(buf) - len(PAGEEND))
+                    break
+                end = buf.find(PAGEEND, m.start())
+                if end < 0:
+                    keep = m.start()
+                    break
+                line = lines + buf.count('\n', 0, end) + 1
+                end += len(PAGEEND)
+                page = buf[m.start():end]
+                member = ''
+                if pages:
+                    data = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+                    member = data.compress(page) + data.flush()
+                entries.append((len(entries) + 1, line, offset + m.start(),
+                                end - m.start(), out.tell(), len(member),
+                                hashlib.md5(page).hexdigest()))
+                out.write(member)
+                pos = end
+            lines += buf.count('\n', 0, keep)
+            offset += keep
+            buf = buf[keep:]
+    with open(indexfile + '.tmp', 'w') as of:
+        of.write('#%d %s %s\n' % (VERSION, os.path.basename(localfile),
+                                  signature(localfile)))
+        for entry in entries:
+            of.write('%d\t%d\t%d\t%d\t%d\t%d\t%s\n' % entry)
+    if pages:
+        os.rename(pagesfile + '.tmp', pagesfile)
+    else:
+        os.remove(pagesfile + '.tmp')
+    os.rename(indexfile + '.tmp', indexfile)
+    return len(entries)
+
+
+def removeindex(localfile):
+    '''
+    Delete a volume's index sidecars, if it has them
+    '''
+    for path in sidecars(localfile):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class PageIndex():
+    '''
+    Random access reader for an indexed volume.
+    '''
+
+    def __init__(self, localfile):
+        pagesfile, indexfile = sidecars(localfile)
+        self.entries = {}
+        with open(indexfile) as f:
+            f.readline()
+            for line in f:
+                fields = line.split()
+                self.entries[int(fields[0])] = map(int, fields[1:6]) + fields[6:]
+        self.lastpage = max(self.entries) if self.entries else 0
+        # without the .pages file we inflate the volume up to each page
+        self.volume = None
+        if os.path.exists(pagesfile):
+            self.f = open(pagesfile, 'rb')
+        else:
+            self.f = self.volume = gzip.open(localfile, 'rb')
+
+    def __contains__(self, pagenum):
+        return pagenum in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def line(self, pagenum):
+        '''
+        Line number of the closing </page> tag in the original file.
+        '''
+        return self.entries[pagenum][0]
+
+    def digest(self, pagenum):
+        '''
+        MD5 of the page's XML text (without having to read it)
+        '''
+        return self.entries[pagenum][5]
+
+    def page(self, pagenum):
+        '''
+        Return the XML text of a single page.
+        '''
+        line, offset, length, coffset, clength, digest = self.entries[pagenum]
+        if self.volume is not None:
+            # GzipFile.seek skips forward a KB at a time
+            if offset < self.volume.tell():
+                self.volume.rewind()
+            while self.volume.tell() < offset:
+                self.volume.read(min(CHUNKSIZE, offset - self.volume.tell()))
+            return self.volume.read(length)
+        self.f.seek(coffset)
+        return zlib.decompress(self.f.read(clength), 16 + zlib.MAX_WBITS)
+
+    def pages(self, start, limit):
+        '''
+        Generator which yields (pagenum, xml) for an inclusive page range.
+        '''
+        for pagenum in range(max(start, 1), min(limit, self.lastpage) + 1):
+            yield pagenum, self.page(pagenum)
+
+    def close(self):
+        self.f.close()
+
+
+def main():
+    args = sys.argv[1:]
+    flags = [arg for arg in args if arg in ('--no-pages', '--remove')]
+    args = [arg for arg in args if arg not in flags]
+    if not args:
+        print __doc__
+        sys.exit(1)
+    localfile = args[0]
+    if '--remove' in flags:
+        removeindex(localfile)
+        return
+    if not isindexed(localfile):
+        print >>sys.stderr, 'Indexing %s' % localfile
+        print >>sys.stderr, 'Found %d pages' % buildindex(localfile,
+                                                         '--no-pages' not in flags)
+    if len(args) > 1:
+        first, _, last = args[1].partition('-')
+        index = PageIndex(localfile)
+        for pagenum, xml in index.pages(int(first), int(last or first)):
+            sys.stdout.write(xml + '\n')
+        index.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+'''
+Rough benchmarks for the oedabby pipeline.
+
+Each benchmark is run in a child process so that the peak RSS figures are
+independent of each other.  By default we benchmark a synthetic volume from
+fixtures.py so that no download is needed and the numbers are comparable
+between runs and machines.  The page index & character store some of the
+benchmarks need are built in a scratch directory which is removed at the
+end, so a real volume is left as it was.
+
+Usage:
+    python benchmark.py [-s PAGES] [input/oed01arch_abbyy.gz]
+'''
+import abbyyindex
+import charstore
+import fixtures
+import geometry
+import gzip
+import lxml.etree as ET
+import metrics
+import multiprocessing
+import optparse
+import os
+import resource
+import shutil
+from StringIO import StringIO
+import subprocess
+import sys
+import tempfile
+import time
+
+import oedabby
+import volumes
+
+LOCALFILE = 'input/oed01arch_abbyy.gz'
+
+
+def maxrss():
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def linereader(localfile):
+    '''
+    The original page reader, kept as a baseline.  Pages are found by line
+    prefix, accumulated as a list of lines, joined into a string and then
+    parsed, so each page is held in memory three times over.
+    '''
+    with gzip.open(localfile, 'rb') as f:
+        pagenum = 0
+        for line in f:
+            if line.startswith('<page'):
+                pagenum += 1
+                xml = ['<?xml version="1.0" encoding="UTF-8"?>']
+                while not line.startswith('</page'):
+                    xml.append(line)
+                    line = f.next()
+                xml.append(line)
+                yield pagenum, ET.fromstring('\n'.join(xml))
+
+
+def streamreader(localfile):
+    with gzip.open(localfile, 'rb') as f:
+        for pagenum, linenum, page in oedabby.iterpages(f, 1, sys.maxint):
+            yield pagenum, page
+
+
+def _run(bench, args, results):
+    start = maxrss()
+    t = time.time()
+    count = bench(*args)
+    results.put((count, time.time() - t, start, maxrss()))
+
+
+def run(name, bench, *args):
+    '''
+    Run bench(*args) in a child process and report how many pages it
+    processed per second and how much its peak RSS grew.
+    '''
+    results = multiprocessing.Queue()
+    p = multiprocessing.Process(target=_run, args=(bench, args, results))
+    p.start()
+    count, elapsed, start, peak = results.get()
+    p.join()
+    print '%-20s %5d pages %8.2fs %8.1f pages/sec   peak RSS +%d KB' % (
+        name, count, elapsed, count / elapsed if elapsed else 0, peak - start)
+    return count, elapsed, peak - start
+
+
+def countpages(reader, localfile):
+    count = 0
+    for pagenum, page in reader(localfile):
+        count += 1
+    return count
+
+
+IMPORTS = ('oedabby', 'entries', 'headwords', 'search', 'charstore')
+HEAVY = ('matplotlib', 'requests')
+IMPORTSCRIPT = '''
+import sys, time
+t = time.time()
+import %s
+print time.time() - t, ' '.join(m for m in %r if m in sys.modules)
+'''
+
+
+def bench_import(repeat=5):
+    '''
+    Time a cold import of each module in a fresh interpreter (best of
+    repeat) and report any heavy dependencies that it pulled in.
+    '''
+    for module in IMPORTS:
+        times = []
+        for i in range(repeat):
+            out = subprocess.check_output([sys.executable, '-c',
+                                           IMPORTSCRIPT % (module, HEAVY)])
+            elapsed, _, loaded = out.strip().partition(' ')
+            times.append(float(elapsed))
+        print '%-20s %8.3fs   %s' % ('import ' + module, min(times),
+                                     'loads ' + loaded if loaded else '')
+
+
+def bench_readers(localfile):
+    run('line reader', countpages, linereader, localfile)
+    run('iterparse reader', countpages, streamreader, localfile)
+
+
+def transformpages(transform, localfile, start, limit):
+    '''
+    Transform & serialize a range of pages, only timing the transform.
+    Returns the number of pages, elapsed seconds & bytes of output.
+    '''
+    count = 0
+    elapsed = 0
+    size = 0
+    with gzip.open(localfile, 'rb') as f:
+        for pagenum, linenum, page in oedabby.iterpages(f, start, limit):
+            t = time.time()
+            dom = transform(page)
+            elapsed += time.time() - t
+            size += len(ET.tostring(dom, pretty_print=True))
+            count += 1
+    return count, elapsed, size
+
+
+def bench_transforms(localfile, start=26, limit=75):
+    for engine in ('xslt', 'native'):
+        transform = oedabby.maketransform(engine)
+        count, elapsed, size = transformpages(transform, localfile, start, limit)
+        print '%-20s %5d pages %8.2fs %8.1f pages/sec   %d KB/page' % (
+            engine + ' transform', count, elapsed,
+            count / elapsed if elapsed else 0, size / count / 1024 if count else 0)
+
+
+STAGES = ('extract', 'parse', 'transform', 'findcolumns', 'mergeblocks',
+          'serialize')
+
+
+def stagepages(localfile, start, limit, engine='xslt'):
+    '''
+    Run the per page pipeline over a range of pages, timing each stage
+    separately.  Returns the number of pages and a dict of stage -> seconds.
+    '''
+    transform = oedabby.maketransform(engine)
+    volume = volumes.VOLUMES[0]  # only for the page links
+    index = abbyyindex.PageIndex(localfile)
+    timings = dict((stage, 0.0) for stage in STAGES)
+    count = 0
+    # the post-processing steps are chatty
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        for pagenum in range(max(start, 1), min(limit, index.lastpage) + 1):
+            t0 = time.time()
+            xml = index.page(pagenum)
+            t1 = time.time()
+            page = ET.fromstring(xml)
+            t2 = time.time()
+            dom = transform(page)
+            t3 = time.time()
+            pagemetrics = metrics.PageMetrics(pagenum)
+            geom = geometry.PageGeometry(dom)
+            columns = oedabby.findcolumns(dom, geom, pagemetrics)
+            t4 = time.time()
+            if columns:
+                tangled = oedabby.tangledblocks(geom, columns)
+                blockof = dict((par, block) for block in geom.blocks
+                               for par in block)
+                oedabby.mergeblocks(dom, columns, geom, pagemetrics)
+                if tangled or len(geom.blocks) != 3:
+                    oedabby.rebuildcolumns(dom, columns, geom, blockof,
+                                           pagemetrics)
+            t5 = time.time()
+            ET.tostring(oedabby.numberandlink(dom, pagenum, volume),
+                        pretty_print=True)
+            t6 = time.time()
+            for stage, elapsed in zip(STAGES, (t1 - t0, t2 - t1, t3 - t2,
+                                               t4 - t3, t5 - t4, t6 - t5)):
+                timings[stage] += elapsed
+            count += 1
+            sys.stdout.seek(0)
+            sys.stdout.truncate()
+    finally:
+        sys.stdout = stdout
+        index.close()
+    return count, timings
+
+
+def _runstages(localfile, start, limit, engine, results):
+    start_ = maxrss()
+    count, timings = stagepages(localfile, start, limit, engine)
+    results.put((count, timings, start_, maxrss()))
+
+
+def bench_stages(localfile, start=1, limit=sys.maxint, engine='xslt'):
+    '''
+    Time each stage of the page pipeline in a child process and report
+    pages/sec for each along with the peak RSS of the whole run.
+    '''
+    if not abbyyindex.isindexed(localfile):
+        abbyyindex.buildindex(localfile)
+    results = multiprocessing.Queue()
+    p = multiprocessing.Process(target=_runstages,
+                                args=(localfile, start, limit, engine, results))
+    p.start()
+    count, timings, startrss, peak = results.get()
+    p.join()
+    total = sum(timings.values())
+    for stage in STAGES + ('total',):
+        elapsed = total if stage == 'total' else timings[stage]
+        print '%-20s %5d pages %8.2fs %8.1f pages/sec %5.1f%%' % (
+            stage, count, elapsed, count / elapsed if elapsed else 0,
+            100 * elapsed / total if total else 0)
+    print '%-20s peak RSS %d KB (+%d KB)' % (engine + ' pipeline', peak,
+                                             peak - startrss)
+    return count, timings, peak
+
+
+def storecolumns(localfile, start, limit):
+    store = charstore.CharStore(localfile)
+    return len(charstore.findcolumns(store, start, limit))
+
+
+def bench_charstore(localfile, start=1, limit=sys.maxint):
+    '''
+    Column finding straight from the memory-mapped character store, for
+    comparison with the findcolumns stage above.
+    '''
+    if not charstore.isstored(localfile):
+        t = time.time()
+        pages = charstore.buildstore(localfile)
+        print '%-20s %5d pages %8.2fs (one time)' % ('charstore build', pages,
+                                                    time.time() - t)
+    run('charstore columns', storecolumns, localfile, start, limit)
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options] [abbyy.gz]')
+    parser.add_option('-s', '--synthetic', type='int', default=100, metavar='N',
+                      help='benchmark a synthetic volume of N pages if no file '
+                      'is given (default %default)')
+    parser.add_option('--seed', type='int', default=0,
+                      help='random seed for the synthetic volume')
+    options, args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    if args:
+        # the sidecars are named after the path, so they go in tmp too
+        localfile = os.path.join(tmp, os.path.basename(args[0]))
+        os.symlink(os.path.abspath(args[0]), localfile)
+        start = volumes.VOLUMES[0].start
+        limit = start + 49
+    else:
+        localfile = os.path.join(tmp, 'synthetic_abbyy.gz')
+        print 'Generating %d synthetic pages' % options.synthetic
+        fixtures.writevolume(localfile, options.synthetic, options.seed)
+        start, limit = 1, options.synthetic
+    try:
+        bench_import()
+        print
+        bench_readers(localfile)
+        bench_transforms(localfile, start, limit)
+        for engine in ('xslt', 'native'):
+            print
+            bench_stages(localfile, start, limit, engine)
+        print
+        bench_charstore(localfile, start, limit)
+    finally:
+        shutil.rmtree(tmp)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+'''
+Packed, compressed bundle of a volume's output pages.
+
+Rather than a loose HTML file per page (and a copy of the CSS) a volume's
+pages can be written to a single bundle, the same way abbyyindex splits the
+input - each file is a gzip member of its own, so the bundle is still a
+valid gzip file, and a table of contents gives the offset of each one:
+
+  oed-vol1_pages.gz     one gzip member per file
+  oed-vol1_pages.idx    table of contents - one line per file with its
+                        name, the offset & length of its gzip member, its
+                        uncompressed size and its MD5
+
+Reading a page is a seek, a read and a zlib.decompress.  Both files are
+only ever appended to: a file that's written again gets a new member and a
+new line in the table of contents, and the last line for a name wins.  A
+file which is written with the same contents as before isn't added again.
+The members which have been replaced are dead space until the bundle is
+compacted, which copies the live members to a new bundle as they are.
+
+Diffing two bundles only needs their tables of contents, since they have
+the MD5 of each file.
+
+Usage:
+    python bundle.py list output/oed-vol1_pages.gz
+    python bundle.py cat output/oed-vol1_pages.gz oed-vol1_p0026.html
+    python bundle.py extract output/oed-vol1_pages.gz outdir [name ...]
+    python bundle.py diff output/oed-vol1_pages.gz other/oed-vol1_pages.gz
+    python bundle.py pack output/oed-vol1_pages.gz output/*.html output/*.css
+    python bundle.py compact output/oed-vol1_pages.gz
+    python bundle.py serve output/oed-vol1_pages.gz [port]
+'''
+import hashlib
+import os
+import sys
+import threading
+import zlib
+
+VERSION = 1
+
+
+def indexfile(path):
+    base = path
+    if base.endswith('.gz'):
+        base = base[:-3]
+    return base + '.idx'
+
+
+class Bundle():
+    '''
+    A bundle opened for reading ('r') or appending ('a', which creates it
+    if need be).
+    '''
+
+    def __init__(self, path, mode='r'):
+        self.path = path
+        self.mode = mode
+        self.entries = {}
+        self.lock = threading.Lock()
+        if mode == 'a' and not os.path.exists(path):
+            open(path, 'wb').close()
+            with open(indexfile(path), 'w') as f:
+                f.write('#%d %s\n' % (VERSION, os.path.basename(path)))
+        with open(indexfile(path)) as f:
+            header = f.readline().split()
+            if not header or header[0] != '#%d' % VERSION:
+                raise ValueError('%s is not a version %d bundle' % (path, VERSION))
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) != 5:
+                    # partial line from an interrupted write
+                    continue
+                name, offset, length, size, digest = fields
+                self.entries[name] = (int(offset), int(length), int(size), digest)
+        self.f = open(path, 'r+b' if mode == 'a' else 'rb')
+        self.index = open(indexfile(path), 'a') if mode == 'a' else None
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def names(self):
+        return sorted(self.entries)
+
+    def digest(self, name):
+        return self.entries[name][3]
+
+    def size(self, name):
+        return self.entries[name][2]
+
+    def member(self, name):
+        '''
+        The compressed gzip member of a file
+        '''
+        offset, length, size, digest = self.entries[name]
+        with self.lock:
+            self.f.seek(offset)
+            return self.f.read(length)
+
+    def read(self, name):
+        return zlib.decompress(self.member(name), 16 + zlib.MAX_WBITS)
+
+    def add(self, name, data):
+        '''
+        Add or replace a file.  Returns False if it was already there with
+        the same contents.
+        '''
+        digest = hashlib.md5(data).hexdigest()
+        if name in self.entries and self.entries[name][3] == digest:
+            return False
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        self.append(name, compressor.compress(data) + compressor.flush(),
+                    len(data), digest)
+        return True
+
+    def copy(self, other, name):
+        '''
+        Add a file from another bundle without recompressing it
+        '''
+        if name in self.entries and self.entries[name][3] == other.digest(name):
+            return False
+        self.append(name, other.member(name), other.size(name), other.digest(name))
+        return True
+
+    def append(self, name, member, size, digest):
+        with self.lock:
+            self.f.seek(0, os.SEEK_END)
+            offset = self.f.tell()
+            self.f.write(member)
+            # the member has to be there before the index points at it
+            self.f.flush()
+            self.index.write('%s\t%d\t%d\t%d\t%s\n' % (name, offset, len(member),
+                                                       size, digest))
+            self.index.flush()
+            self.entries[name] = (offset, len(member), size, digest)
+
+    def waste(self):
+        '''
+        Number of bytes taken up by replaced members
+        '''
+        return (os.path.getsize(self.path)
+                - sum(length for offset, length, size, digest in self.entries.values()))
+
+    def close(self):
+        self.f.close()
+        if self.index:
+            self.index.close()
+
+
+def compact(path):
+    '''
+    Rewrite a bundle without its replaced members, in name order.  Returns
+    the number of bytes saved.
+    '''
+    before = os.path.getsize(path)
+    old = Bundle(path)
+    tmp = path + '.tmp'
+    for filename in (tmp, indexfile(tmp)):
+        if os.path.exists(filename):
+            os.remove(filename)
+    new = Bundle(tmp, 'a')
+    try:
+        for name in old.names():
+            new.copy(old, name)
+    finally:
+        old.close()
+        new.close()
+    os.rename(tmp, path)
+    os.rename(indexfile(tmp), indexfile(path))
+    return before - os.path.getsize(path)
+
+
+def diff(a, b):
+    '''
+    Compare two bundles by their tables of contents.  Returns lists of the
+    names only in a, only in b and in both but different.
+    '''
+    return ([name for name in a.names() if name not in b],
+            [name for name in b.names() if name not in a],
+            [name for name in a.names() if name in b and a.digest(name) != b.digest(name)])
+
+
+def serve(path, port):
+    '''
+    Serve the files of a bundle over HTTP
+    '''
+    import BaseHTTPServer
+    import mimetypes
+    from pageserver import PageServer
+
+    class BundleHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_GET(self):
+            name = self.path.split('?')[0].lstrip('/')
+            if name not in pages:
+                return self.send_error(404)
+            data = pages.read(name)
+            self.send_response(200)
+            self.send_header('Content-Type', mimetypes.guess_type(name)[0]
+                             or 'application/octet-stream')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    pages = Bundle(path)
+    server = PageServer(('localhost', port), BundleHandler)
+    print 'Serving %d files of %s on http://localhost:%d/' % (len(pages), path, port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pages.close()
+
+
+def main():
+    commands = ('list', 'cat', 'extract', 'diff', 'pack', 'compact', 'serve')
+    if len(sys.argv) < 3 or sys.argv[1] not in commands:
+        print __doc__
+        sys.exit(1)
+    command, path, args = sys.argv[1], sys.argv[2], sys.argv[3:]
+    if command == 'compact':
+        print 'Saved %d bytes' % compact(path)
+    elif command == 'serve':
+        serve(path, int(args[0]) if args else 8089)
+    elif command == 'pack':
+        pages = Bundle(path, 'a')
+        added = 0
+        for filename in args:
+            with open(filename, 'rb') as f:
+                added += pages.add(os.path.basename(filename), f.read())
+        pages.close()
+        print 'Added %d of %d files' % (added, len(args))
+    elif command == 'diff':
+        a, b = Bundle(path), Bundle(args[0])
+        removed, added, changed = diff(a, b)
+        for prefix, names in (('-', removed), ('+', added), ('M', changed)):
+            for name in names:
+                print '%s %s' % (prefix, name)
+    else:
+        pages = Bundle(path)
+        if command == 'list':
+            for name in pages.names():
+                print '%s\t%d\t%s' % (name, pages.size(name), pages.digest(name))
+        elif command == 'cat':
+            for name in args:
+                sys.stdout.write(pages.read(name))
+        else:
+            outdir = args[0] if args else '.'
+            if not os.path.exists(outdir):
+                os.makedirs(outdir)
+            for name in args[1:] or pages.names():
+                with open(os.path.join(outdir, name), 'wb') as f:
+                    f.write(pages.read(name))
+        pages.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,287 @@
+'''
+Columnar binary store of the OCR characters of an ABBYY volume.
+
+Going back through the gzip, the XML parse and the transform every time we
+want to try something new with the page geometry is slow.  This converts
+the volume once into flat binary columns, one file per field, which are
+memory-mapped as numpy arrays so they can be sliced per page without
+copying or parsing anything:
+
+  oed01arch_abbyy.chars/
+    VERSION                    version & signature of the source volume
+    chars.code  ...            one entry per character (see CHARS)
+    lines.left  ...            one entry per line (see LINES)
+    blocks.left ...            one entry per text block (see BLOCKS)
+    pages.chars ...            one entry per page plus one (see PAGES), the
+                               first char/line/block of each page
+
+Characters are in document order, so the characters of a line, the lines
+of a block and everything on a page are contiguous ranges.  Lines know
+their paragraph & block and characters know their line, so the paragraph
+and block of a character are lines.par[chars.line] & lines.block[chars.line].
+
+Usage:
+    python charstore.py input/oed01arch_abbyy.gz [page[-page]]
+'''
+import os
+import sys
+import time
+
+import numpy as np
+import lxml.etree as ET
+
+import abbyyindex
+import layout
+import oedabby
+
+VERSION = 1
+
+# character formatting & recognition flags
+BOLD = 1
+ITALIC = 2
+SMALLCAPS = 4
+SUPERSCRIPT = 8
+SUBSCRIPT = 16
+DICTIONARY = 32   # wordFromDictionary
+WORDSTART = 64
+SUSPICIOUS = 128
+FORMATTING = (('bold', BOLD), ('italic', ITALIC), ('smallcaps', SMALLCAPS),
+              ('superscript', SUPERSCRIPT), ('subscript', SUBSCRIPT))
+CHARFLAGS = (('wordFromDictionary', DICTIONARY), ('wordStart', WORDSTART),
+             ('suspicious', SUSPICIOUS))
+NOCONFIDENCE = 255
+
+CHARS = (('code', '<u4'),        # unicode codepoint
+         ('confidence', 'u1'),   # charConfidence 0-100, 255 if missing
+         ('flags', 'u1'),
+         ('size', 'u1'),         # font size in half points
+         ('left', '<i2'), ('top', '<i2'), ('right', '<i2'), ('bottom', '<i2'),
+         ('line', '<u4'))
+LINES = (('left', '<i2'), ('top', '<i2'), ('right', '<i2'), ('bottom', '<i2'),
+         ('baseline', '<i2'),
+         ('par', '<u4'), ('block', '<u4'), ('chars', '<u4'))  # first char
+BLOCKS = (('left', '<i2'), ('top', '<i2'), ('right', '<i2'), ('bottom', '<i2'),
+          ('lines', '<u4'))  # first line
+PAGES = (('chars', '<u4'), ('lines', '<u4'), ('blocks', '<u4'),
+         ('width', '<i2'), ('height', '<i2'))
+TABLES = (('chars', CHARS), ('lines', LINES), ('blocks', BLOCKS),
+          ('pages', PAGES))
+
+
+def storedir(localfile):
+    base = localfile
+    if base.endswith('.gz'):
+        base = base[:-3]
+    return base + '.chars'
+
+
+def isstored(localfile):
+    '''
+    Returns True if there's an up to date store for the volume
+    '''
+    path = os.path.join(storedir(localfile), 'VERSION')
+    if not os.path.exists(path):
+        return False
+    with open(path) as f:
+        return f.read().strip() == '#%d %s' % (VERSION,
+                                               abbyyindex.signature(localfile))
+
+
+def _int(value, default=0):
+    return int(float(value)) if value else default
+
+
+def pagearrays(page, firstchar, firstline, firstblock, firstpar):
+    '''
+    Convert a <page> element into lists of rows for each table.  Ids
+    are numbered on from the given first char, line, block & paragraph.
+    '''
+    chars = []
+    lines = []
+    blocks = []
+    par = firstpar
+    for block in page.iter('block'):
+        blocklines = list(block.iter('line'))
+        if not blocklines:
+            continue
+        blocks.append((_int(block.get('l')), _int(block.get('t')),
+                       _int(block.get('r')), _int(block.get('b')),
+                       firstline + len(lines)))
+        blockid = firstblock + len(blocks) - 1
+        for p in block.iter('par'):
+            for line in p.iter('line'):
+                lineid = firstline + len(lines)
+                lines.append((_int(line.get('l')), _int(line.get('t')),
+                              _int(line.get('r')), _int(line.get('b')),
+                              _int(line.get('baseline')), par, blockid,
+                              firstchar + len(chars)))
+                for fmt in line.iter('formatting'):
+                    fmtflags = 0
+                    for name, flag in FORMATTING:
+                        if fmt.get(name) == 'true':
+                            fmtflags |= flag
+                    size = int(round(float(fmt.get('fs') or 0) * 2))
+                    for ch in fmt.iter('charParams'):
+                        flags = fmtflags
+                        for name, flag in CHARFLAGS:
+                            if ch.get(name) in ('true', '1'):
+                                flags |= flag
+                        text = ch.text or u''
+                        chars.append((ord(text[0]) if text else 0,
+                                      _int(ch.get('charConfidence'), NOCONFIDENCE),
+                                      flags, size,
+                                      _int(ch.get('l')), _int(ch.get('t')),
+                                      _int(ch.get('r')), _int(ch.get('b')),
+                                      lineid))
+            par += 1
+    return chars, lines, blocks, par
+
+
+def _append(files, fields, rows):
+    '''
+    Append rows to the column files of a table
+    '''
+    if not rows:
+        return
+    columns = zip(*rows)
+    for (name, dtype), values in zip(fields, columns):
+        np.array(values, dtype=dtype).tofile(files[name])
+
+
+def buildstore(localfile):
+    '''
+    Convert a volume into a character store, one page at a time.
+    Returns the number of pages.
+    '''
+    if not abbyyindex.isindexed(localfile):
+        abbyyindex.buildindex(localfile)
+    path = storedir(localfile)
+    if not os.path.exists(path):
+        os.makedirs(path)
+    versionfile = os.path.join(path, 'VERSION')
+    if os.path.exists(versionfile):
+        os.remove(versionfile)
+
+    files = {}
+    for table, fields in TABLES:
+        files[table] = dict((name, open(os.path.join(path, '%s.%s' % (table, name)), 'wb'))
+                            for name, dtype in fields)
+    index = abbyyindex.PageIndex(localfile)
+    nchars = nlines = nblocks = npars = 0
+    try:
+        for pagenum in range(1, index.lastpage + 1):
+            page = ET.fromstring(index.page(pagenum))
+            if page.tag[0] == '{':
+                oedabby.stripnamespace(page)
+            chars, lines, blocks, npars = pagearrays(page, nchars, nlines,
+                                                     nblocks, npars)
+            _append(files['pages'], PAGES,
+                    [(nchars, nlines, nblocks, _int(page.get('width')),
+                      _int(page.get('height')))])
+            _append(files['chars'], CHARS, chars)
+            _append(files['lines'], LINES, lines)
+            _append(files['blocks'], BLOCKS, blocks)
+            nchars += len(chars)
+            nlines += len(lines)
+            nblocks += len(blocks)
+        # sentinel so that page n runs from pages[n - 1] to pages[n]
+        _append(files['pages'], PAGES, [(nchars, nlines, nblocks, 0, 0)])
+    finally:
+        index.close()
+        for table in files.values():
+            for f in table.values():
+                f.close()
+    with open(versionfile, 'w') as f:
+        f.write('#%d %s\n' % (VERSION, abbyyindex.signature(localfile)))
+    return index.lastpage
+
+
+class Table():
+    '''
+    Set of memory-mapped columns, accessed as attributes
+    '''
+
+    def __init__(self, columns):
+        self.__dict__.update(columns)
+        self.names = sorted(columns)
+
+    def __len__(self):
+        return len(getattr(self, self.names[0])) if self.names else 0
+
+    def slice(self, start, end):
+        '''
+        Zero-copy view of a range of rows
+        '''
+        return Table(dict((name, getattr(self, name)[start:end])
+                          for name in self.names))
+
+
+class CharStore():
+    '''
+    Memory-mapped character store for a volume.
+    '''
+
+    def __init__(self, localfile):
+        path = storedir(localfile)
+        for table, fields in TABLES:
+            columns = {}
+            for name, dtype in fields:
+                filename = os.path.join(path, '%s.%s' % (table, name))
+                if os.path.getsize(filename):
+                    columns[name] = np.memmap(filename, dtype=dtype, mode='r')
+                else:
+                    columns[name] = np.zeros(0, dtype=dtype)
+            setattr(self, table, Table(columns))
+        self.lastpage = len(self.pages) - 1
+
+    def page(self, pagenum):
+        '''
+        Return (chars, lines, blocks) tables for a page as views into the
+        store.  Line & block numbers are still volume wide.
+        '''
+        pages = self.pages
+        i = pagenum - 1
+        return (self.chars.slice(pages.chars[i], pages.chars[i + 1]),
+                self.lines.slice(pages.lines[i], pages.lines[i + 1]),
+                self.blocks.slice(pages.blocks[i], pages.blocks[i + 1]))
+
+    def text(self, chars):
+        return u''.join(unichr(c) for c in chars.code if c)
+
+
+def findcolumns(store, start, limit):
+    '''
+    Column gutters for a range of pages straight from the line table, in
+    one batch.  Returns a list of (pagenum, gutters).
+    '''
+    pagenums = range(max(start, 1), min(limit, store.lastpage) + 1)
+    lefts = [store.page(pagenum)[1].left for pagenum in pagenums]
+    return zip(pagenums, layout.findgutters(lefts))
+
+
+def main():
+    if len(sys.argv) < 2:
+        print __doc__
+        sys.exit(1)
+    localfile = sys.argv[1]
+    if not isstored(localfile):
+        t = time.time()
+        print >>sys.stderr, 'Converting %s' % localfile
+        pages = buildstore(localfile)
+        print >>sys.stderr, 'Stored %d pages in %.1fs' % (pages, time.time() - t)
+    store = CharStore(localfile)
+    start, limit = 1, store.lastpage
+    if len(sys.argv) > 2:
+        first, _, last = sys.argv[2].partition('-')
+        start, limit = int(first), int(last or first)
+    t = time.time()
+    results = findcolumns(store, start, limit)
+    elapsed = time.time() - t
+    for pagenum, gutters in results:
+        chars, lines, blocks = store.page(pagenum)
+        print '%d\t%d chars\t%d lines\t%d blocks\t%s' % (
+            pagenum, len(chars), len(lines), len(blocks), gutters)
+    print >>sys.stderr, 'Found columns for %d pages in %.3fs' % (len(results), elapsed)
+
+if __name__ == '__main__':
+    main()
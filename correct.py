@@ -0,0 +1,420 @@
+# -*- coding: utf-8 -*-
+'''
+Lexicon driven correction of the OCR on post-processed pages.
+
+FineReader tells us which characters it wasn't sure of, and the stylesheet
+marks those that weren't in its own dictionary as low_confidence or
+very_low_confidence, so rather than spell checking everything we only look
+at the words which contain one of them.  Each is looked up in a lexicon
+compiled from the dictionary itself - the headwords, and the authors &
+titles of the quotations - with a bounded edit distance search of a trie,
+and replaced if there's a single best match.  The lexicon searched depends
+on the typography: bold words are checked against the headwords, small caps
+against the authors and italics against the titles.  Words in plain text are
+left alone, since the lexicon has none of the ordinary words of the
+definitions and they'd be "corrected" to the nearest headword.
+
+Two fixes are made whatever the confidence, on the first line of each
+paragraph: an unbolded 't' or 'II' / 'I!' / '||' in front of a bold headword
+is really a dagger or double bar, and an apostrophe inside the headword is
+really the stress mark.
+
+Every substitution is returned as (anchor, old, new) so the pipeline can
+record them in the page metrics.  The lexicon is stored as tab separated
+text sorted by word:
+
+  kind    word    count
+
+where kind is headword, author or title.
+
+Usage:
+    python correct.py compile output/oed-lexicon.txt FILE [FILE ...]
+    python correct.py apply output/oed-lexicon.txt output/oed-vol1_p*.html
+
+compile reads headword tables (output/*_headwords.txt), entry files
+(output/*_entries.jsonl) and plain word lists (one word per line, added as
+headwords).  apply corrects pages in place and prints the substitutions.
+'''
+import json
+import os
+import re
+import sys
+
+import lxml.etree as ET
+
+from geometry import columnblocks
+import headwords
+import search
+
+KINDS = ('headword', 'author', 'title')
+# the innermost style of a word picks the lexicon
+STYLEKINDS = {'b': ('headword',), 's': ('author',), 'i': ('title',)}
+LOWCLASSES = ('low_confidence', 'very_low_confidence')
+MINLENGTH = 4    # shorter words have too many neighbours to correct
+LONGWORD = 8     # words this long can be two edits away
+MINCOUNT = 2     # authors & titles seen fewer times than this are likely OCR errors
+TOKEN = re.compile(r'^(\W*)(.*?)(\W*)$', re.U)
+WORDS = re.compile(r'\S+', re.U)
+LEADINGMARK = re.compile(u'^(\\s*)(t|II|I!|\\|\\|)(?=\\s*$)')
+DAGGER = u'†'
+DOUBLEBAR = u'‖'
+STRESSMARK = u'·'
+APOSTROPHES = re.compile(u"(?<=\\w)['`‘’](?=\\w)", re.U)
+
+
+class Trie():
+    '''
+    Character trie of lower case words, with the number of times each was
+    seen.  Nodes are dicts of character -> child, and a node which ends a
+    word has the count under the key None.
+    '''
+
+    def __init__(self):
+        self.root = {}
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, word):
+        node = self.root
+        for ch in word:
+            node = node.get(ch)
+            if node is None:
+                return False
+        return None in node
+
+    def add(self, word, count=1):
+        node = self.root
+        for ch in word:
+            node = node.setdefault(ch, {})
+        if None not in node:
+            self.size += 1
+        node[None] = node.get(None, 0) + count
+
+    def search(self, word, maxdist):
+        '''
+        Return a list of (distance, word, count) for the words within
+        maxdist edits (insertions, deletions or substitutions) of word.
+        Each trie node extends one row of the edit distance table, and
+        branches are abandoned once every entry in the row is over maxdist.
+        '''
+        results = []
+        first = range(len(word) + 1)
+        for ch, child in self.root.items():
+            if ch is not None:
+                self._search(child, ch, ch, word, first, maxdist, results)
+        return results
+
+    def _search(self, node, ch, prefix, word, previous, maxdist, results):
+        row = [previous[0] + 1]
+        for i in range(1, len(word) + 1):
+            row.append(min(row[i - 1] + 1, previous[i] + 1,
+                           previous[i - 1] + (word[i - 1] != ch)))
+        if row[-1] <= maxdist and None in node:
+            results.append((row[-1], prefix, node[None]))
+        if min(row) <= maxdist:
+            for nextch, child in node.items():
+                if nextch is not None:
+                    self._search(child, nextch, prefix + nextch, word, row,
+                                 maxdist, results)
+
+
+class Lexicon():
+    '''
+    A trie of words for each kind
+    '''
+
+    def __init__(self):
+        self.tries = dict((kind, Trie()) for kind in KINDS)
+
+    def __len__(self):
+        return sum(len(trie) for trie in self.tries.values())
+
+    def add(self, kind, word, count=1):
+        word = headwords.STRESS.sub(u'', word).lower()
+        if len(word) >= MINLENGTH and word.replace(u'-', u'').isalpha():
+            self.tries[kind].add(word, count)
+
+    def known(self, word, kinds):
+        return any(word in self.tries[kind] for kind in kinds)
+
+    def best(self, word, kinds):
+        '''
+        Return the closest word of the given kinds, or None if there isn't a
+        single best one.  Ties on distance go to the most frequent word.
+        '''
+        maxdist = 2 if len(word) >= LONGWORD else 1
+        candidates = {}
+        for kind in kinds:
+            for distance, candidate, count in self.tries[kind].search(word, maxdist):
+                best = candidates.get(candidate, (maxdist + 1, 0))
+                candidates[candidate] = min(best, (distance, -count))
+        if not candidates:
+            return None
+        ranked = sorted((score, candidate) for candidate, score in candidates.items())
+        if len(ranked) > 1 and ranked[0][0] == ranked[1][0]:
+            return None
+        return ranked[0][1]
+
+    def save(self, path):
+        rows = []
+        for kind, trie in self.tries.items():
+            stack = [(trie.root, u'')]
+            while stack:
+                node, prefix = stack.pop()
+                for ch, child in node.items():
+                    if ch is None:
+                        rows.append((prefix, kind, child))
+                    else:
+                        stack.append((child, prefix + ch))
+        with open(path + '.tmp', 'w') as f:
+            for word, kind, count in sorted(rows):
+                f.write('%s\t%s\t%d\n' % (kind, word.encode('utf-8'), count))
+        os.rename(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+        lexicon = cls()
+        with open(path) as f:
+            for line in f:
+                kind, word, count = line.rstrip('\n').split('\t')
+                lexicon.tries[kind].add(word.decode('utf-8'), int(count))
+        return lexicon
+
+
+def buildlexicon(paths):
+    '''
+    Build a lexicon from headword tables, entry files and word lists
+    '''
+    lexicon = Lexicon()
+    names = {'author': {}, 'title': {}}
+    for path in paths:
+        with open(path) as f:
+            if path.endswith('.jsonl'):
+                for line in f:
+                    entry = json.loads(line)
+                    for sense in entry['senses']:
+                        for quote in sense['quotations']:
+                            for kind in names:
+                                for word in (quote[kind] or u'').split():
+                                    word = word.strip(u'.,;:()')
+                                    names[kind][word] = names[kind].get(word, 0) + 1
+            else:
+                for line in f:
+                    fields = line.rstrip('\n').split('\t')
+                    word = fields[1] if len(fields) == 3 else fields[0]
+                    lexicon.add('headword', word.decode('utf-8'))
+    for kind, counts in names.items():
+        for word, count in counts.items():
+            if count >= MINCOUNT:
+                lexicon.add(kind, word, count)
+    return lexicon
+
+
+def segments(el, style='', low=False):
+    '''
+    Generator yielding (element, attribute, style, low) for each piece of
+    text in an element in document order, where attribute is 'text' or
+    'tail', style is made up of b, i & s as in entries.styledruns and low
+    is True for text in a low confidence span.
+    '''
+    if el.tag == 'b':
+        style += 'b'
+    elif el.tag == 'em':
+        style += 'i'
+    elif 'small-caps' in el.get('style', ''):
+        style += 's'
+    low = low or el.get('class') in LOWCLASSES
+    if el.text:
+        yield el, 'text', style, low
+    for child in el:
+        for segment in segments(child, style, low):
+            yield segment
+        if child.tail:
+            yield child, 'tail', style, low
+
+
+class Line():
+    '''
+    The text of a line with the pieces it's made up of, which lets us edit
+    a range of the line's text in place in the DOM.
+    '''
+
+    def __init__(self, el):
+        self.segments = [[0, element, attr, style, low]
+                         for element, attr, style, low in segments(el)]
+        self.reindex()
+
+    def reindex(self):
+        offset = 0
+        for segment in self.segments:
+            segment[0] = offset
+            offset += len(getattr(segment[1], segment[2]))
+        self.text = u''.join(getattr(s[1], s[2]) for s in self.segments)
+
+    def segment(self, offset):
+        '''
+        The segment containing a character of the line
+        '''
+        found = None
+        for segment in self.segments:
+            if segment[0] > offset:
+                break
+            found = segment
+        return found
+
+    def overlapping(self, start, end):
+        return [s for s in self.segments
+                if s[0] < end and s[0] + len(getattr(s[1], s[2])) > start]
+
+    def replace(self, start, end, new):
+        '''
+        Replace the line's text from start to end.  The new text goes where
+        the old text started and the rest of the old text is removed from
+        any other pieces it ran over.
+        '''
+        # an insertion goes at the end of the piece before it
+        pieces = self.overlapping(start if end > start else start - 1, end)
+        for i, (offset, element, attr, style, low) in enumerate(pieces):
+            text = getattr(element, attr)
+            a, b = max(start - offset, 0), min(end - offset, len(text))
+            setattr(element, attr, text[:a] + (new if i == 0 else u'') + text[b:])
+        self.reindex()
+
+
+def matchcase(word, original):
+    if original.isupper() and len(original) > 1:
+        return word.upper()
+    if original[:1].isupper():
+        return word[:1].upper() + word[1:]
+    return word
+
+
+class Corrector():
+    '''
+    Corrects pages against a lexicon, remembering what it decided for each
+    word since the same misreadings turn up again and again.
+    '''
+
+    def __init__(self, lexicon):
+        self.lexicon = lexicon
+        self.memo = {}
+
+    def lookup(self, word, kinds):
+        key = (word, kinds)
+        if key not in self.memo:
+            lower = word.lower()
+            if self.lexicon.known(lower, kinds):
+                self.memo[key] = None
+            else:
+                self.memo[key] = self.lexicon.best(lower, kinds)
+        return self.memo[key]
+
+    def fixheadword(self, line, corrections, anchor):
+        '''
+        Dagger & double bar before a headword and stress marks in it
+        '''
+        bold = [s for s in line.segments if 'b' in s[3] and getattr(s[1], s[2]).strip()]
+        if not bold:
+            return
+        text = getattr(bold[0][1], bold[0][2])
+        start = bold[0][0] + len(text) - len(text.lstrip())
+        if not line.text[start].isupper():
+            return
+        end = WORDS.match(line.text, start).end()
+        for m in reversed(list(APOSTROPHES.finditer(line.text, start, end))):
+            line.replace(m.start(), m.end(), STRESSMARK)
+            corrections.append((anchor, m.group(), STRESSMARK))
+        # everything in front of the first bold text isn't bold
+        m = LEADINGMARK.match(line.text[:start])
+        if m:
+            mark = DAGGER if m.group(2) == u't' else DOUBLEBAR
+            line.replace(m.start(2), m.end(2), mark)
+            corrections.append((anchor, m.group(2), mark))
+
+    def fixwords(self, line, corrections, anchor):
+        '''
+        Lexicon lookups for the styled words with low confidence characters
+        '''
+        for m in reversed(list(WORDS.finditer(line.text))):
+            segments = line.overlapping(m.start(), m.end())
+            if not any(s[4] for s in segments):
+                continue
+            prefix, word, suffix = TOKEN.match(m.group()).groups()
+            if (len(word) < MINLENGTH or not word.isalnum()
+                    or sum(not ch.isalpha() for ch in word) > 1
+                    or not word[0].isalpha() or not word[-1].isalpha()):
+                continue
+            style = line.segment(m.start() + len(prefix))[3]
+            kinds = STYLEKINDS.get(style[-1:])
+            if not kinds:
+                continue
+            best = self.lookup(word, kinds)
+            if best:
+                new = matchcase(best, word)
+                # only replace what differs, which usually leaves the edit
+                # inside the low confidence span
+                same = 0
+                while same < min(len(word), len(new)) and word[same] == new[same]:
+                    same += 1
+                tail = 0
+                while (tail < min(len(word), len(new)) - same
+                       and word[-1 - tail] == new[-1 - tail]):
+                    tail += 1
+                start = m.start() + len(prefix)
+                line.replace(start + same, start + len(word) - tail,
+                             new[same:len(new) - tail])
+                corrections.append((anchor, word, new))
+
+    def correct(self, dom):
+        '''
+        Correct a post-processed page in place.  Returns a list of
+        (anchor, old, new) for the substitutions made, in page order.
+        '''
+        corrections = []
+        for col, block in enumerate(columnblocks(dom), 1):
+            lines = block.findall('p/' + search.LINEXPATH)
+            starts = set(par.find(search.LINEXPATH) for par in block.iterfind('p'))
+            for i, el in enumerate(lines):
+                if i == 0 and headwords.isheader(el, block):
+                    continue
+                anchor = search.anchor(col, i + 1)
+                line = Line(el)
+                # the marks first, so that a dagger isn't taken as part of
+                # the headword
+                found = []
+                if el in starts:
+                    self.fixheadword(line, found, anchor)
+                corrections.extend(reversed(found))
+                found = []
+                self.fixwords(line, found, anchor)
+                corrections.extend(reversed(found))
+        return corrections
+
+
+def main():
+    if len(sys.argv) < 4 or sys.argv[1] not in ('compile', 'apply'):
+        print __doc__
+        sys.exit(1)
+    command, path, filenames = sys.argv[1], sys.argv[2], sys.argv[3:]
+    if command == 'compile':
+        lexicon = buildlexicon(filenames)
+        lexicon.save(path)
+        print >>sys.stderr, 'Wrote %d words to %s' % (len(lexicon), path)
+        return
+    corrector = Corrector(Lexicon.load(path))
+    total = 0
+    for filename in filenames:
+        dom = ET.parse(filename)
+        corrections = corrector.correct(dom.getroot())
+        for anchor, old, new in corrections:
+            print ('%s#%s\t%s\t%s' % (os.path.basename(filename), anchor, old,
+                                      new)).encode('utf-8')
+        if corrections:
+            dom.write(filename, pretty_print=True)
+        total += len(corrections)
+    print >>sys.stderr, 'Made %d corrections in %d pages' % (total, len(filenames))
+
+if __name__ == '__main__':
+    main()
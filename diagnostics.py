@@ -0,0 +1,215 @@
+'''
+Diagnostic plots of the page segmentation.
+
+For each page we draw the text blocks as FineReader segmented them, the
+column blocks we ended up with and the column gutters, next to the
+histogram of line starts & ends that the gutters were found from.  The
+plots can be shown interactively (which is what DEBUG does in oedabby) or,
+for a whole range of pages, rendered headless to PNGs in parallel along
+with a contact sheet which puts the pages that were flagged as broken first.
+
+matplotlib is slow to import, so it's only imported when a plot is drawn.
+
+Usage:
+    python diagnostics.py [-v volume] [-p N[-M]] [-j jobs] [-o outdir]
+'''
+import multiprocessing
+import optparse
+import os
+import sys
+
+import lxml.etree as ET
+import numpy as np
+
+import abbyyindex
+from geometry import PageGeometry, columnblocks, parsebbox
+import metrics
+import oedabby
+import volumes
+
+OUTDIR = 'output/diagnostics'
+PAGESIZE = (2700, 3600)
+DPI = 60
+THUMBWIDTH = 300
+
+
+def plotblocks(ax, boxes, gutters=None, final=()):
+    '''
+    Draw the original blocks as translucent rectangles, the final blocks
+    as outlines and the gutters as dotted lines, in page coordinates.
+    '''
+    from matplotlib.collections import PatchCollection
+    import matplotlib.cm as cm
+    import matplotlib.patches as mpatches
+
+    ax.axis([0, PAGESIZE[0], PAGESIZE[1], 0])
+    patches = [mpatches.Rectangle([bb.left, bb.top], bb.width(), bb.height(),
+                                  ec='none') for bb in boxes]
+    collection = PatchCollection(patches, cmap=cm.hsv, alpha=0.3)
+    collection.set_array(np.linspace(0, 1, len(patches)))
+    ax.add_collection(collection)
+    for bb in final:
+        ax.add_patch(mpatches.Rectangle([bb.left, bb.top], bb.width(), bb.height(),
+                                        fill=False, ec='black'))
+    for gutter in gutters or ():
+        ax.axvline(gutter, color='red', linestyle='dotted')
+
+
+def plothistogram(ax, lefts, rights, gutters=None):
+    '''
+    Histogram of line starts (blue) and ends (green) with the gutters in red
+    '''
+    ax.axis([0, PAGESIZE[0], 0, 45])
+    xvals, counts = np.unique(lefts, return_counts=True)
+    ax.bar(xvals, counts, 10)
+    xvals, counts = np.unique(rights, return_counts=True)
+    ax.bar(xvals, counts, 10, color='green')
+    if gutters:
+        ax.bar(gutters, [40] * len(gutters), 10, color='red', linestyle='dotted')
+
+
+def show(plot, *args):
+    '''
+    Draw a plot in a window and wait for it to be closed
+    '''
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots()
+    plot(ax, *args)
+    plt.subplots_adjust(left=0, right=1, bottom=0, top=1)
+    plt.show(block=True)
+
+
+def pngfile(outdir, volume, pagenum):
+    return os.path.join(outdir, os.path.basename(volume.htmlfile(pagenum))
+                        .replace('.html', '.png'))
+
+
+# Per-process state for pool workers
+_transform = None
+_index = None
+
+
+def _initworker(engine, localfile):
+    global _transform, _index
+    _transform = oedabby.maketransform(engine)
+    _index = abbyyindex.PageIndex(localfile)
+
+
+def renderpage(task):
+    '''
+    Process a page on its own and render its diagnostics to a PNG without
+    a display.  Returns the page's metrics.
+    '''
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    volume, pagenum, outdir = task
+    pagemetrics = metrics.PageMetrics(pagenum)
+    dom = _transform(ET.fromstring(_index.page(pagenum)))
+    geom = PageGeometry(dom)
+    boxes = [geom.bbox(block) for block in geom.blocks]
+    coords = geom.linearray()
+    gutters = oedabby.postprocess(dom, pagemetrics)
+    final = [parsebbox(block.get('title')) for block in columnblocks(dom)]
+
+    fig = Figure(figsize=(12, 8))
+    FigureCanvasAgg(fig)
+    plotblocks(fig.add_subplot(1, 2, 1), boxes, gutters, final)
+    if len(coords):
+        plothistogram(fig.add_subplot(1, 2, 2), coords[:, 0], coords[:, 2], gutters)
+    fig.suptitle('%s p%d  %d blocks  %s' % (volume.name, pagenum, len(boxes),
+                                           ' '.join(pagemetrics['flags'])))
+    fig.savefig(pngfile(outdir, volume, pagenum), dpi=DPI)
+    return pagemetrics
+
+
+def contactsheet(outdir, volume, records):
+    '''
+    Write an HTML page of thumbnails of the pages, most broken first
+    '''
+    flagged = sorted((r for r in records if r['flags']), key=metrics.badness,
+                     reverse=True)
+    rest = [r for r in records if not r['flags']]
+    path = os.path.join(outdir, '%s_contact.html' % volume.name)
+    html = ET.Element('html')
+    head = ET.SubElement(html, 'head')
+    ET.SubElement(head, 'title').text = '%s diagnostics' % volume.name
+    ET.SubElement(head, 'style').text = (
+        'div.page { display: inline-block; margin: 4px; font: 10px sans-serif; '
+        'vertical-align: top; width: %dpx } div.broken { background: #fcc }'
+        % THUMBWIDTH)
+    body = ET.SubElement(html, 'body')
+    ET.SubElement(body, 'h1').text = '%s: %d of %d pages flagged' % (
+        volume.name, len(flagged), len(records))
+    for record in flagged + rest:
+        pagenum = record['page']
+        div = ET.SubElement(body, 'div')
+        div.set('class', 'page broken' if record['flags'] else 'page')
+        link = ET.SubElement(div, 'a', href=os.path.relpath(
+            volume.htmlfile(pagenum), outdir))
+        ET.SubElement(link, 'img', src=os.path.basename(
+            pngfile(outdir, volume, pagenum)), width=str(THUMBWIDTH))
+        ET.SubElement(div, 'br').tail = 'p%d %s' % (pagenum, ' '.join(record['flags']))
+    with open(path, 'w') as f:
+        f.write(ET.tostring(html, pretty_print=True, method='html'))
+    return path
+
+
+def renderpages(volume, start, limit, jobs=None, engine='xslt', outdir=OUTDIR):
+    '''
+    Render the diagnostics for a range of pages of a volume in a pool of
+    worker processes and write the contact sheet.  Returns its path.
+    '''
+    if not abbyyindex.isindexed(volume.localfile):
+        print 'Indexing %s' % volume.localfile
+        abbyyindex.buildindex(volume.localfile)
+    index = abbyyindex.PageIndex(volume.localfile)
+    pagenums = range(max(start, 1), min(limit, index.lastpage) + 1)
+    index.close()
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    pool = multiprocessing.Pool(jobs or multiprocessing.cpu_count(), _initworker,
+                                (engine, volume.localfile))
+    records = []
+    try:
+        for record in pool.imap(renderpage, [(volume, pagenum, outdir)
+                                             for pagenum in pagenums]):
+            print 'Rendered page %d %s' % (record['page'], ' '.join(record['flags']))
+            records.append(record)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return contactsheet(outdir, volume, records)
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('-v', '--volume', default='1',
+                      help='volumes to render [default: %default]')
+    parser.add_option('-p', '--pages', metavar='N[-M]',
+                      help='page or range of pages [default: all of the dictionary]')
+    parser.add_option('-j', '--jobs', type='int', default=None,
+                      help='number of worker processes [default: one per core]')
+    parser.add_option('-e', '--engine', type='choice', choices=['xslt', 'native'],
+                      default='xslt', help='hOCR transform [default: %default]')
+    parser.add_option('-o', '--outdir', default=OUTDIR,
+                      help='directory for the PNGs & contact sheet [default: %default]')
+    options, args = parser.parse_args()
+    try:
+        vols = volumes.lookup(options.volume)
+    except ValueError as e:
+        parser.error(str(e))
+    for volume in vols:
+        start, limit = volume.start, volume.limit or sys.maxint
+        if options.pages:
+            first, _, last = options.pages.partition('-')
+            start = int(first)
+            limit = int(last or first)
+        print 'Wrote %s' % renderpages(volume, start, limit, options.jobs,
+                                       options.engine, options.outdir)
+
+if __name__ == '__main__':
+    main()
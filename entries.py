@@ -0,0 +1,490 @@
+# -*- coding: utf-8 -*-
+'''
+Assemble dictionary entries from the post-processed pages.
+
+Pages are consumed in order and entries are carried across column and page
+boundaries, so one that starts at the bottom of the last column of a page
+is completed from the top of the next.  The running head (first word, page
+number, last word) and signature marks at the foot of the columns are
+dropped and words hyphenated across lines are rejoined.  Each entry is
+written out as soon as the next one starts as a JSON record:
+
+  {"headword": "Abandon", "obsolete": false, "alien": false,
+   "pronunciation": "ăbæ·ndən", "pos": "v.", "etymology": "a. F. abandoner",
+   "senses": [{"number": "1", "definition": "To give up ...",
+               "quotations": [{"year": "1375", "author": "Barbour",
+                               "title": "Bruce", "text": "..."}]}],
+   "page": 33, "col": 2, "anchor": "line_2_41", "endpage": 33}
+
+The structure is recovered from the typography described on pp xix-xxiii:
+the main word is bold, the pronunciation follows in parentheses, the part of
+speech is in italics, the etymology in square brackets, senses are numbered
+with bold arabic numerals and each quotation starts with a bold year, the
+author in small caps and the title in italics.
+
+Only the entry being assembled is held in memory.  After each page the
+output offset and the partial entry are appended to a checkpoint file, so
+assembly can restart from any page.  An entry which starts part way through
+(eg at the first page processed) is marked "continued": true.
+
+Usage:
+    python entries.py output/oed-vol1_entries.jsonl output/oed-vol1_p*.html
+'''
+import json
+import os
+import re
+import sys
+
+import lxml.etree as ET
+
+from geometry import columnblocks
+import headwords
+
+LINEXPATH = "span[@class='ocr_line']"
+SIGNATURE = re.compile(r'^(VOL\.?\s*I+\.?|\d+(-\d+)?|[IVX]+)$')
+SENSE = re.compile(r'^\s*(\d{1,2})\s*\.?\s*$')
+YEAR = re.compile(r'^\s*([ac]\.?\s*)?(\d{3,4})\s*$')
+POS = re.compile(r'^\s*(sb|v|a|adj|adv|prep|conj|int|pron|pple|ppl\. a|vbl\. sb|'
+                 r'pa\. pple|pa\. t|sb\. pl|quasi-sb|phr)\.')
+PRONUNCIATION = re.compile(r'^\s*,?\s*\(([^)]*)\)')
+ETYMOLOGY = re.compile(r'\[([^\]]*)\]')
+MAXLINES = 5000  # never hold more than this many lines of one entry
+
+
+def styledruns(el, style=''):
+    '''
+    Generator yielding (text, style) for the text of an element, where
+    style is made up of b (bold), i (italic) and s (small caps).
+    '''
+    if el.tag == 'b':
+        style += 'b'
+    elif el.tag == 'em':
+        style += 'i'
+    elif 'small-caps' in el.get('style', ''):
+        style += 's'
+    if el.text:
+        yield el.text, style
+    for child in el:
+        for run in styledruns(child, style):
+            yield run
+        if child.tail:
+            yield child.tail, style
+
+
+def bodylines(dom):
+    '''
+    Generator yielding (col, first, line) for the lines of the page text in
+    reading order, where first is True for the first line of a paragraph.
+    The column header and signature marks are skipped.
+    '''
+    for col, block in enumerate(columnblocks(dom), 1):
+        pars = [par.findall(LINEXPATH) for par in block.iterfind('p')]
+        pars = [lines for lines in pars if lines]
+        if pars and headwords.isheader(pars[0][0], block):
+            pars[0] = pars[0][1:]
+        if pars and pars[-1]:
+            last = pars[-1][-1]
+            if SIGNATURE.match(u''.join(last.itertext()).strip()):
+                pars[-1] = pars[-1][:-1]
+        for lines in pars:
+            for i, line in enumerate(lines):
+                yield col, i == 0, line
+
+
+def joinlines(lines):
+    '''
+    Join the lines of an entry into a list of (text, style) runs, rejoining
+    words hyphenated at the end of a line and merging adjacent runs with
+    the same style.
+    '''
+    runs = []
+    for line in lines:
+        line = [[text, style] for text, style in line if text]
+        if not line:
+            continue
+        if runs:
+            last = runs[-1]
+            if (last[0].rstrip().endswith(u'-') and len(last[0].rstrip()) > 1
+                    and line[0][0][:1].islower()):
+                last[0] = last[0].rstrip()[:-1]
+            elif not last[0].endswith(u' '):
+                last[0] += u' '
+        for run in line:
+            if runs and runs[-1][1] == run[1]:
+                runs[-1][0] += run[0]
+            else:
+                runs.append(run)
+    return runs
+
+
+def clean(text):
+    return u' '.join(text.split())
+
+
+def parseentry(lines):
+    '''
+    Split the lines of an entry into its parts
+    '''
+    runs = joinlines(lines)
+    entry = {'headword': None, 'obsolete': False, 'alien': False,
+             'pronunciation': None, 'pos': None, 'etymology': None,
+             'senses': []}
+
+    # Headword - the first bold word, possibly after a dagger or double bar
+    i = 0
+    prefix = u''
+    while i < len(runs) and 'b' not in runs[i][1]:
+        prefix += runs[i][0]
+        i += 1
+    if i < len(runs):
+        text = runs[i][0].lstrip()
+        word = text.split()[0] if text.split() else u''
+        raw = (prefix.strip() + word)
+        entry['obsolete'] = raw[:1] in (u't', u'†')
+        entry['alien'] = raw[:2] in (u'II', u'I!', u'||') or raw[:1] == u'‖'
+        entry['headword'] = headwords.normalize(raw)
+        runs[i] = [text[len(word):], runs[i][1]]
+
+    # Preamble is everything up to the first sense number or quotation
+    preamble = []
+    sense = None
+    quote = None
+    for text, style in runs[i:]:
+        if 'b' in style and SENSE.match(text):
+            sense = {'number': SENSE.match(text).group(1), 'definition': u'',
+                     'quotations': []}
+            entry['senses'].append(sense)
+            quote = None
+        elif 'b' in style and YEAR.match(text):
+            if sense is None:
+                sense = {'number': None, 'definition': u'', 'quotations': []}
+                entry['senses'].append(sense)
+            quote = {'year': clean(text), 'author': None, 'title': None,
+                     'text': u''}
+            sense['quotations'].append(quote)
+        elif quote is not None:
+            if 's' in style and quote['author'] is None and not quote['text'].strip():
+                quote['author'] = clean(text)
+            elif 'i' in style and quote['title'] is None and not quote['text'].strip():
+                quote['title'] = clean(text)
+            else:
+                quote['text'] += text
+        elif sense is not None:
+            sense['definition'] += text
+        else:
+            preamble.append((text, style))
+
+    # Pronunciation, part of speech and etymology from the preamble
+    for t, s in preamble:
+        if u'[' in t:
+            break
+        if 'i' in s and POS.match(t):
+            entry['pos'] = POS.match(t).group(0).strip()
+            break
+    rest = u''.join(t for t, s in preamble)
+    m = PRONUNCIATION.match(rest)
+    if m:
+        entry['pronunciation'] = clean(m.group(1))
+        rest = rest[m.end():]
+    if entry['pos'] and rest.lstrip().startswith(entry['pos']):
+        rest = rest.lstrip()[len(entry['pos']):]
+    m = ETYMOLOGY.search(rest)
+    if m:
+        entry['etymology'] = clean(m.group(1))
+        rest = rest[m.end():]
+    # anything left is the definition when there's only one sense
+    rest = clean(rest)
+    senses = entry['senses']
+    if senses and senses[0]['number'] is None:
+        senses[0]['definition'] = rest + u' ' + senses[0]['definition']
+    elif rest:
+        senses.insert(0, {'number': None, 'definition': rest, 'quotations': []})
+
+    for sense in entry['senses']:
+        sense['definition'] = clean(sense['definition'])
+        for quote in sense['quotations']:
+            quote['text'] = clean(quote['text'])
+    return entry
+
+
+class EntryAssembler():
+    '''
+    Accumulates the lines of the current entry across columns & pages.
+    '''
+
+    def __init__(self, state=None):
+        self.lines = []
+        self.start = None  # page, col & anchor of the first line
+        self.endpage = None
+        self.continued = False  # started without a headword
+        if state:
+            self.lines = state['lines']
+            self.start = state['start']
+            self.endpage = state['endpage']
+            self.continued = state.get('continued', False)
+
+    def state(self):
+        return {'lines': self.lines, 'start': self.start, 'endpage': self.endpage,
+                'continued': self.continued}
+
+    def flush(self):
+        '''
+        Return the entry assembled so far (if any) and start a new one
+        '''
+        if not self.lines:
+            return None
+        entry = parseentry(self.lines)
+        entry['page'], entry['col'], entry['anchor'] = self.start
+        entry['endpage'] = self.endpage
+        if len(self.lines) >= MAXLINES:
+            entry['truncated'] = True
+        if self.continued:
+            entry['continued'] = True
+        self.lines = []
+        self.start = None
+        return entry
+
+    def feed(self, pagenum, dom):
+        '''
+        Generator yielding the entries completed by a page
+        '''
+        for col, first, line in bodylines(dom):
+            starts = first and headwords.headword(line) is not None
+            if starts or len(self.lines) >= MAXLINES:
+                entry = self.flush()
+                if entry:
+                    yield entry
+            if not self.lines:
+                self.start = (pagenum, col, line.get('id'))
+                self.continued = not starts
+            self.lines.append([[text, style] for text, style in styledruns(line)])
+            self.endpage = pagenum
+
+
+def checkpointline(pagenum, offset, state):
+    '''
+    Line of a checkpoint file.  The keys are sorted so that a checkpoint
+    read back & written out again is the same.
+    '''
+    return json.dumps({'page': pagenum, 'offset': offset, 'state': state},
+                      sort_keys=True) + '\n'
+
+
+class EntryLog():
+    '''
+    JSONL file of entries plus a checkpoint file recording, for each page,
+    the size of the entry file and the partial entry after that page.
+
+    A run from page start carries on from the checkpoint for the page before
+    it.  If the log already has pages from start on they aren't thrown away:
+    the run is written to temporary files and spliced into the log when it's
+    closed.  The pages after the run are fed in (read through
+    pagefile(pagenum), which returns a path or file) until the partial entry
+    is the same as the log's, and the rest of the log is copied from there.
+    '''
+
+    def __init__(self, path, start=None, pagefile=None):
+        self.path = path
+        self.checkpoints = path + '.checkpoints'
+        self.pagefile = pagefile
+        self.count = 0
+        self.lastpage = None
+        # the log's checkpoints before the run & from its start on, with the
+        # size of the checkpoint file up to and including each one
+        before = []
+        self.after = []
+        if start is not None and os.path.exists(self.checkpoints):
+            with open(self.checkpoints, 'rb') as f:
+                for line in iter(f.readline, ''):
+                    checkpoint = json.loads(line)
+                    if checkpoint['page'] < start:
+                        before.append((checkpoint, f.tell()))
+                    else:
+                        self.after.append(checkpoint)
+        if self.after:
+            if not pagefile:
+                raise ValueError('Need the pages to keep the entries of %s after '
+                                 'page %d' % (path, start))
+            self.out = open(path + '.tmp', 'wb')
+            self.f = open(self.checkpoints + '.tmp', 'wb')
+            if before:
+                with open(path, 'rb') as f:
+                    self.out.write(f.read(before[-1][0]['offset']))
+                with open(self.checkpoints, 'rb') as f:
+                    self.f.write(f.read(before[-1][1]))
+        elif before:
+            # only the last entry, which the run carries on, is cut off
+            self.out = open(path, 'r+b')
+            self.out.truncate(before[-1][0]['offset'])
+            self.out.seek(0, os.SEEK_END)
+            self.f = open(self.checkpoints, 'r+b')
+            self.f.truncate(before[-1][1])
+            self.f.seek(0, os.SEEK_END)
+        else:
+            self.out = open(path, 'wb')
+            self.f = open(self.checkpoints, 'wb')
+        self.assembler = EntryAssembler(before and before[-1][0]['state'])
+        if before and before[-1][0]['page'] != start - 1:
+            # the entry the log stopped in is cut short at the gap
+            self.endentry()
+
+    def write(self, entry):
+        self.out.write(json.dumps(entry, sort_keys=True) + '\n')
+        self.count += 1
+
+    def endentry(self):
+        entry = self.assembler.flush()
+        if entry:
+            self.write(entry)
+
+    def feed(self, pagenum, dom):
+        for entry in self.assembler.feed(pagenum, dom):
+            self.write(entry)
+        self.out.flush()
+        self.f.write(checkpointline(pagenum, self.out.tell(),
+                                    self.assembler.state()))
+        self.f.flush()
+        self.lastpage = pagenum
+
+    def matches(self, checkpoint):
+        # JSON round trip so that tuples & byte strings compare equal
+        return json.loads(json.dumps(self.assembler.state())) == checkpoint['state']
+
+    def splice(self):
+        '''
+        Join the rest of the log onto the end of the run.  Returns False if
+        the log ran out before the partial entries came back together.
+        '''
+        last = self.lastpage
+        rest = [c for c in self.after if last is None or c['page'] > last]
+        joined = None
+        for checkpoint in self.after:
+            if checkpoint['page'] == last and self.matches(checkpoint):
+                joined = checkpoint
+        for checkpoint in rest:
+            if joined:
+                break
+            if last is not None and checkpoint['page'] > last + 1:
+                self.endentry()
+            pagefile = self.pagefile(checkpoint['page'])
+            self.feed(checkpoint['page'], ET.parse(pagefile).getroot())
+            last = checkpoint['page']
+            if self.matches(checkpoint):
+                joined = checkpoint
+        if not joined:
+            return False
+        delta = self.out.tell() - joined['offset']
+        with open(self.path, 'rb') as f:
+            f.seek(joined['offset'])
+            for chunk in iter(lambda: f.read(1024 * 1024), ''):
+                self.out.write(chunk)
+        for c in self.after[self.after.index(joined) + 1:]:
+            self.f.write(checkpointline(c['page'], c['offset'] + delta, c['state']))
+        return True
+
+    def close(self):
+        '''
+        Write out the last entry and close the files.  The last entry may
+        carry on into pages we haven't seen, so it's not in the checkpoint.
+        '''
+        if not (self.after and self.splice()):
+            self.endentry()
+        self.out.close()
+        self.f.close()
+        if self.after:
+            os.rename(self.path + '.tmp', self.path)
+            os.rename(self.checkpoints + '.tmp', self.checkpoints)
+
+
+def readcheckpoints(path):
+    with open(path + '.checkpoints', 'rb') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def mergeshards(paths, out, pagefile):
+    '''
+    Join the entry files of consecutive shards of a volume into one.  The
+    last entry of a shard is cut off at the end of the shard and the first
+    entry of the next one is missing its start, so the two are reassembled
+    from the shard's last checkpoint and the pages of the next shard up to
+    its first headword.  pagefile(pagenum) is the path of a page's HTML.
+    The shards' checkpoints are joined too, with the partial entries of the
+    pages fed again in place of the shard's own, so a later run can carry on
+    from any page as if the volume had been done in one go.
+    Returns the number of entries written.
+    '''
+    count = 0
+    carry = None  # partial entry at the end of the previous shard
+    dangling = None  # assembler for an entry running through a whole shard
+    with open(out + '.tmp', 'wb') as f, open(out + '.checkpoints.tmp', 'wb') as cp:
+        for i, path in enumerate(paths):
+            checkpoints = readcheckpoints(path)
+            skipfirst = False
+            dangling = None
+            if carry and carry['lines'] and checkpoints:
+                assembler = EntryAssembler(carry)
+                entry = None
+                for n, c in enumerate(checkpoints):
+                    pagenum = c['page']
+                    dom = ET.parse(pagefile(pagenum)).getroot()
+                    entry = next(assembler.feed(pagenum, dom), None)
+                    if entry:
+                        break
+                    cp.write(checkpointline(pagenum, f.tell(), assembler.state()))
+                if not entry:
+                    # the whole shard is the middle of one entry
+                    carry = assembler.state()
+                    dangling = assembler
+                    continue
+                f.write(json.dumps(entry, sort_keys=True) + '\n')
+                count += 1
+                skipfirst = True
+                # from its first headword on the shard's partial entries
+                # are the same as the volume's
+                checkpoints = checkpoints[n:]
+            last = i == len(paths) - 1
+            end = None if last or not checkpoints else checkpoints[-1]['offset']
+            delta = f.tell()
+            with open(path, 'rb') as shard:
+                for line in iter(shard.readline, ''):
+                    if end is not None and shard.tell() > end:
+                        break
+                    if skipfirst:
+                        skipfirst = False
+                        if json.loads(line).get('continued'):
+                            delta -= len(line)
+                            continue
+                    f.write(line)
+                    count += 1
+            for c in checkpoints:
+                cp.write(checkpointline(c['page'], c['offset'] + delta, c['state']))
+            if checkpoints:
+                carry = checkpoints[-1]['state']
+        entry = dangling and dangling.flush()
+        if entry:
+            f.write(json.dumps(entry, sort_keys=True) + '\n')
+            count += 1
+    os.rename(out + '.tmp', out)
+    os.rename(out + '.checkpoints.tmp', out + '.checkpoints')
+    return count
+
+
+def main():
+    if len(sys.argv) < 3:
+        print __doc__
+        sys.exit(1)
+    pattern = re.compile(r'_p(\d+)\.html$')
+    pages = sorted((int(pattern.search(f).group(1)), f)
+                   for f in sys.argv[2:] if pattern.search(f))
+    if not pages:
+        sys.exit(1)
+    log = EntryLog(sys.argv[1])
+    try:
+        for pagenum, filename in pages:
+            log.feed(pagenum, ET.parse(filename).getroot())
+    finally:
+        log.close()
+    print 'Wrote %d entries' % log.count
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,326 @@
+'''
+Resumable, verified downloads of the (large) Internet Archive source files.
+
+Files are downloaded to <local>.part, split into byte ranges fetched over
+several connections when the server supports Range requests.  Progress is
+recorded in <local>.part.state so that an interrupted download picks up where
+it left off.  The file is only renamed to <local> once its size (and MD5, if
+we know it) have been checked, so a failed download never leaves a truncated
+file where the rest of the pipeline will pick it up.
+
+Usage:
+    python fetch.py url local [md5]
+'''
+import hashlib
+import os
+import re
+import sys
+import threading
+
+import lxml.etree as ET
+import requests
+
+CHUNKSIZE = 1024 * 1024
+CONNECTIONS = 4
+MINSEGMENT = 8 * 1024 * 1024  # don't bother splitting smaller than this
+TIMEOUT = 60
+IAFILES = 'https://archive.org/download/%s/%s_files.xml'
+
+
+class FetchError(Exception):
+    pass
+
+
+def iachecksums(identifier):
+    '''
+    Return a dict of name -> (size, md5) for the files of an Internet Archive
+    item, or an empty dict if the metadata isn't available.
+    '''
+    try:
+        r = requests.get(IAFILES % (identifier, identifier), timeout=TIMEOUT)
+        r.raise_for_status()
+        files = ET.fromstring(r.content)
+    except (requests.RequestException, ET.XMLSyntaxError):
+        return {}
+    result = {}
+    for f in files.iterfind('file'):
+        size = f.findtext('size')
+        result[f.get('name')] = (int(size) if size else None, f.findtext('md5'))
+    return result
+
+
+def iaidentifier(url):
+    '''
+    Extract the item identifier from an archive.org download URL
+    '''
+    m = re.search(r'/(?:download|items)/([^/]+)/', url)
+    return m.group(1) if m else None
+
+
+def probe(url):
+    '''
+    Return (size, ranges) for a URL, where ranges is True if the server
+    accepts byte range requests.  size is None if unknown.
+    '''
+    r = requests.head(url, allow_redirects=True, timeout=TIMEOUT)
+    if r.status_code != 200:
+        raise FetchError('HEAD %s failed with status code %d' % (url, r.status_code))
+    size = r.headers.get('content-length')
+    ranges = r.headers.get('accept-ranges', '').lower() == 'bytes'
+    return (int(size) if size is not None else None), ranges
+
+
+def segments(size, connections):
+    '''
+    Split size bytes into up to connections [start, end) segments.
+    '''
+    count = max(1, min(connections, size // MINSEGMENT))
+    step = -(-size // count)
+    return [[start, min(start + step, size)] for start in range(0, size, step)]
+
+
+class _State():
+    '''
+    Download progress - [position, end) of each segment still to fetch,
+    saved after every chunk so we can resume.
+    '''
+
+    def __init__(self, path, size, connections):
+        self.path = path
+        self.lock = threading.Lock()
+        self.segments = None
+        if os.path.exists(path):
+            with open(path) as f:
+                header = f.readline().split()
+                if header == [str(size)]:
+                    self.segments = [map(int, line.split()) for line in f]
+        if self.segments is None:
+            self.segments = segments(size, connections)
+        self.size = size
+
+    def save(self):
+        with self.lock:
+            with open(self.path + '.tmp', 'w') as f:
+                f.write('%d\n' % self.size)
+                for pos, end in self.segments:
+                    f.write('%d %d\n' % (pos, end))
+            os.rename(self.path + '.tmp', self.path)
+
+    def remaining(self):
+        return sum(end - pos for pos, end in self.segments)
+
+
+def _fetchsegment(url, part, segment, state, errors):
+    try:
+        pos, end = segment
+        if pos >= end:
+            return
+        headers = {'Range': 'bytes=%d-%d' % (pos, end - 1)}
+        r = requests.get(url, headers=headers, stream=True, timeout=TIMEOUT)
+        if r.status_code != 206:
+            raise FetchError('range request for %s failed with status code %d'
+                             % (url, r.status_code))
+        with open(part, 'r+b') as f:
+            f.seek(pos)
+            for chunk in r.iter_content(CHUNKSIZE):
+                chunk = chunk[:end - pos]
+                f.write(chunk)
+                pos += len(chunk)
+                segment[0] = pos
+                state.save()
+                if pos >= end:
+                    break
+        if pos < end:
+            raise FetchError('connection closed at byte %d of %s' % (pos, url))
+    except Exception as e:
+        errors.append(e)
+
+
+def _fetchranges(url, part, size, connections):
+    state = _State(part + '.state', size, connections)
+    if not os.path.exists(part) or os.path.getsize(part) != size:
+        with open(part, 'ab') as f:
+            f.truncate(size)
+    errors = []
+    threads = [threading.Thread(target=_fetchsegment,
+                                args=(url, part, segment, state, errors))
+               for segment in state.segments if segment[0] < segment[1]]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if errors:
+        raise errors[0]
+    if state.remaining():
+        raise FetchError('incomplete download of %s' % url)
+    os.remove(state.path)
+
+
+def _fetchstream(url, part, ranges):
+    if os.path.exists(part + '.state'):
+        # the .part is the full size with holes where ranges are missing, so
+        # its size isn't how far we got
+        os.remove(part + '.state')
+        if os.path.exists(part):
+            os.remove(part)
+    pos = os.path.getsize(part) if os.path.exists(part) and ranges else 0
+    headers = {'Range': 'bytes=%d-' % pos} if pos else {}
+    r = requests.get(url, headers=headers, stream=True, timeout=TIMEOUT)
+    if r.status_code == 200:
+        mode = 'wb'
+    elif r.status_code == 206 and pos:
+        mode = 'ab'
+    else:
+        raise FetchError('Download of %s failed with status code %d'
+                         % (url, r.status_code))
+    with open(part, mode) as f:
+        for chunk in r.iter_content(CHUNKSIZE):
+            f.write(chunk)
+
+
+def md5sum(path):
+    h = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNKSIZE), ''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def fetch(url, local, md5=None, size=None, connections=CONNECTIONS):
+    '''
+    Download url to local, resuming a previous partial download if there is
+    one.  Raises FetchError if the download fails or doesn't match the
+    expected size or md5 checksum.
+    '''
+    part = local + '.part'
+    try:
+        length, ranges = probe(url)
+        if size is None:
+            size = length
+        elif length is not None and length != size:
+            raise FetchError('%s is %d bytes, expected %d' % (url, length, size))
+
+        # a ranged download is resumed as one, whatever the connections
+        if ranges and size and (connections > 1 or os.path.exists(part + '.state')):
+            _fetchranges(url, part, size, connections)
+        else:
+            _fetchstream(url, part, ranges)
+    except requests.RequestException as e:
+        raise FetchError('Download of %s failed: %s' % (url, e))
+
+    actual = os.path.getsize(part)
+    if size is not None and actual != size:
+        raise FetchError('%s is %d bytes, expected %d' % (part, actual, size))
+    if md5 and md5sum(part) != md5.lower():
+        os.remove(part)
+        raise FetchError('MD5 checksum mismatch for %s' % url)
+    os.rename(part, local)
+
+
+def fetchia(url, local, connections=CONNECTIONS):
+    '''
+    Download a file from the Internet Archive, checking it against the
+    size and MD5 listed in the item's metadata.
+    '''
+    identifier = iaidentifier(url)
+    size, md5 = None, None
+    if identifier:
+        size, md5 = iachecksums(identifier).get(url.split('/')[-1], (None, None))
+    fetch(url, local, md5, size, connections)
+
+
+def test_fetch():
+    '''
+    Exercise fetch against a local range capable HTTP server.
+    '''
+    import BaseHTTPServer
+    import shutil
+    import tempfile
+
+    data = os.urandom(3 * MINSEGMENT + 12345)
+    failures = []
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_HEAD(self):
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(data)))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.end_headers()
+
+        def do_GET(self):
+            m = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+            start, end = 0, len(data)
+            if m:
+                start = int(m.group(1))
+                end = int(m.group(2)) + 1 if m.group(2) else len(data)
+            body = data[start:end]
+            if failures:
+                # simulate a dropped connection part way through
+                failures.pop()
+                body = body[:len(body) // 2]
+            self.send_response(206 if m else 200)
+            self.send_header('Content-Length', str(end - start))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    url = 'http://127.0.0.1:%d/file.bin' % server.server_port
+    tmp = tempfile.mkdtemp()
+    try:
+        local = os.path.join(tmp, 'file.bin')
+        md5 = hashlib.md5(data).hexdigest()
+        for connections in (1, 4):
+            fetch(url, local, md5, connections=connections)
+            assert open(local, 'rb').read() == data
+            os.remove(local)
+
+        # interrupted download resumes from the .part file
+        failures.append(True)
+        try:
+            fetch(url, local, md5, connections=4)
+            assert False, 'expected FetchError'
+        except FetchError:
+            assert not os.path.exists(local)
+            assert os.path.exists(local + '.part.state')
+        fetch(url, local, md5, connections=4)
+        assert open(local, 'rb').read() == data
+        os.remove(local)
+
+        # and carries on from the .part.state over a single connection
+        failures.append(True)
+        try:
+            fetch(url, local, md5, connections=4)
+            assert False, 'expected FetchError'
+        except FetchError:
+            pass
+        fetch(url, local, md5, connections=1)
+        assert open(local, 'rb').read() == data
+        assert not os.path.exists(local + '.part.state')
+        os.remove(local)
+
+        # bad checksum never goes live
+        try:
+            fetch(url, local, '0' * 32)
+            assert False, 'expected FetchError'
+        except FetchError:
+            assert not os.path.exists(local)
+        print 'fetch OK'
+    finally:
+        server.shutdown()
+        shutil.rmtree(tmp)
+
+
+def main():
+    if len(sys.argv) < 3:
+        print __doc__
+        sys.exit(1)
+    fetch(sys.argv[1], sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+'''
+Synthetic ABBYY FineReader volumes for benchmarking & testing offline.
+
+The pages look like the OED scans as far as the pipeline is concerned -
+three columns of justified text whose position alternates between odd and
+even (facing) pages, a running head of first word, page number and last
+word, entries starting with bold headwords in alphabetical order (some with
+a dagger or stress mark) and a sprinkling of low confidence characters -
+along with the OCR segmentation problems that post-processing has to deal
+with:
+
+  * columns broken into several stacked blocks
+  * columns split into side by side blocks part way down
+  * small "runt" blocks overlapping the text of a column
+
+The output is deterministic for a given seed so timings can be compared
+from run to run.
+
+Usage:
+    python fixtures.py output.gz [pages [seed]]
+'''
+import gzip
+import random
+import sys
+
+ABBYYNS = 'http://www.abbyy.com/FineReader_xml/FineReader6-schema-v1.xml'
+WIDTH = 2700
+HEIGHT = 3600
+COLUMNS = (55, 810, 1560)  # left edges on odd pages
+COLWIDTH = 720
+FACINGOFFSET = 300         # even pages are shifted right by this much
+TOP = 200
+BOTTOM = 3300
+LINEHEIGHT = 42
+CHARWIDTH = 17
+INDENT = 30
+ENTRIES = 500              # more than the entries on any page
+
+WORDS = ('the', 'of', 'a', 'and', 'to', 'in', 'obs', 'rare', 'trans', 'fig',
+         'whence', 'also', 'sense', 'pl', 'cf', 'esp', 'var', 'forms',
+         'abandon', 'abase', 'abash', 'abate', 'abbey', 'abbot', 'abdicate',
+         'aberrant', 'abeyance', 'abhor', 'abide', 'ability', 'abject')
+STYLES = ('', '', '', ' italic="true"', ' smallcaps="true"')
+
+
+class Page():
+    '''
+    Builds the XML for one page, a block at a time.
+    '''
+
+    def __init__(self, rand, pagenum):
+        self.rand = rand
+        self.pagenum = pagenum
+        self.headwords = []
+        self.out = ['<page width="%d" height="%d" resolution="400" '
+                    'originalCoords="true">' % (WIDTH, HEIGHT)]
+
+    def chars(self, x, y, text, attrs=''):
+        rand = self.rand
+        out = self.out
+        out.append('<formatting lang="EnglishUnitedStates" '
+                   'ff="Times New Roman" fs="9.5"%s>' % attrs)
+        for ch in text:
+            if rand.random() < 0.03:
+                confidence = rand.randint(0, 50)
+                dictionary = 'false'
+            else:
+                confidence = rand.randint(60, 100)
+                dictionary = 'true'
+            out.append('<charParams l="%d" t="%d" r="%d" b="%d" '
+                       'wordFromDictionary="%s" charConfidence="%d">%s'
+                       '</charParams>' % (x, y, x + CHARWIDTH - 2, y + 38,
+                                          dictionary, confidence, ch))
+            x += CHARWIDTH
+        out.append('</formatting>')
+        return x
+
+    def headword(self):
+        '''
+        Next headword - four letters counting up through the volume so
+        they're in alphabetical order.
+        '''
+        n = self.pagenum * ENTRIES + len(self.headwords)
+        word = ''
+        for i in range(4):
+            n, letter = divmod(n, 26)
+            word = chr(ord('a') + letter) + word
+        word = word.capitalize()
+        self.headwords.append(word)
+        return word
+
+    def line(self, left, top, right, first=False):
+        '''
+        A line of text between left & right.  The first line of a paragraph
+        is indented and starts with a bold headword.
+        '''
+        rand = self.rand
+        self.out.append('<line baseline="%d" l="%d" t="%d" r="%d" b="%d">'
+                        % (top + 35, left, top, right, top + 38))
+        x = left
+        if first:
+            word = self.headword()
+            if rand.random() < 0.1:
+                # stress mark recognized as an apostrophe
+                word = word[:2] + "'" + word[2:]
+            if rand.random() < 0.1:
+                # obsolete - dagger recognized as an unbolded t
+                x = self.chars(x, top, 't')
+            x = self.chars(x, top, word + ' ', ' bold="true"')
+        while True:
+            word = rand.choice(WORDS) + ' '
+            if x + len(word) * CHARWIDTH > right:
+                break
+            x = self.chars(x, top, word, rand.choice(STYLES))
+        self.out.append('</line>')
+
+    def block(self, left, top, right, bottom, continued=False, entries=True):
+        '''
+        A text block filled with paragraphs of lines, which start entries
+        unless entries is False.
+        '''
+        rand = self.rand
+        out = self.out
+        out.append('<block blockType="Text" l="%d" t="%d" r="%d" b="%d">'
+                   '<region><rect l="%d" t="%d" r="%d" b="%d"/></region><text>'
+                   % (left, top, right, bottom, left, top, right, bottom))
+        y = top
+        first = not continued
+        while y + LINEHEIGHT <= bottom:
+            out.append('<par align="Justified">')
+            for k in range(rand.randint(2, 8)):
+                if y + LINEHEIGHT > bottom:
+                    break
+                # last line of a paragraph is usually short
+                right_ = right - rand.randint(0, 30)
+                if k > 0 and rand.random() < 0.2:
+                    right_ = left + (right - left) * 2 // 3
+                self.line(left + (INDENT if first else 0), y, right_,
+                          first and entries)
+                first = False
+                y += LINEHEIGHT
+            first = True
+            out.append('</par>')
+        out.append('</text></block>')
+
+    def column(self, left):
+        '''
+        A column of text, segmented the way FineReader tends to get it wrong
+        '''
+        rand = self.rand
+        right = left + COLWIDTH
+        splits = sorted(rand.sample(range(TOP + 400, BOTTOM - 400, LINEHEIGHT),
+                                    rand.choice((0, 0, 1, 2))))
+        tops = [TOP] + splits
+        bottoms = splits + [BOTTOM]
+        for i, (top, bottom) in enumerate(zip(tops, bottoms)):
+            if i == 1 and rand.random() < 0.2 and bottom - top > 8 * LINEHEIGHT:
+                # side by side split
+                middle = top + (bottom - top) // 2
+                self.block(left, top, left + COLWIDTH // 2 - 10, middle,
+                           True, False)
+                self.block(left + COLWIDTH // 2 + 10, top, right, middle,
+                           True, False)
+                self.block(left, middle, right, bottom, True)
+            else:
+                self.block(left, top, right, bottom, i > 0)
+        if rand.random() < 0.15:
+            # runt overlapping the column
+            top = rand.randrange(TOP, BOTTOM - 100, LINEHEIGHT)
+            self.block(left + 100, top, left + 400, top + LINEHEIGHT + 10,
+                       True, False)
+
+    def head(self, left, text):
+        '''
+        Centered header line at the top of a column
+        '''
+        left += (COLWIDTH - len(text) * CHARWIDTH) // 2
+        right = left + len(text) * CHARWIDTH
+        self.out.append('<block blockType="Text" l="%d" t="100" r="%d" b="%d">'
+                        '<text><par align="Center">' % (left, right,
+                                                        100 + LINEHEIGHT))
+        self.out.append('<line baseline="135" l="%d" t="100" r="%d" b="138">'
+                        % (left, right))
+        self.chars(left, 100, text)
+        self.out.append('</line></par></text></block>')
+
+    def build(self):
+        offset = 0 if self.pagenum % 2 else FACINGOFFSET
+        for left in COLUMNS:
+            self.column(left + offset)
+        body = self.out
+        # running head goes first but needs to know the words on the page
+        self.out = []
+        for left, text in zip(COLUMNS, (self.headwords[0].upper(),
+                                        str(self.pagenum),
+                                        self.headwords[-1].upper())):
+            self.head(left + offset, text)
+        self.out = body[:1] + self.out + body[1:] + ['</page>']
+        return '\n'.join(self.out)
+
+
+def page(pagenum, seed=0):
+    '''
+    Return the XML text of a single synthetic page
+    '''
+    return Page(random.Random('%d:%d' % (seed, pagenum)), pagenum).build()
+
+
+def writevolume(localfile, pages, seed=0):
+    '''
+    Write a gzipped synthetic ABBYY volume with the given number of pages
+    '''
+    with gzip.open(localfile, 'wb') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write('<document xmlns="%s" version="1.0" producer="fixtures" '
+                'pagesCount="%d">\n' % (ABBYYNS, pages))
+        for pagenum in range(1, pages + 1):
+            f.write(page(pagenum, seed))
+            f.write('\n')
+        f.write('</document>\n')
+
+
+def main():
+    if len(sys.argv) < 2:
+        print __doc__
+        sys.exit(1)
+    pages = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    writevolume(sys.argv[1], pages, seed)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+'''
+Page geometry for hOCR post-processing.
+
+Block and line coordinates live in the hOCR title attributes (eg
+"blockType: Text bbox 55 200 775 3200" or "bbox 85 200 741 238").  Rather
+than re-parsing those strings every time a coordinate is needed, we parse
+each one exactly once per page into a PageGeometry table right after the
+transform, and the post-processing steps work from that.
+'''
+import bisect
+import numpy as np
+
+BLOCKXPATH = ".//div[contains(concat(' ',@class,' '),' ocr_carea ')]"
+LINEXPATH = ".//span[@class='ocr_line']"
+
+
+class BoundingBox(object):
+        '''
+        Rectangle in page coordinates - 0,0 in upper left.
+        '''
+        __slots__ = ('left', 'top', 'right', 'bottom')
+
+        def __init__(self, bbox):
+            self.left = bbox[0]
+            self.top = bbox[1]
+            self.right = bbox[2]
+            self.bottom = bbox[3]
+
+        def inner(self, b2):
+                '''
+                Checks two bounding boxes to see if either completely contains
+                the other.  If a completely contained box is found, that inner box
+                is returned, otherwise None is returned.
+                '''
+                if self.contains(b2):
+                        return b2
+                if b2.contains(self):
+                        return self
+                return None
+
+        def contains(self,b2):
+                '''
+                Returns True if b2 is contained by this box
+                '''
+                return (b2.left >= self.left and b2.top >= self.top
+                        and b2.right <= self.right and b2.bottom <= self.bottom)
+
+        def intersects(self,b2):
+                '''
+                Tests two bounding boxes to see if they intersect (or touch). Returns True
+                if they do and false if they don't.
+                '''
+                return not (self.left >= b2.right or b2.left >= self.right
+                            or self.top >= b2.bottom or b2.top >= self.bottom)
+
+        def width(self):
+                return self.right - self.left
+        def height(self):
+                return self.bottom - self.top
+        def centerx(self):
+                return self.left+self.width()/2
+
+        def union(self,b2):
+                '''
+                Return a new bounding box which encloses both boxes.
+                '''
+                return BoundingBox([min(self.left,b2.left), min(self.top,b2.top),
+                                    max(self.right,b2.right), max(self.bottom, b2.bottom)])
+
+        def maximize(self,b2):
+                '''
+                Maximize our bounding box with the other boxes bounds.
+                '''
+                self.left = min(self.left,b2.left)
+                self.top = min(self.top,b2.top)
+                self.right = max(self.right,b2.right)
+                self.bottom = max(self.bottom, b2.bottom)
+
+        def column(self, cols):
+            '''
+            Return the column index for the bounding because, given a list
+            of column left margins.
+            '''
+            if self.right < cols[0]:
+                # in the left margin
+                return -1
+            for i in range(1, len(cols)):
+                if self.left < cols[i] - 10:
+                    return i-1
+            return len(cols)-1
+
+        def __str__(self):
+                return "bbox %d %d %d %d" % (self.left, self.top, self.right, self.bottom)
+
+        def __repr__(self):
+                return "%s %d %d" % (str(self), self.width(), self.height())
+
+
+def parsebbox(title):
+    '''
+    Parse the bbox out of an hOCR title attribute.
+    '''
+    coords = title.split('bbox', 1)[1].split(';', 1)[0].split()
+    return BoundingBox(map(int, coords[:4]))
+
+
+def columnblocks(dom):
+    '''
+    Text blocks on the page, left to right
+    '''
+    return sorted(dom.xpath(BLOCKXPATH),
+                  key=lambda block: parsebbox(block.attrib['title']).left)
+
+
+def anchor(col, line):
+    return 'line_%d_%d' % (col, line)
+
+
+def numberlines(dom):
+    '''
+    Give each line on the page an id of line_<column>_<line>, numbering
+    columns left to right and lines from the top of their column.
+    '''
+    for col, block in enumerate(columnblocks(dom), 1):
+        for line, el in enumerate(block.iterfind("p/span[@class='ocr_line']"), 1):
+            el.set('id', anchor(col, line))
+    return dom
+
+
+class SpatialIndex():
+    '''
+    Static index for overlap queries over a set of bounding boxes.
+
+    Boxes are sorted by their left edge and we keep a running maximum of
+    their right edges, which never decreases, so the range of candidates in
+    x for a query can be found by bisecting both lists.  That alone is no
+    help for boxes stacked one above the other, like the lines of a column,
+    so the page is also cut into horizontal strips the height of a typical
+    box, each with the sorted positions of the boxes crossing it, and the x
+    range is bisected within the strips the query crosses.  Building the
+    index is O(n log n) plus the strips each box crosses, and a query is
+    O(s log n) for s strips plus the candidates which overlap it in both x
+    and y (and their strip neighbours).
+    '''
+
+    def __init__(self, items):
+        '''
+        items is a sequence of (key, BoundingBox) pairs
+        '''
+        items = sorted(items, key=lambda item: item[1].left)
+        self.keys = [key for key, bbox in items]
+        self.boxes = [bbox for key, bbox in items]
+        self.lefts = [bbox.left for bbox in self.boxes]
+        self.maxrights = []
+        right = None
+        for bbox in self.boxes:
+            right = bbox.right if right is None else max(right, bbox.right)
+            self.maxrights.append(right)
+        heights = sorted(bbox.bottom - bbox.top for bbox in self.boxes)
+        self.strip = max(1, heights[len(heights) // 2]) if heights else 1
+        self.strips = {}
+        for i, bbox in enumerate(self.boxes):
+            for strip in self._strips(bbox):
+                self.strips.setdefault(strip, []).append(i)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _strips(self, bbox):
+        # a query box can be turned inside out, eg by shrinking a short box
+        top, bottom = sorted((bbox.top, bbox.bottom))
+        return xrange(top // self.strip, bottom // self.strip + 1)
+
+    def _candidates(self, bbox):
+        lo = bisect.bisect_right(self.maxrights, bbox.left)
+        hi = bisect.bisect_left(self.lefts, bbox.right)
+        candidates = set()
+        for strip in self._strips(bbox):
+            positions = self.strips.get(strip, ())
+            candidates.update(positions[bisect.bisect_left(positions, lo):
+                                        bisect.bisect_left(positions, hi)])
+        return sorted(candidates)
+
+    def intersecting(self, bbox):
+        '''
+        Return the keys of all boxes which intersect bbox, left to right
+        '''
+        return [self.keys[i] for i in self._candidates(bbox)
+                if self.boxes[i].intersects(bbox)]
+
+
+class PageGeometry():
+    '''
+    Table of the text blocks & lines on a page and their bounding boxes,
+    built once per page.  Blocks and lines are kept in document order.
+    '''
+
+    def __init__(self, dom):
+        self.blocks = dom.xpath(BLOCKXPATH)
+        self.lines = dom.xpath(LINEXPATH)
+        self.boxes = {}
+        self._linearray = None
+        for el in self.blocks:
+            self.boxes[el] = parsebbox(el.attrib['title'])
+        for el in self.lines:
+            self.boxes[el] = parsebbox(el.attrib['title'])
+
+    def bbox(self, el):
+        return self.boxes[el]
+
+    def lineboxes(self):
+        return [self.boxes[line] for line in self.lines]
+
+    def linearray(self):
+        '''
+        Line coordinates as an (n x 4) array of left, top, right, bottom
+        '''
+        if self._linearray is None:
+            self._linearray = np.array(
+                [(b.left, b.top, b.right, b.bottom) for b in self.lineboxes()],
+                dtype=int).reshape(-1, 4)
+        return self._linearray
+
+    def update(self, el):
+        '''
+        Write an element's (possibly modified) bbox back to its title
+        '''
+        el.attrib['title'] = str(self.boxes[el])
+
+    def removeblock(self, block):
+        self.blocks.remove(block)
+        del self.boxes[block]
+
+    def removeline(self, line):
+        self.lines.remove(line)
+        del self.boxes[line]
+        self._linearray = None
+
+    def refreshlines(self, dom):
+        '''
+        Re-read the lines in document order after they've been moved around,
+        dropping any which are no longer on the page.
+        '''
+        lines = dom.xpath(LINEXPATH)
+        live = set(lines)
+        for line in self.lines:
+            if line not in live:
+                del self.boxes[line]
+        self.lines = lines
+        self._linearray = None
+
+    def blockindex(self):
+        return SpatialIndex((block, self.boxes[block]) for block in self.blocks)
+
+    def lineindex(self, lines=None):
+        if lines is None:
+            lines = self.lines
+        return SpatialIndex((line, self.boxes[line]) for line in lines)
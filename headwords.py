@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+'''
+Headwords and the headword -> page lookup table.
+
+Main words start an entry at the beginning of a paragraph, in bold, title
+case and (usually) preceded by nothing but a dagger ( = obsolete, usually
+recognized as a lower case 't') or double vertical bar ( = not naturalized,
+recognized as 'II', 'I!' or '||').  The stress mark is a turned period which
+mostly comes out as an apostrophe in the middle of the word.  Each column
+is also headed by a short centered line - the first word on the page, the
+page number and the last word on the page.
+
+Since main words occur in alphabetical order, a sorted list of them with the
+page each was found on lets us find the page for any word with a binary
+search, and words out of order point to OCR errors or missing pages.
+
+The table is stored as tab separated text sorted by key:
+
+  key     word    page
+
+Usage:
+    python headwords.py output/oed-vol1_headwords.txt word [word ...]
+'''
+from array import array
+import bisect
+import os
+import re
+import sys
+import unicodedata
+
+from geometry import columnblocks, parsebbox
+
+STRESS = re.compile(u"['`‘’·ˈ]")
+MARKS = u'(?:†|‖|\|\||II|I!|t)'
+PREFIX = re.compile(u'^%s(?=[A-Z])' % MARKS)
+MARK = re.compile(u'^%s?$' % MARKS)
+HEADERWIDTH = 0.5  # header lines are less than this fraction of a column
+
+
+def normalize(word):
+    '''
+    Strip the stress mark, dagger / double bar and trailing punctuation from
+    a headword as recognized by the OCR.
+    '''
+    word = STRESS.sub(u'', word.strip())
+    word = PREFIX.sub(u'', word)
+    return word.strip(u'.,;:')
+
+
+def sortkey(word):
+    '''
+    Key for alphabetical order - lower case letters only, without accents
+    '''
+    if isinstance(word, str):
+        word = word.decode('utf-8')
+    word = unicodedata.normalize('NFKD', word).lower()
+    return ''.join(ch for ch in word if 'a' <= ch <= 'z').encode('ascii')
+
+
+def runs(el, bold=False):
+    '''
+    Generator yielding (text, bold) for the text in an element in order
+    '''
+    bold = bold or el.tag == 'b'
+    if el.text:
+        yield el.text, bold
+    for child in el:
+        for run in runs(child, bold):
+            yield run
+        if child.tail:
+            yield child.tail, bold
+
+
+def headword(line):
+    '''
+    Return the headword at the start of a line, or None if the line doesn't
+    start with a bold, title case word.
+    '''
+    text = u''
+    for chunk, bold in runs(line):
+        if not bold:
+            # only an unbolded dagger or double bar can come before it
+            if text.strip() or not MARK.match(chunk.strip()):
+                break
+            text += chunk.strip()
+            continue
+        text += chunk
+        if text.strip() and chunk != chunk.rstrip():
+            break
+    words = text.split()
+    if not words:
+        return None
+    word = normalize(words[0])
+    if not word or not word[0].isupper() or not word.replace(u'-', u'').isalpha():
+        return None
+    return word
+
+
+def isheader(line, block):
+    '''
+    Returns True if a line is short enough to be a column header
+    '''
+    return (parsebbox(line.attrib['title']).width()
+            < parsebbox(block.attrib['title']).width() * HEADERWIDTH)
+
+
+def extract(dom):
+    '''
+    Find the column header words & headwords on a post-processed page.
+    Returns (header, headwords) where header is a list of the header text
+    of each column and headwords a list of words in page order.
+    '''
+    header = []
+    words = []
+    for block in columnblocks(dom):
+        first = True
+        for par in block.iterfind('p'):
+            lines = par.findall("span[@class='ocr_line']")
+            if not lines:
+                continue
+            if first:
+                first = False
+                # short line at the top of the column is the header
+                if isheader(lines[0], block):
+                    header.append(normalize(u''.join(lines[0].itertext())))
+                    lines = lines[1:]
+                    if not lines:
+                        continue
+            word = headword(lines[0])
+            if word:
+                words.append(word)
+    return header, words
+
+
+def disorder(words, previous=None):
+    '''
+    Return a list of (before, after) pairs of consecutive words which are
+    out of alphabetical order, starting from the previous word (if any).
+    '''
+    result = []
+    last = sortkey(previous) if previous else None
+    for word in words:
+        key = sortkey(word)
+        if last is not None and key < last:
+            result.append((previous, word))
+        previous = word
+        last = key
+    return result
+
+
+class HeadwordIndex():
+    '''
+    Sorted headword -> page table.  The keys are kept as a sorted list and
+    the pages in a parallel array, so a lookup is a binary search.
+    '''
+
+    def __init__(self, entries=()):
+        '''
+        entries is a sequence of (word, pagenum)
+        '''
+        entries = sorted((sortkey(word), word, pagenum) for word, pagenum in entries)
+        self.keys = [key for key, word, pagenum in entries]
+        self.words = [word for key, word, pagenum in entries]
+        self.pages = array('H', [pagenum for key, word, pagenum in entries])
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup(self, word):
+        '''
+        Return the page a word would be on - the page of the last headword
+        at or before it alphabetically - or None if it comes before them all.
+        '''
+        key = sortkey(word)
+        i = bisect.bisect_right(self.keys, key) - 1
+        if i < 0:
+            return None
+        if self.keys[i] == key:
+            # first of several homonyms
+            i = bisect.bisect_left(self.keys, key)
+        return self.pages[i]
+
+    def save(self, path):
+        with open(path + '.tmp', 'w') as f:
+            for key, word, pagenum in zip(self.keys, self.words, self.pages):
+                f.write('%s\t%s\t%d\n' % (key, word.encode('utf-8'), pagenum))
+        os.rename(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        with open(path) as f:
+            for line in f:
+                key, word, pagenum = line.rstrip('\n').split('\t')
+                index.keys.append(key)
+                index.words.append(word.decode('utf-8'))
+                index.pages.append(int(pagenum))
+        return index
+
+
+def main():
+    if len(sys.argv) < 3:
+        print __doc__
+        sys.exit(1)
+    index = HeadwordIndex.load(sys.argv[1])
+    for word in sys.argv[2:]:
+        print '%s\t%s' % (word, index.lookup(word))
+
+if __name__ == '__main__':
+    main()
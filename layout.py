@@ -0,0 +1,155 @@
+'''
+Column gutter detection from line left edges.
+
+Lines in each of the three columns start at (nearly) the same X position, with
+paragraph first lines indented a little, so a histogram of line left edges
+has one tall, narrow peak per column.  We smooth the histogram and pick the
+three strongest peaks which are at least a column width apart, which copes
+much better with margin runts, skew and sparse columns than walking the raw
+edge counts with fixed thresholds.
+
+Everything works on a batch of pages at once - each page is one row of a 2D
+histogram.
+'''
+import numpy as np
+
+BINWIDTH = 10       # pixels per histogram bin
+PAGEWIDTH = 4000    # wider than any scanned page
+MINSEPARATION = 500 # column left edges are ~750px apart
+MINPEAK = 0.02      # minimum fraction of a page's lines at a column edge
+COLMARGIN = 10      # slop to the left of the column edge
+NCOLUMNS = 3
+
+
+def histograms(lefts):
+    '''
+    Build a 2D (page x bin) histogram of line left edges for a list of
+    per-page arrays with a single bincount.
+    '''
+    nbins = PAGEWIDTH // BINWIDTH
+    rows = np.repeat(np.arange(len(lefts)), [len(l) for l in lefts])
+    edges = np.concatenate(lefts) if lefts else np.zeros(0, dtype=int)
+    bins = np.clip(edges // BINWIDTH, 0, nbins - 1)
+    counts = np.bincount(rows * nbins + bins, minlength=len(lefts) * nbins)
+    return counts.reshape(len(lefts), nbins)
+
+
+def findpeaks(hist, count=NCOLUMNS):
+    '''
+    Return a (page x count) array of peak bins from a 2D histogram, in
+    decreasing order of density, or -1 where no significant peak was found.
+    '''
+    smooth = hist.astype(float)
+    smooth[:, 1:] += hist[:, :-1] * 0.5
+    smooth[:, :-1] += hist[:, 1:] * 0.5
+    threshold = np.maximum(3, hist.sum(axis=1) * MINPEAK)
+    window = MINSEPARATION // BINWIDTH
+    bins = np.arange(hist.shape[1])
+    peaks = np.empty((hist.shape[0], count), dtype=int)
+    for i in range(count):
+        peak = smooth.argmax(axis=1)
+        found = smooth[np.arange(len(peak)), peak] >= threshold
+        peaks[:, i] = np.where(found, peak, -1)
+        # suppress everything within a column width of this peak
+        smooth[np.abs(bins - peak[:, None]) < window] = 0
+    return peaks
+
+
+def findgutters(lefts):
+    '''
+    Compute column gutters for a batch of pages given a list of arrays of
+    line left edges (one per page).  Returns a list with a sorted tuple of
+    three X coordinates per page, or None for pages where three columns
+    couldn't be found.
+    '''
+    lefts = [np.asarray(l, dtype=int) for l in lefts]
+    hist = histograms(lefts)
+    peaks = findpeaks(hist)
+    result = []
+    for i, (page, row) in enumerate(zip(lefts, peaks)):
+        found = sorted(p for p in row if p >= 0)
+        if len(found) == NCOLUMNS - 1 and found[1] - found[0] > \
+                1.5 * MINSEPARATION // BINWIDTH:
+            # Missing middle column - guess it's half way between
+            found.insert(1, (found[0] + found[1]) // 2)
+        if len(found) != NCOLUMNS:
+            result.append(None)
+            continue
+        gutters = []
+        for p in found:
+            # Refine to the leftmost edge in the densest bin of the peak
+            lo = max(p - 1, 0)
+            best = lo + hist[i, lo:p + 2].argmax()
+            inbin = page[(page // BINWIDTH) == best]
+            edge = inbin.min() if len(inbin) else p * BINWIDTH
+            gutters.append(max(int(edge) - COLMARGIN, 0))
+        result.append(tuple(gutters))
+    return result
+
+
+def assign(lefts, gutters):
+    '''
+    Return an array with the column index of each line given its left edge.
+    '''
+    col1, col2, col3 = gutters
+    lefts = np.asarray(lefts)
+    return np.where(lefts >= col3, 2, np.where(lefts <= col2, 0, 1))
+
+
+# Checking a page against a known layout
+INDENT = 40         # paragraph first lines are indented ~30px
+TOLERANCE = 15      # slop either side of a column edge
+MINFIT = 0.6        # fraction of lines which must line up with a column edge
+MINALIGNED = 2      # lines which must line up with each column
+WARMUP = 8          # pages of each parity to learn the layout from
+
+
+def fits(gutters, lefts):
+    '''
+    Check whether a page's line left edges agree with the given gutters,
+    ie most lines start at (or just indented from) one of the column edges
+    and every column has some lines.
+    '''
+    lefts = np.asarray(lefts, dtype=int)
+    if not len(lefts):
+        return False
+    offsets = lefts[:, None] - (np.asarray(gutters) + COLMARGIN)[None, :]
+    aligned = (offsets >= -TOLERANCE) & (offsets <= INDENT + TOLERANCE)
+    return (aligned.any(axis=1).mean() >= MINFIT
+            and (aligned.sum(axis=0) >= MINALIGNED).all())
+
+
+class ColumnCache():
+    '''
+    Column layout for a volume, learnt separately for odd and even pages
+    since facing pages are offset by ~300px due to the binding gutter.
+
+    The first WARMUP pages of each parity which produce columns are used to
+    learn the layout (the median of their gutters), after which it's fixed.
+    Callers learn() from pages in page order so the result is the same no
+    matter how the pages were processed.
+    '''
+
+    def __init__(self, warmup=WARMUP):
+        self.warmup = warmup
+        self.samples = ([], [])
+        self.layouts = [None, None]
+
+    def layout(self, pagenum):
+        '''
+        Return the learnt gutters for a page, or None if still warming up
+        '''
+        return self.layouts[pagenum % 2]
+
+    def ready(self):
+        return None not in self.layouts
+
+    def learn(self, pagenum, gutters):
+        parity = pagenum % 2
+        if gutters is None or self.layouts[parity] is not None:
+            return
+        samples = self.samples[parity]
+        samples.append(gutters)
+        if len(samples) >= self.warmup:
+            median = np.median(np.array(samples), axis=0)
+            self.layouts[parity] = tuple(int(g) for g in median)
@@ -0,0 +1,75 @@
+'''
+Build manifest for incremental rebuilds.
+
+For every page we've written we record a key which is a hash of everything
+that went into it - the page's ABBYY XML, the stylesheet, the CSS, the code
+which post-processes it and the column layout it was given - along with the
+column gutters that were found for it.  If the key for a page hasn't changed
+since the last run (and the output file is still there) there's no need to
+parse or transform it again.
+'''
+import hashlib
+import os
+
+
+def filedigest(paths):
+    '''
+    MD5 of the contents of a list of files
+    '''
+    h = hashlib.md5()
+    for path in paths:
+        with open(path, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def sourcefile(module):
+    return os.path.splitext(module.__file__)[0] + '.py'
+
+
+def pagekey(version, digest, cached):
+    '''
+    Key for a page given the build version, the MD5 of the page's XML and
+    the cached column layout (if any) that the page will be checked against.
+    '''
+    return hashlib.md5('%s %s %s' % (version, digest, cached)).hexdigest()
+
+
+class Manifest():
+    '''
+    Page number -> (key, columns) for the pages in the output directory,
+    stored one page per line as tab separated text.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.pages = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    pagenum, key, columns = line.split()
+                    if columns == '-':
+                        columns = None
+                    else:
+                        columns = tuple(map(int, columns.split(',')))
+                    self.pages[int(pagenum)] = (key, columns)
+
+    def current(self, pagenum, key):
+        '''
+        Returns True if the page was last built with the same key
+        '''
+        return self.pages.get(pagenum, (None, None))[0] == key
+
+    def columns(self, pagenum):
+        return self.pages[pagenum][1]
+
+    def update(self, pagenum, key, columns):
+        self.pages[pagenum] = (key, columns)
+
+    def save(self):
+        with open(self.path + '.tmp', 'w') as f:
+            for pagenum in sorted(self.pages):
+                key, columns = self.pages[pagenum]
+                f.write('%d\t%s\t%s\n' % (pagenum, key,
+                        ','.join(map(str, columns)) if columns else '-'))
+        os.rename(self.path + '.tmp', self.path)
@@ -0,0 +1,216 @@
+'''
+Per page metrics for the hOCR pipeline.
+
+Rather than printing diagnostics as it goes, each page's processing fills in
+a PageMetrics record - stage timings, block counts before and after
+merging, the column gutters, line counts per column and flags for anything
+that looked wrong - and these are written out one JSON object per line so
+they can be aggregated across a volume.  For example:
+
+  {"page": 46, "line": 60710, "columns": [447, 1201, 1950],
+   "blocks": {"found": 9, "merged": 4, "final": 3}, "lines": [71, 74, 70],
+   "flags": ["tangled", "rebuilt"], "spliced": 10,
+   "time": {"read": 0.041, "transform": 0.061, "findcolumns": 0.003, ...}}
+
+Usage:
+    python metrics.py output/oed-vol1_metrics.jsonl [count]
+'''
+from contextlib import contextmanager
+import json
+import os
+import sys
+import time
+
+TOPN = 10
+
+
+class PageMetrics(dict):
+    '''
+    Metrics for a single page.  It's a plain dict underneath so that it can
+    be pickled back from pool workers and dumped as JSON.
+    '''
+
+    def __init__(self, pagenum):
+        dict.__init__(self, page=pagenum, flags=[], time={})
+
+    @contextmanager
+    def timer(self, stage):
+        '''
+        Context manager which adds the time spent in its body to a stage
+        '''
+        start = time.time()
+        try:
+            yield
+        finally:
+            times = self['time']
+            times[stage] = times.get(stage, 0) + time.time() - start
+
+    def flag(self, name):
+        if name not in self['flags']:
+            self['flags'].append(name)
+
+
+def timedpages(pages, times):
+    '''
+    Pass through a (pagenum, ...) iterator, recording in times how long it
+    took to produce each page.
+    '''
+    pages = iter(pages)
+    while True:
+        start = time.time()
+        try:
+            page = next(pages)
+        except StopIteration:
+            return
+        times[page[0]] = time.time() - start
+        yield page
+
+
+class MetricsLog():
+    '''
+    Append only JSONL file of page metrics, keeping the records in memory
+    for the end of run summary.  The records from the last run are kept
+    for pages which aren't reprocessed (eg because this run was for a range
+    of pages) and are available from previous().  The log is written to a
+    .part file and only replaces the last one when it's closed.
+    '''
+
+    def __init__(self, path, keep=True):
+        self.path = path
+        self.last = {}
+        if keep and os.path.exists(path):
+            self.last = dict((record['page'], record) for record in load(path))
+        self.f = open(path + '.part', 'w')
+        self.records = []
+
+    def previous(self, pagenum):
+        '''
+        Return the metrics from the last run for a page as a PageMetrics
+        with no timings, or an empty one if there aren't any
+        '''
+        record = PageMetrics(pagenum)
+        record.update(self.last.get(pagenum, {}))
+        record['time'] = {}
+        return record
+
+    def write(self, record):
+        self.f.write(json.dumps(record, sort_keys=True) + '\n')
+        self.records.append(record)
+
+    def close(self):
+        '''
+        Close the log.  Pages from the last run which weren't seen in this one
+        are carried over.
+        '''
+        self.f.close()
+        seen = set(record['page'] for record in self.records)
+        missing = [self.previous(pagenum) for pagenum in self.last
+                   if pagenum not in seen]
+        if missing:
+            self.records = sorted(self.records + missing,
+                                  key=lambda record: record['page'])
+            save(self.path, self.records)
+            os.remove(self.path + '.part')
+        else:
+            os.rename(self.path + '.part', self.path)
+
+
+def load(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def save(path, records):
+    with open(path + '.tmp', 'w') as f:
+        for record in records:
+            f.write(json.dumps(record, sort_keys=True) + '\n')
+    os.rename(path + '.tmp', path)
+
+
+def merge(paths):
+    '''
+    Combine metrics logs (eg of the shards of a volume), later logs taking
+    precedence for pages which appear in more than one.  Returns the
+    records in page order.
+    '''
+    pages = {}
+    for path in paths:
+        if os.path.exists(path):
+            for record in load(path):
+                pages[record['page']] = record
+    records = []
+    for pagenum in sorted(pages):
+        record = PageMetrics(pagenum)
+        record.update(pages[pagenum])
+        records.append(record)
+    return records
+
+
+def badness(record):
+    '''
+    Rough measure of how broken a page's segmentation was
+    '''
+    blocks = record.get('blocks', {})
+    return (len(record['flags']), blocks.get('found', 0) - 3,
+            record.get('spliced', 0))
+
+
+def summary(records, count=TOPN):
+    '''
+    Return a report of totals by stage & flag and the slowest and most
+    broken pages as a list of lines.
+    '''
+    processed = [r for r in records if r['time']]
+    lines = ['%d pages, %d processed' % (len(records), len(processed))]
+    if not processed:
+        return lines
+
+    totals = {}
+    for record in processed:
+        for stage, elapsed in record['time'].items():
+            totals[stage] = totals.get(stage, 0) + elapsed
+    total = sum(totals.values())
+    lines.append('%.1fs total, %.1f pages/sec' % (total, len(processed) / total
+                                                  if total else 0))
+    for stage, elapsed in sorted(totals.items(), key=lambda t: -t[1]):
+        lines.append('  %-12s %8.2fs %5.1f%%' % (stage, elapsed,
+                                                 100 * elapsed / total))
+
+    flags = {}
+    for record in processed:
+        for flag in record['flags']:
+            flags[flag] = flags.get(flag, 0) + 1
+    if flags:
+        lines.append('Flags:')
+        for flag, n in sorted(flags.items(), key=lambda t: (-t[1], t[0])):
+            lines.append('  %-12s %5d pages' % (flag, n))
+
+    lines.append('Slowest pages:')
+    for record in sorted(processed, key=lambda r: -sum(r['time'].values()))[:count]:
+        lines.append('  %4d %6.2fs' % (record['page'], sum(record['time'].values())))
+
+    corrections = sum(len(r.get('corrections', [])) for r in processed)
+    if corrections:
+        lines.append('%d corrections' % corrections)
+
+    broken = [r for r in processed if r['flags']]
+    if broken:
+        lines.append('Most broken pages:')
+        for record in sorted(broken, key=lambda r: (tuple(-b for b in badness(r)),
+                                                    r['page']))[:count]:
+            lines.append('  %4d %2d blocks  %s' % (
+                record['page'], record.get('blocks', {}).get('found', 0),
+                ' '.join(record['flags'])))
+    return lines
+
+
+def main():
+    if len(sys.argv) < 2:
+        print __doc__
+        sys.exit(1)
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else TOPN
+    for line in summary(load(sys.argv[1]), count):
+        print line
+
+if __name__ == '__main__':
+    main()
@@ -4,7 +4,7 @@ Grab original source files from:
 pdf: http://www.archive.org/download/oed01arch/oed01arch.pdf
 jp2: http://www.archive.org/download/oed01arch/oed01arch_jp2.tar   
 
-Put them inside oed/
+Put them inside oed/ (download_sources() will fetch and verify them).
 
 cache/ directory is created and used for storing results of processing.
 
@@ -13,10 +13,37 @@ Dictionary
 
 Dictionary itself begins on p.25 of first scan volume.
 '''
+from collections import deque
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import os
+import re
+import shutil
+import subprocess
+import tarfile
+import tempfile
+
+import volumes
 
 TIF_DIR = './cache/tif'
 PDF_DIR = './cache/pdf'
+SOURCE_DIR = './oed'
+PDF_URL = 'http://www.archive.org/download/oed01arch/oed01arch.pdf'
+JP2_URL = 'http://www.archive.org/download/oed01arch/oed01arch_jp2.tar'
+GS = 'gs'
+CHUNK = 20  # pages per Ghostscript run
+RESOLUTION = 300
+DEVICE = 'tiffg4'
+CONVERT = 'convert'
+THRESHOLD = '50%'  # for binarizing the grayscale scans
+JP2_PAGE = re.compile(r'_(\d+)\.jp2$')
+
+class GhostscriptError(Exception):
+    pass
+
+class ConvertError(Exception):
+    pass
+
 def ensure_dir(dir):
     if not os.path.exists(dir): os.makedirs(dir)
 ensure_dir(TIF_DIR)
@@ -26,74 +53,313 @@ def basename(path):
     basename = os.path.basename(path)
     return os.path.splitext(basename)[0]
 
-def pdf2tif(pdf):
-    basename = os.path.basename(pdf)
-    outfile = os.path.splitext(basename)[0] + '-%03d.tif'
-    outfile = os.path.join(TIF_DIR, outfile)
-    first_page = 1
-    last_page = 10
-    cmd = 'gs -q -dNOPAUSE -dBATCH -dSAFER -r300x300 -sDEVICE=tiffg3 ' + \
-        '-dFirstPage=%s -dLastPage=%s ' % (first_page, last_page) + \
-        '-sOutputFile="%s" -c save pop -f "%s"' % (outfile, pdf)
-    os.system(cmd)
-
-def chop_pdf(in_fp, out_fp):
-    '''Chop up the large pdf file (250MB, 1.3k pages) into more manageable
-    chunks (gs b0rks on the whole thing).
+def download_sources(urls=(PDF_URL, JP2_URL)):
+    '''Download the source files into SOURCE_DIR, checking them against the
+    sizes and checksums the Internet Archive publishes for the item.
+    '''
+    import fetch
+    ensure_dir(SOURCE_DIR)
+    for url in urls:
+        local = os.path.join(SOURCE_DIR, url.split('/')[-1])
+        if not os.path.exists(local):
+            print 'Downloading %s to %s' % (url, local)
+            fetch.fetchia(url, local)
+
+def pdfpagecount(pdf):
+    '''Number of pages in a pdf, as counted by Ghostscript (which only reads
+    the cross reference table & page tree, not the whole file).  The path
+    is passed as the string File rather than pasted into the PostScript, so
+    it can have parentheses or backslashes in it.
+    '''
+    cmd = [GS, '-q', '-dNODISPLAY', '-dNOSAFER', '-dNOPAUSE', '-dBATCH',
+           '-sFile=%s' % pdf, '-c', 'File (r) file runpdfbegin pdfpagecount = quit']
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    out = p.communicate()[0]
+    m = re.search(r'^(\d+)\s*$', out, re.M)
+    if p.returncode or not m:
+        raise GhostscriptError('Unable to count pages of %s: %s' % (pdf, out.strip()))
+    return int(m.group(1))
+
+def chunks(first_page, last_page, size=CHUNK):
+    '''Split a range of pages into (first, last) chunks of at most size pages'''
+    return [(start, min(start + size - 1, last_page))
+            for start in range(first_page, last_page + 1, size)]
+
+def tif_fp(pdf, page_num):
+    return os.path.join(TIF_DIR, '%s-%04d.tif' % (basename(pdf), page_num))
+
+def gs_command(pdf, outfile, first_page, last_page, device=DEVICE,
+               resolution=RESOLUTION):
+    return [GS, '-q', '-dNOPAUSE', '-dBATCH', '-dSAFER',
+            '-r%dx%d' % (resolution, resolution), '-sDEVICE=%s' % device,
+            '-dFirstPage=%d' % first_page, '-dLastPage=%d' % last_page,
+            '-sOutputFile=%s' % outfile, '-f', pdf]
+
+def rasterize_chunk(task):
+    '''Rasterize one chunk of pages with Ghostscript.  The pages are written
+    to a scratch directory and only moved into place once gs has succeeded,
+    so a chunk is either all there or not at all.  Returns None if all went
+    well, otherwise an error message.
+    '''
+    pdf, first_page, last_page, device, resolution = task
+    tmpdir = tempfile.mkdtemp(dir=TIF_DIR)
+    try:
+        # gs numbers the output files from 1 whatever the first page is
+        outfile = os.path.join(tmpdir, 'page-%04d.tif')
+        p = subprocess.Popen(gs_command(pdf, outfile, first_page, last_page,
+                                        device, resolution),
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        out = p.communicate()[0]
+        if p.returncode:
+            return 'gs exited with %d: %s' % (p.returncode, out.strip()[-500:])
+        done = []
+        for ii, page_num in enumerate(range(first_page, last_page + 1), 1):
+            src = outfile % ii
+            if not os.path.exists(src):
+                return 'gs produced no output for page %d' % page_num
+            done.append((src, tif_fp(pdf, page_num)))
+        for src, dest in done:
+            os.rename(src, dest)
+        return None
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+def pdf2tif(pdf, first_page=1, last_page=None, jobs=None, size=CHUNK,
+            device=DEVICE, resolution=RESOLUTION):
+    '''Rasterize a range of pages of a pdf (all of it by default) to one
+    tiff per page, running Ghostscript over chunks of pages in parallel.
+    Chunks whose tiffs already exist are skipped, so an interrupted run can
+    simply be restarted.  Returns the number of pages rasterized.
+    '''
+    if last_page is None:
+        last_page = pdfpagecount(pdf)
+    todo = [(pdf, first, last, device, resolution)
+            for first, last in chunks(first_page, last_page, size)
+            if not all(os.path.exists(tif_fp(pdf, page_num))
+                       for page_num in range(first, last + 1))]
+    if not todo:
+        return 0
+    # gs is single threaded, so one per core is as many as will help
+    cpus = multiprocessing.cpu_count()
+    jobs = min(jobs or cpus, cpus, len(todo))
+    pool = ThreadPool(jobs)
+    failed = []
+    count = 0
+    try:
+        for task, error in zip(todo, pool.imap(rasterize_chunk, todo)):
+            first, last = task[1:3]
+            if error:
+                print 'Pages %d-%d failed: %s' % (first, last, error)
+                failed.append('%d-%d' % (first, last))
+            else:
+                print 'Rasterized pages %d-%d' % (first, last)
+                count += last - first + 1
+    finally:
+        pool.close()
+        pool.join()
+    if failed:
+        raise GhostscriptError('Failed to rasterize pages %s of %s'
+                               % (', '.join(failed), pdf))
+    return count
+
+def chop_pdf(in_fp, out_fp, first_page=25, last_page=34):
+    '''Chop a range of pages out of the large pdf file (250MB, 1.3k pages)
+    into a more manageable one.  Ghostscript only reads the pages it needs,
+    so this doesn't load the whole thing.
     '''
-    from pyPdf import PdfFileWriter, PdfFileReader
-
-    output = PdfFileWriter()
-    input1 = PdfFileReader(file(in_fp, "rb"))
-    for ii in range(10):
-        output.addPage(input1.getPage(24+ii))
-    # finally, write "output" to document-output.pdf
-    outputStream = file(out_fp, "wb")
-    output.write(outputStream)
-    outputStream.close()
-
-def jp22tif(src, dest):
+    cmd = [GS, '-q', '-dNOPAUSE', '-dBATCH', '-dSAFER', '-sDEVICE=pdfwrite',
+           '-dFirstPage=%d' % first_page, '-dLastPage=%d' % last_page,
+           '-sOutputFile=%s' % out_fp, '-f', in_fp]
+    if subprocess.call(cmd):
+        raise GhostscriptError('Failed to extract pages %d-%d of %s'
+                               % (first_page, last_page, in_fp))
+
+def convert_command(src, dest, gray=False):
+    '''ImageMagick command to convert a jp2 to a compact tiff - bilevel with
+    CCITT G4 compression (~100KB a page) or, if gray, 8 bit grayscale with
+    LZW compression.
+    '''
+    cmd = [CONVERT, src, '-colorspace', 'Gray']
+    if gray:
+        cmd += ['-depth', '8', '-compress', 'LZW']
+    else:
+        cmd += ['-threshold', THRESHOLD, '-type', 'bilevel', '-compress', 'Group4']
+    return cmd + ['tif:' + dest]
+
+def jp22tif(src, dest, gray=False):
     '''Convert jpeg 2000 documents to tiff.
 
     Requires imagemagick's convert command line utility.
-    
-    Remarks: for our purposes this has the disadvantage that a 1.5MB jp2 doc
-    becomes a 30MB tiff!
+
+    A straight conversion turns a 1.5MB jp2 into a 30MB RGB tiff, so we
+    binarize (or at least grayscale) and compress it.
     '''
-    cmd = 'convert %s %s' % (src, dest)
-    os.system(cmd)
+    if subprocess.call(convert_command(src, dest, gray)):
+        raise ConvertError('Failed to convert %s' % src)
+
+def convert_jp2(task):
+    '''Convert a jp2 held in memory, piping it through convert.  The tiff
+    is only moved into place once it's complete.  Returns None if all went
+    well, otherwise an error message.
+    '''
+    data, dest, gray = task
+    p = subprocess.Popen(convert_command('jp2:-', dest + '.part', gray),
+                         stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                         stderr=subprocess.STDOUT)
+    out = p.communicate(data)[0]
+    if p.returncode or not os.path.exists(dest + '.part'):
+        if os.path.exists(dest + '.part'):
+            os.remove(dest + '.part')
+        return 'convert exited with %d: %s' % (p.returncode, out.strip()[-500:])
+    os.rename(dest + '.part', dest)
+    return None
+
+def open_tar(tar_fp):
+    '''Open a tar file (or URL) for streaming.  Members can only be read in
+    order, but nothing is extracted to disk or seeked.
+    '''
+    if tar_fp.startswith('http'):
+        import requests
+        r = requests.get(tar_fp, stream=True, timeout=60)
+        r.raise_for_status()
+        return tarfile.open(fileobj=r.raw, mode='r|*')
+    return tarfile.open(tar_fp, mode='r|*')
+
+def jp2_members(tar, first_page=1, last_page=None, skip=None):
+    '''Generator yielding (page_num, name, data) for the jp2 images in a
+    streamed tar file between first_page and last_page.  The images are
+    numbered by leaf, from 0, but the page numbers are the ABBYY & pdf ones,
+    the same as the rest of the pipeline.  Pages for which skip(name) is
+    True aren't read.
+    '''
+    for member in tar:
+        m = JP2_PAGE.search(member.name)
+        if not member.isfile() or not m:
+            continue
+        page_num = volumes.leafpage(int(m.group(1)))
+        if (page_num < first_page or last_page is not None and page_num > last_page
+                or skip and skip(member.name)):
+            continue
+        yield page_num, member.name, tar.extractfile(member).read()
+
+def jp2tar2tif(tar_fp, first_page=1, last_page=None, jobs=None, gray=False):
+    '''Convert the jp2 images in a tar file (eg oed01arch_jp2.tar, which can
+    also be a URL) straight to compact tiffs in TIF_DIR, without extracting
+    the tar.  Images are decoded in a pool of convert processes, with only a
+    few in memory at a time.  Pages whose tiffs already exist are skipped.
+    Returns the number of pages converted.
+    '''
+    def dest(name):
+        return os.path.join(TIF_DIR, basename(name) + '.tif')
+
+    jobs = jobs or multiprocessing.cpu_count()
+    # convert does the work, so threads are enough to keep it busy
+    pool = ThreadPool(jobs)
+    pending = deque()
+    failed = []
+    count = [0]
+
+    def drain(limit):
+        while len(pending) > limit:
+            page_num, result = pending.popleft()
+            error = result.get()
+            if error:
+                print 'Page %d failed: %s' % (page_num, error)
+                failed.append(page_num)
+            else:
+                count[0] += 1
+
+    tar = open_tar(tar_fp)
+    try:
+        for page_num, name, data in jp2_members(
+                tar, first_page, last_page, lambda name: os.path.exists(dest(name))):
+            print 'Converting %s' % name
+            pending.append((page_num, pool.apply_async(convert_jp2,
+                                                       ((data, dest(name), gray),))))
+            drain(2 * jobs)
+        drain(0)
+    finally:
+        tar.close()
+        pool.close()
+        pool.join()
+    if failed:
+        raise ConvertError('Failed to convert pages %s of %s'
+                           % (', '.join(map(str, failed)), tar_fp))
+    return count[0]
 
 def get_jp2_fp(page_num):
     num = str(page_num).rjust(4, '0')
     fp = 'oed/oed01arch_jp2/oed01arch_%s.jp2' % num
     return fp
 
-def tesseract():
-    pass
+def tesseract(images, metrics=None, jobs=None):
+    '''OCR page images with tesseract, writing hOCR pages in the same form
+    as abbyy2hocr.xsl to cache/hocr.  If we have the metrics of an ABBYY run
+    the columns of each page are OCRed separately.  Returns the number of
+    pages.
+    '''
+    import tess2hocr
+    layout = tess2hocr.metricslayout(metrics) if metrics else None
+    count = 0
+    for image, dom in tess2hocr.ocrpages(images, layout, jobs):
+        print 'Writing %s' % tess2hocr.hocrfile(image)
+        dom.write(tess2hocr.hocrfile(image), pretty_print=True)
+        count += 1
+    return count
 
 def main():
     usage = \
-'''%prog [options] 
+'''%prog [options] [oed01arch.pdf | oed01arch_jp2.tar]
 
 Process oed to plain text.'''
     import optparse
     parser = optparse.OptionParser(usage)
+    parser.add_option('-d', '--download', action='store_true', default=False,
+                      help='download the source pdf and jp2 files')
+    parser.add_option('-p', '--pages', metavar='N[-M]',
+                      help='page or range of pages to rasterize, convert or OCR, '
+                      'numbered as in the pdf & ABBYY file (jp2 leaf + 1) [default: all]')
+    parser.add_option('-j', '--jobs', type='int', default=None,
+                      help='number of Ghostscript or convert processes [default: one per core]')
+    parser.add_option('-g', '--gray', action='store_true', default=False,
+                      help='convert jp2 images to grayscale rather than bilevel tiffs')
+    parser.add_option('-o', '--ocr', action='store_true', default=False,
+                      help='OCR the tiffs in %s with tesseract' % TIF_DIR)
+    parser.add_option('-m', '--metrics',
+                      help='ABBYY metrics file giving the columns to OCR separately, '
+                      'eg output/oed-vol1_metrics.jsonl')
     options, args = parser.parse_args()
+    if options.download:
+        download_sources()
+    first_page, last_page = 1, None
+    if options.pages:
+        first, _, last = options.pages.partition('-')
+        first_page = int(first)
+        last_page = int(last or first)
     if len(args) > 0:
-        pdf2tif(args[0])
+        if args[0].endswith('.tar'):
+            print 'Converted %d pages' % jp2tar2tif(args[0], first_page, last_page,
+                                                    options.jobs, options.gray)
+        else:
+            print 'Rasterized %d pages' % pdf2tif(args[0], first_page, last_page,
+                                                  options.jobs)
+    if options.ocr:
+        import tess2hocr
+        images = []
+        for name in sorted(os.listdir(TIF_DIR)):
+            page_num = tess2hocr.imagepage(name)
+            if page_num and first_page <= page_num <= (last_page or page_num):
+                images.append(os.path.join(TIF_DIR, name))
+        print 'OCRed %d pages' % tesseract(images, options.metrics, options.jobs)
 
 def test_pdf_route():
     '''Produces unusable tiffs ...'''
     in_fp = 'oed/oed01arch.pdf'
-    out_fp = os.path.join(PDF_DIR, 'chunk1.pdf')
-    chop_pdf(in_fp, out_fp)
-    pdf2tif(out_fp)
+    pdf2tif(in_fp, 25, 34)
 
 def test_jp2_route():
-    src = get_jp2_fp(26)
-    dest = os.path.join(TIF_DIR, basename(src) + '.tif')
-    jp22tif(src,dest)
+    jp2tar2tif('oed/oed01arch_jp2.tar', 26, 26)
 
 if __name__ == '__main__':
-    test_jp2_route()
+    main()
 
@@ -36,146 +36,61 @@ Page characteristics:
   - small caps indicates a cross reference wherever it occurs - ideally should be hyperlinked
 - main words occur in alphabetical order (duh!)
 '''
-from collections import Counter
+import abbyy2hocr
+import abbyyindex
+from collections import deque
+import geometry
+from geometry import BoundingBox, PageGeometry
 import gzip
+import headwords
+import layout
 import lxml.etree as ET
-import matplotlib.pyplot as plt
-import matplotlib.patches as mpatches
-from matplotlib.collections import PatchCollection
+import metrics
+import multiprocessing
 import numpy as np
-from operator import itemgetter
+import optparse
 import os
-import requests
+import re
 import shutil
+from StringIO import StringIO
+import sys
+import time
+import volumes
 #from xml.etree import cElementTree
 #import zlib
 
 DEBUG = False
-PAGESTART = 26  # 351  # 26
-PAGELIMIT = 1275
 SIZE = 5 * 1024 * 1024
-XMLTEMPLATE = 'output/oed-vol1_p%d.xml'
-HTMLTEMPLATE = 'output/oed-vol1_p%04d.html'
-IATEMPLATE = 'https://archive.org/stream/oed01arch#page/%d/mode/1up'
-HEADER = ['<?xml version="1.0" encoding="UTF-8"?>',
-          # '<document version="1.0" producer="LuraDocument XML Exporter for ABBYY FineReader" pagesCount="1"',
-          # 'xmlns="http://www.abbyy.com/FineReader_xml/FineReader6-schema-v1.xml" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:schemaLocation="http://www.abbyy.com/FineReader_xml/FineReader6-schema-v1.xml http://www.abbyy.com/FineReader_xml/FineReader6-schema-v1.xml">',
-          ]
-FILENAME = 'https://ia600401.us.archive.org/7/items/oed01arch/oed01arch_abbyy.gz'
-
-
-class BoundingBox():
-        left = 0
-        top = 0
-        right = 0
-        bottom = 0
-
-        def __init__(self, bbox):
-            self.left = bbox[0]
-            self.top = bbox[1]
-            self.right = bbox[2]
-            self.bottom = bbox[3]
-
-        def inner(self, b2):
-                '''
-                Checks two bounding boxes to see if either completely contains
-                the other.  If a completely contained box is found, that inner box
-                is returned, otherwise None is returned.
-                '''
-                if self.contains(b2):
-                        return b2
-                if b2.contains(self):
-                        return self
-                return None
-
-        def contains(self,b2):
-                '''
-                Returns True if b2 is contained by b1
-                '''
-                # top, left, bottom, right - 0,0 in upper left
-                return b2.left >= left and b2.top >= top and b2.bottom <= bottom and b2.right <= b1.right
-
-        def intersects(self,b2):
-                '''
-                Tests two bounding boxes to see if they intersect (or touch). Returns True
-                if they do and false if they don't.
-                '''
-                return not (self.left >= b2.right or b2.left >= self.right
-                            or self.top >= b2.bottom or b2.top >= self.bottom)
-
-        def width(self):
-                return self.right - self.left
-        def height(self):
-                return self.bottom - self.top
-        def centerx(self):
-                return self.left+self.width()/2
-
-        def union(self,b2):
-                return BoundingBox(min(self.left,b2.left), min(self.top,b2.top),
-                                       max(self.right,b2.right), max(self.bottom, b2.bottom) )
-
-        def maximize(self,b2):
-                '''
-                Maximize our bounding box with the other boxes bounds.
-                '''
-                self.left = min(self.left,b2.left)
-                self.top = min(self.top,b2.top)
-                self.right = max(self.right,b2.right)
-                self.bottom = max(self.bottom, b2.bottom)
-
-        def column(self, cols):
-            '''
-            Return the column index for the bounding because, given a list
-            of column left margins.
-            '''
-            if self.right < cols[0]:
-                # in the left margin
-                return -1
-            for i in range(1, len(cols)):
-                if self.left < cols[i] - 10:
-                    return i-1
-            return len(cols)-1
-
-        def __str__(self):
-                return "bbox %d %d %d %d" % (self.left, self.top, self.right, self.bottom)
-
-        def __repr__(self):
-                return "%s %d %d" % (str(self), self.width(), self.height())
-
-
-def bound_box(block):
-        # TODO: refactor to return BoundingBox object
-        bbox = block.attrib['title'].split('bbox')[1]
-        return map(int, bbox.strip().split(' '))
-
-
-def extendblock(block1, block2):
+CHUNKSIZE = 256 * 1024
+SIDEGAP = 30  # max gap between side by side blocks in pixels
+XMLTEMPLATE = 'output/p%d.xml'
+SEARCHDB = 'output/oed-search.sqlite'
+ABBYYNS = 'http://www.abbyy.com/FineReader_xml/FineReader6-schema-v1.xml'
+LINKS = re.compile(r'(<a id="(prev|next)" href=")([^"]*)(")')
+
+
+def extendblock(block1, block2, geom):
         '''
         Merge contents of block2 into block1
         '''
-        bb1 = BoundingBox(bound_box(block1))
-        bb2 = BoundingBox(bound_box(block2))
+        bb1 = geom.bbox(block1)
+        bb2 = geom.bbox(block2)
         if DEBUG:
             print("merging two blocks: %s, %s" % (bb1, bb2))
         block1.extend(block2.findall("*"))
-        bb1.maximize(bb2)
-        block1.attrib['title'] = str(bb1)
+        geom.boxes[block1] = bb1.union(bb2)
+        geom.update(block1)
         if DEBUG:
-            print("resulting block: %s" % bb1)
-        removeblock(block2)
+            print("resulting block: %s" % geom.bbox(block1))
+        removeblock(block2, geom)
 
 
-def removeblock(block):
+def removeblock(block, geom):
         block.find("..").remove(block)
-        block.clear
-
-
-def blocktop(block):
-    bbox = BoundingBox(bound_box(block))
-    return bbox.top
+        geom.removeblock(block)
 
 
-def mergeblocks(dom, columns):
+def mergeblocks(dom, columns, geom, metrics):
         '''
         Sort text blocks by column and merge those where the columns
         were split up into multiple blocks.
@@ -184,7 +99,7 @@ def mergeblocks(dom, columns):
         '''
         cols = [[] for i in range(3)]
         page_bb = BoundingBox([1500, 1500, 1500, 1500]) # Starting page bounding box - center point of page
-        blocks = dom.xpath(".//div[contains(concat(' ',@class,' '),' ocr_carea ')]")
+        blocks = list(geom.blocks)
         if DEBUG:
             print 'Found %d blocks' % len(blocks)
         if len(blocks) <= 3:
@@ -192,15 +107,17 @@ def mergeblocks(dom, columns):
         bboxes = []
         for i in range(len(blocks)):
                 block = blocks[i]
-                bbox = BoundingBox(bound_box(block))
+                bbox = geom.bbox(block)
                 bboxes.append(bbox)
                 page_bb.maximize(bbox)
 
                 col = bbox.column(columns)
                 # TODO: Filter / warn on runts
                 if col < 0:
-                    removeblock(block)
-                    print 'Removed ', repr(bbox)
+                    removeblock(block, geom)
+                    metrics['removed'] = metrics.get('removed', 0) + 1
+                    if DEBUG:
+                        print 'Removed ', repr(bbox)
                 else:
                     cols[col].append(block)
                     if DEBUG:
@@ -208,25 +125,8 @@ def mergeblocks(dom, columns):
 
         # Graphical display of our bounding boxes for debugging
         if DEBUG:
-            fig, ax = plt.subplots()
-            ax.axis([0, 2700, 3600, 0])
-            patches = []
-
-            # add a rectangle for each bounding box
-            for bb in bboxes:
-                rect = mpatches.Rectangle([bb.left, bb.top],
-                                          bb.right - bb.left,
-                                          bb.bottom - bb.top, ec="none")
-                patches.append(rect)
-
-            colors = np.linspace(0, 1, len(patches))
-            collection = PatchCollection(patches, cmap=plt.cm.hsv, alpha=0.3)
-            collection.set_array(np.array(colors))
-            ax.add_collection(collection)
-
-            plt.subplots_adjust(left=0, right=1, bottom=0, top=1)
-
-            plt.show(block=True)
+            import diagnostics
+            diagnostics.show(diagnostics.plotblocks, bboxes)
 
         # ** need to watch for overlapping bboxes ie bad segmentation**
 
@@ -236,8 +136,8 @@ def mergeblocks(dom, columns):
                 continue
             lastcenter = -2000
             lastblock = None
-            for block in sorted(col, key = lambda b: BoundingBox(bound_box(b)).top):
-                bbox = BoundingBox(bound_box(block))
+            for block in sorted(col, key = lambda b: geom.bbox(b).top):
+                bbox = geom.bbox(block)
 
                 # Nominal column width is ~720-750 pixels
                 w = bbox.width()
@@ -258,41 +158,215 @@ def mergeblocks(dom, columns):
                     print 'Center delta: ', lastcenter - c, w, h, c, lastcenter
                 # TODO: Remove this sanity check since they should be in right cols?
                 if (abs(lastcenter - c) < 450):
-                        extendblock(lastblock, block)
+                        extendblock(lastblock, block, geom)
                 else:
                         lastcenter = c
                         lastblock = block
 
-        pw = page_bb.width()
-        ph = page_bb.height()
-        print "Page: %s" % (repr(page_bb))
-        blocks = dom.xpath(".//div[contains(concat(' ',@class,' '),' ocr_carea ')]")
+        blocks = geom.blocks
         if DEBUG:
+            print "Page: %s" % (repr(page_bb))
             print 'Final block count:  %d' % len(blocks)
         if len(blocks) != 3:
-                print '  * wrong # blocks on this page: %d' % len(blocks)
-                for bbox in bboxes:
-                        print bbox
+                metrics.flag('wrongblocks')
                 if DEBUG:
+                    for bbox in bboxes:
+                            print bbox
                     assert False
 
-def numberandlink(dom,pagenum):
-	# TODO Add link to page image at Internet Archives
+def tangledblocks(geom, columns):
+        '''
+        Find pairs of blocks in the same column which overlap or sit side by
+        side (rather than one above the other), which simple merging can't
+        untangle.
+        '''
+        index = geom.blockindex()
+        order = dict((block, i) for i, block in enumerate(geom.blocks))
+        result = []
+        for block in geom.blocks:
+            bbox = geom.bbox(block)
+            col = bbox.column(columns)
+            # widen the box to catch neighbours across a narrow gap & ignore
+            # boxes which only share a sliver at the top or bottom
+            near = BoundingBox([bbox.left - SIDEGAP, bbox.top + SIDEGAP,
+                                bbox.right + SIDEGAP, bbox.bottom - SIDEGAP])
+            for other in index.intersecting(near):
+                if order[other] > order[block] and geom.bbox(other).column(columns) == col:
+                    result.append((block, other))
+        return result
+
+
+def splicelines(lines, geom):
+        '''
+        Splice lines which have been split side by side (eg by a block split
+        down the middle of a column) back together.  lines should all be from
+        the same column.  Returns the remaining lines sorted top to bottom.
+        '''
+        index = geom.lineindex(lines)
+        left = min(geom.bbox(line).left for line in lines)
+        right = max(geom.bbox(line).right for line in lines)
+        spliced = set()
+        result = []
+        for line in sorted(lines, key=lambda l: geom.bbox(l).top):
+            if line in spliced:
+                continue
+            bbox = geom.bbox(line)
+            # the middle half of the line, extended across the column
+            quarter = bbox.height() / 4
+            row = BoundingBox([left, bbox.top + quarter, right + 1, bbox.bottom - quarter])
+            pieces = [line]
+            for other in index.intersecting(row):
+                if other is line or other in spliced:
+                    continue
+                obox = geom.bbox(other)
+                if not any(obox.intersects(geom.bbox(p)) for p in pieces):
+                    pieces.append(other)
+            pieces.sort(key=lambda l: geom.bbox(l).left)
+            first = pieces[0]
+            for piece in pieces[1:]:
+                if DEBUG:
+                    print 'Splicing line %s onto %s' % (geom.bbox(piece), geom.bbox(first))
+                if len(first):
+                    first[-1].tail = (first[-1].tail or '') + ' '
+                else:
+                    first.text = (first.text or '') + ' '
+                first.extend(piece.getchildren())
+                geom.boxes[first] = geom.bbox(first).union(geom.bbox(piece))
+                geom.update(first)
+                piece.getparent().remove(piece)
+                geom.removeline(piece)
+                spliced.add(piece)
+            spliced.add(first)
+            result.append(first)
+        return result
+
+
+def rebuildcolumns(dom, columns, geom, blockof, metrics):
+        '''
+        Throw away the page segmentation and construct three column blocks
+        de novo from the lines on the page, splicing lines and paragraphs
+        which were split by the bad segmentation.  blockof maps paragraphs
+        to the blocks they were originally segmented into.
+        '''
+        if not geom.blocks:
+            return
+        container = geom.blocks[0].getparent()
+        position = container.index(geom.blocks[0])
+
+        lines = [line for line in geom.lines if geom.bbox(line).right >= columns[0]]
+        if not lines:
+            return
+        origpar = dict((line, line.getparent()) for line in lines)
+        origblock = dict((line, blockof.get(par)) for line, par in origpar.items())
+        colindex = layout.assign([geom.bbox(line).left for line in lines], columns)
+        collines = [[], [], []]
+        for line, col in zip(lines, colindex):
+            collines[col].append(line)
+
+        newblocks = []
+        classes = ['col_left', 'col_center', 'col_right']
+        for col in range(3):
+            if not collines[col]:
+                continue
+            ordered = splicelines(collines[col], geom)
+            if len(ordered) < len(collines[col]):
+                metrics['spliced'] = (metrics.get('spliced', 0)
+                                      + len(collines[col]) - len(ordered))
+            rights = sorted(geom.bbox(line).right for line in ordered)
+            # lines this far right run to the end of the column
+            fullwidth = rights[len(rights) * 9 / 10] - 40
+            block = ET.Element('div')
+            block.set('title', '')
+            block.set('class', 'ocr_carea column ' + classes[col])
+            par = None
+            last = None
+            bbox = None
+            for line in ordered:
+                if par is None or origpar[line] is not origpar[last]:
+                    # A paragraph which carries on from one block into the
+                    # next is a continuation if the previous line is full width
+                    if not (par is not None
+                            and origblock[line] is not origblock[last]
+                            and geom.bbox(last).right >= fullwidth):
+                        par = ET.SubElement(block, 'p')
+                        par.set('class', 'ocr_par')
+                par.append(line)
+                bbox = geom.bbox(line) if bbox is None else bbox.union(geom.bbox(line))
+                last = line
+            geom.boxes[block] = bbox
+            block.set('title', 'blockType: Text ' + str(bbox))
+            newblocks.append(block)
+
+        metrics.flag('rebuilt')
+        if DEBUG:
+            print 'Rebuilt %d blocks as %d columns' % (len(geom.blocks), len(newblocks))
+        for block in list(geom.blocks):
+            removeblock(block, geom)
+        for block in newblocks:
+            container.insert(position, block)
+            position += 1
+            geom.blocks.append(block)
+        geom.refreshlines(dom)
+
+def numberandlink(dom, pagenum, volume):
         nxt = dom.find(".//a[@id='next']")
         prev = dom.find(".//a[@id='prev']")
         orig = dom.find(".//a[@id='orig']")
-        relativetemplate = HTMLTEMPLATE.split('/')[-1]
-        nxt.attrib['href'] = relativetemplate % (pagenum+1)
-        prev.attrib['href'] = relativetemplate % (pagenum-1)
-        orig.attrib['href'] = IATEMPLATE % (pagenum-24)
+        nxt.attrib['href'] = os.path.basename(volume.htmlfile(pagenum+1))
+        prev.attrib['href'] = os.path.basename(volume.htmlfile(pagenum-1))
+        orig.attrib['href'] = volume.image(pagenum)
         return dom
 
 
-def findcolumns(dom):
+def relink(html, prev, nxt):
+        '''
+        Point the previous & next links of a serialized page at other files
+        '''
+        targets = {'prev': prev, 'next': nxt}
+        return LINKS.sub(lambda m: m.group(1) + targets[m.group(2)] + m.group(4), html)
+
+
+def fixlinks(vols):
+        '''
+        Point the previous & next links of the pages of a run of volumes at
+        the pages which actually exist, skipping missing pages and joining
+        the ends of volumes (and of the shards they were built in).  Returns
+        the number of pages rewritten.
+        '''
+        bundles = dict((volume.key, openbundle(volume)) for volume in vols)
+        pages = [(volume, pagenum) for volume in vols
+                 for pagenum in outputpages(volume, bundles[volume.key])]
+        count = 0
+        try:
+            for i, (volume, pagenum) in enumerate(pages):
+                # the ends of the run link back to the page itself
+                targets = pages[max(i - 1, 0)], pages[min(i + 1, len(pages) - 1)]
+                html = readpage(volume, pagenum, bundles[volume.key])
+                fixed = relink(html, *[target.pagename(targetpage)
+                                       for target, targetpage in targets])
+                if fixed != html:
+                    if bundles[volume.key] is not None:
+                        bundles[volume.key].add(volume.pagename(pagenum), fixed)
+                    else:
+                        with open(volume.htmlfile(pagenum), 'w') as f:
+                            f.write(fixed)
+                    count += 1
+        finally:
+            for pagebundle in bundles.values():
+                if pagebundle is not None:
+                    pagebundle.close()
+        return count
+
+
+def findcolumns(dom, geom, metrics, cached=None):
         '''
         Look at line beginning & ending coordinates to compute column gutters.
         Returns a 3-tuple of X page coordinates.
 
+        If we've learnt the column layout for this side of the volume (cached)
+        we only check that the page agrees with it, and fall back to it for
+        pages which are too sparse or skewed to work out on their own.
+
         TODO: Although this information is currently used as input to the block
         merging method, it's becoming clear that we should probably just ignore
         the page segmentation and construct the columns de novo from the line
@@ -301,126 +375,105 @@ def findcolumns(dom):
         split horizontally by mistake.
         '''
 
-        lines = dom.findall(".//span[@class='ocr_line']")
-        if len(lines) < 30:
+        lines = geom.lines
+        if not lines or (len(lines) < 30 and not cached):
+            metrics.flag('nocolumns')
             return
-        leftcounter = Counter()
-        rightcounter = Counter()
-        total = 0
-        for line in lines:
-                # TODO: Check for lines which span multiple columns
-                # TODO: Compute bounds of entire text area here too?
-                bbox = line.attrib['title'].strip().split(' ')[1:]
-                left = int(bbox[0])
-                right = int(bbox[2])
-                width = right - left
-                total += width
-                leftcounter[left] += 1
-                rightcounter[right] += 1
-        print 'Average width: ', total / len(lines)
-
-        # TODO: Need a better algorithm here which takes into account density to handle outliers
-
-        # Find right column's left edge
-        last = None
-        for k, v in sorted(leftcounter.items(), key=itemgetter(0), reverse=True):
-                if last and last - k > 200:
-                        # if we're up to the next column, return previous value
-                        col3 = last - COLMARGIN
-                        break
-                if k < 2400 and v > 1:
-                        last = k
-
-        # Left column is easy
-        col1 = int(sorted(leftcounter.items(), key=itemgetter(0))[0][0])
-        if col1 > COLMARGIN:
-            col1 -= COLMARGIN
+        coords = geom.linearray()
+        lefts = coords[:, 0]
+        rights = coords[:, 2]
+        # TODO: Check for lines which span multiple columns
+        # TODO: Compute bounds of entire text area here too?
+        if DEBUG:
+            print 'Average width: ', int((rights - lefts).sum()) / len(lines)
+
+        if cached and layout.fits(cached, lefts):
+            gutters = cached
         else:
-            col1 = 0
-
-        # Middle column
-        last = None
-        triggered = False
-        col2 = -1
-        for k, v in sorted(leftcounter.items(), key=itemgetter(0)):
-            if v > 2:  # threshold low frequency bins
-                if last:
-                    if DEBUG:
-                        pass
-                        print "Mid col left/delta: ", k, k-last
-                    if triggered:
-                        if k - last < 10:
-                            col2 = last - COLMARGIN
-                            if DEBUG:
-                                print 'Col 2 left = ', col2
-                            break
-                    elif k - last > 100:
-                        triggered = True
-                last = k
-
-        # Workaround for pathological case - should never happen, but does!
-        # TODO: should bail in the case of a page with no recognizable content
-        if col2 == -1:
-            col2 = (col3 - col1) / 2 + col1
-
-        print "Columns: ", col1, col2, col3
-        #print "Column left edge frequency: "
-        #for k,v in leftcounter.most_common(20):
-        #       print k,v
-        columnlines = [[],[],[]]
-        for line in lines:
-                left = int(line.attrib['title'].strip().split(' ')[1])
-                if left >= col3:
-                        columnlines[2].append(line)
-                elif left <= col2:
-                        columnlines[0].append(line)
-                else:
-                        columnlines[1].append(line)
+            gutters = None
+            if len(lines) >= 30:
+                gutters = layout.findgutters([lefts])[0]
+            if cached:
+                metrics.flag('misfit')
+                gutters = gutters or cached
+        if not gutters:
+            # TODO: should bail in the case of a page with no recognizable content
+            metrics.flag('nocolumns')
+            return
+        col1, col2, col3 = gutters
+        metrics['columns'] = gutters
+
+        if DEBUG:
+            print "Columns: ", col1, col2, col3
+        colindex = layout.assign(lefts, gutters)
+        # line indexes ordered by column, then from top to bottom
+        order = np.lexsort((coords[:, 1], colindex))
+        counts = np.bincount(colindex, minlength=3)
+        columnlines = []
+        start = 0
+        for count in counts:
+            columnlines.append([lines[i] for i in order[start:start + count]])
+            start += count
         totallines = len(lines)
-        print "Total lines: ", totallines
+        metrics['lines'] = [int(count) for count in counts]
+        if DEBUG:
+            print "Total lines: ", totallines
 
         # Visualization of line start/end histogram for debugging
+        # (python diagnostics.py renders these for a range of pages)
         if DEBUG and True:
-            plt.axis([0, 2700, 0, 45])
-            xsorted = sorted(leftcounter.items(), key=itemgetter(0))
-            xvals, counts = zip(*xsorted)  # unzip our values for plot
-            plt.bar(xvals, counts, 10)
-            xsorted = sorted(rightcounter.items(), key=itemgetter(0))
-            xvals, counts = zip(*xsorted)  # unzip our values for plot
-            plt.bar(xvals, counts, 10, color='green')
-            plt.bar([col1, col2, col3], [40]*3, color='red',
-                    linestyle='dotted', width=10)
-            plt.show(block=True)
+            import diagnostics
+            diagnostics.show(diagnostics.plothistogram, lefts, rights, gutters)
 
         # Sanity check line counts
         for i in range(3):
             if DEBUG:
                 print "Col %d lines" % i, len(columnlines[i])
             if len(columnlines[i]) * 1.0 / totallines < 0.25:
-                    print '*** short column %d %d' % (i, len(columnlines[i]))
+                    metrics.flag('shortcolumn')
                     if DEBUG:
+                        print '*** short column %d %d' % (i, len(columnlines[i]))
                         assert False
-            columnlines[i].sort(key=lambda line:  int(line.attrib['title'].strip().split(' ')[2]))
 
         # Print top and bottom of page
-        print("First words: %s\t%s\t%s" % tuple([unicode(columnlines[i][0].xpath("string()")) for i in range(3)]))
-        # TODO: Validate & strip head words & page numbers
-        print("Last words: %s\t%s\t%s" % tuple([unicode(columnlines[i][-1].xpath("string()")) for i in range(3)]))
+        if DEBUG:
+            print("First words: %s\t%s\t%s" % tuple([unicode(col[0].xpath("string()")) if col else u'' for col in columnlines]))
+            # TODO: Validate & strip head words & page numbers
+            print("Last words: %s\t%s\t%s" % tuple([unicode(col[-1].xpath("string()")) if col else u'' for col in columnlines]))
         # TODO: Look for and remove signature marks - VOL. I. in col #1
         # 999 in col 3 (at the bottom of every 8th page - img 33/pg 9 is #2 & img 41/pg 17 is #3)
 
         return col1, col2, col3
 
-def postprocess(dom):
+def postprocess(dom, metrics, cached=None):
         '''
-        Post-process our HTML in an attempt to improve it
+        Post-process our HTML in an attempt to improve it.  The DOM is modified
+        in place and the column gutters found (if any) are returned.  What we
+        found & did is recorded in metrics.
         '''
-        columns = findcolumns(dom)
-        if columns:
-            print "Columns: ", columns
+        # parse block & line coordinates once for all the steps below
+        geom = PageGeometry(dom)
+        metrics['blocks'] = {'found': len(geom.blocks)}
 
-            # merge multiple blocks in a column
-            mergeblocks(dom, columns)
+        with metrics.timer('findcolumns'):
+            columns = findcolumns(dom, geom, metrics, cached)
+        if columns:
+            with metrics.timer('mergeblocks'):
+                tangled = tangledblocks(geom, columns)
+                if tangled:
+                    metrics.flag('tangled')
+                # remember which block each paragraph was in before merging
+                blockof = dict((par, block) for block in geom.blocks for par in block)
+
+                # merge multiple blocks in a column
+                mergeblocks(dom, columns, geom, metrics)
+            metrics['blocks']['merged'] = len(geom.blocks)
+
+            # start over from the lines if the segmentation is still a mess
+            if tangled or len(geom.blocks) != 3:
+                with metrics.timer('rebuild'):
+                    rebuildcolumns(dom, columns, geom, blockof, metrics)
+        metrics['blocks']['final'] = len(geom.blocks)
 
         # strip headwords & page number after validating no missing pages
         # strip trailing signature marks
@@ -432,27 +485,352 @@ def postprocess(dom):
 
         # concatenate hyphenated words
 
-        return dom
+        return columns
 
 def download(remote,local):
+    import fetch
     print 'Downloading %s to %s' % (remote, local)
-    r = requests.get(remote, stream=True)
-    if r.status_code == 200:
-        with open(local, 'wb') as f:
-            for chunk in r.iter_content():
-                f.write(chunk)
-    else:
-        print 'Download failed with status code %d' % r.status_code
-
-def processfile(filename):
-    localfile = 'input/'+filename.split('/')[-1]
-    if not os.path.exists(localfile):
-        download(filename,localfile)
+    try:
+        fetch.fetchia(remote, local)
+    except fetch.FetchError as e:
+        print 'Download failed: %s' % e
+        raise
+
+
+def stripnamespace(page):
+    '''
+    Strip namespaces from a page's elements since our stylesheet matches
+    plain element names.
+    '''
+    for el in page.iter(ET.Element):
+        if el.tag[0] == '{':
+            el.tag = el.tag.split('}', 1)[1]
+    return page
+
+
+def lastline(page):
+    '''
+    Source line of the last element in a page (ie roughly the number of XML
+    lines processed so far).
+    '''
+    el = page
+    while len(el):
+        el = el[-1]
+    return el.sourceline
+
+
+def iterpages(f, start=1, limit=sys.maxint):
+    '''
+    Generator which incrementally parses an ABBYY document from a file
+    object and yields (pagenum, linenum, page) for each page between start
+    and limit, where page is the <page> element.
+
+    Pages are only valid until the next one is requested since we throw them
+    away as we go to keep memory use flat.
+    '''
+    parser = ET.XMLPullParser(events=('end',), tag='{*}page')
+    pagenum = 0
+    first = True
+    while True:
+        chunk = f.read(CHUNKSIZE)
+        if first:
+            # The document element declares the FineReader schema as the
+            # default namespace.  Dropping the declaration is much cheaper
+            # than renaming every element of every page after the fact.
+            chunk = chunk.replace(' xmlns="%s"' % ABBYYNS, '', 1)
+            first = False
+        if chunk:
+            parser.feed(chunk)
+        else:
+            parser.close()
+        for event, page in parser.read_events():
+            pagenum += 1
+            # Detach the finished page from the document so it can be freed
+            page.getparent().remove(page)
+            if pagenum < start:
+                continue
+            if pagenum > limit:
+                return
+            if page.tag[0] == '{':
+                stripnamespace(page)
 
-    xslt = ET.parse('abbyy2hocr.xsl')
-    transform = ET.XSLT(xslt)
+            # Our extracted XML file if it's interesting for debugging
+            #with file(XMLTEMPLATE % pagenum, 'w') as of:
+            #    of.write(ET.tostring(page))
+
+            yield pagenum, lastline(page), page
+            page.clear()
+        if not chunk:
+            break
+
+
+def readpages(localfile, start=1, limit=sys.maxint, skip=None, raw=False):
+    '''
+    Yield (pagenum, linenum, page) for the pages between start and limit
+    of a gzipped ABBYY file.  If the volume has been indexed we jump straight
+    to the pages, otherwise we parse from the beginning.
+
+    skip is an optional callable taking the page number and MD5 of the page
+    XML (only available for indexed volumes).  If it returns True the page
+    isn't read or parsed and is yielded as None.  If raw, the pages of an
+    indexed volume are yielded as their XML text, unparsed, for pool workers
+    to parse themselves.
+    '''
+    if abbyyindex.isindexed(localfile):
+        index = abbyyindex.PageIndex(localfile)
+        try:
+            for pagenum in range(max(start, 1), min(limit, index.lastpage) + 1):
+                linenum = index.line(pagenum)
+                if skip and skip(pagenum, index.digest(pagenum)):
+                    yield pagenum, linenum, None
+                else:
+                    xml = index.page(pagenum)
+                    yield pagenum, linenum, xml if raw else ET.fromstring(xml)
+        finally:
+            index.close()
+        return
 
-    shutil.copyfile('3column.css','output/3column.css')
+    with gzip.open(localfile, 'rb') as f:
+        for page in iterpages(f, start, limit):
+            yield page
+
+
+def renderpage(transform, page, pagenum, volume, cached=None, corrector=None):
+    '''
+    Transform a single ABBYY page element to hOCR, post-process it (and
+    correct it against the lexicon if given a corrector) and return the
+    serialized HTML, the column gutters found and the page's metrics.
+    '''
+    pagemetrics = metrics.PageMetrics(pagenum)
+
+    # Transform to hOCR
+    with pagemetrics.timer('transform'):
+        newdom = transform(page)
+
+    columns = postprocess(newdom, pagemetrics, cached)
+
+    if corrector:
+        with pagemetrics.timer('correct'):
+            pagemetrics['corrections'] = corrector.correct(newdom)
+
+    with pagemetrics.timer('headwords'):
+        header, words = headwords.extract(newdom)
+    pagemetrics['header'] = header
+    pagemetrics['headwords'] = words
+    if columns and not words:
+        pagemetrics.flag('noheadwords')
+
+    # number page and add next/previous page link
+    with pagemetrics.timer('serialize'):
+        newdom = numberandlink(newdom, pagenum, volume)
+        # always, so that search, entries & corrections can link to lines
+        # of pages rendered without the search index
+        geometry.numberlines(newdom)
+        html = ET.tostring(newdom, pretty_print=True)
+
+    return html, columns, pagemetrics
+
+
+def writepage(volume, pagenum, linenum, html, pages=None):
+    print 'Writing page %d - %d XML lines processed' % (pagenum,linenum)
+    if pages is not None:
+        pages.add(volume.pagename(pagenum), html)
+        return
+    with file(volume.htmlfile(pagenum), 'w') as of:
+        of.write(html)
+
+
+def readpage(volume, pagenum, pages=None):
+    '''
+    HTML of an output page, from the volume's bundle if given one
+    '''
+    if pages is not None:
+        return pages.read(volume.pagename(pagenum))
+    with open(volume.htmlfile(pagenum)) as f:
+        return f.read()
+
+
+def openbundle(volume):
+    '''
+    The volume's page bundle opened for appending, or None if its pages are
+    separate files
+    '''
+    path = volume.output('pages.gz')
+    if not os.path.exists(path):
+        return None
+    import bundle
+    return bundle.Bundle(path, 'a')
+
+
+def outputpages(volume, pages=None):
+    '''
+    Page numbers of a volume's output pages, in its bundle if given one
+    '''
+    return volume.pages(pages.names() if pages is not None else None)
+
+
+def copystylesheet(pages=None):
+    '''
+    Put the CSS alongside the pages, unless it's already there
+    '''
+    with open('3column.css', 'rb') as f:
+        css = f.read()
+    if pages is not None:
+        pages.add('3column.css', css)
+        return
+    dest = 'output/3column.css'
+    if os.path.exists(dest):
+        with open(dest, 'rb') as f:
+            if f.read() == css:
+                return
+    shutil.copyfile('3column.css', dest)
+
+
+def maketransform(engine='xslt'):
+    '''
+    Return a callable which transforms an ABBYY page to hOCR, using either
+    the XSLT stylesheet or the native Python builder (which merges runs of
+    low confidence characters).
+    '''
+    if engine == 'native':
+        return abbyy2hocr.transform
+    xslt = ET.parse('abbyy2hocr.xsl')
+    return ET.XSLT(xslt)
+
+
+# Per-process compiled stylesheet, volume & corrector for pool workers
+_transform = None
+_volume = None
+_corrector = None
+
+
+def _initworker(engine, volume, lexicon=None):
+    global _transform, _volume, _corrector
+    _transform = maketransform(engine)
+    _volume = volume
+    _corrector = makecorrector(lexicon)
+
+
+def _renderworker(page):
+    '''
+    Render a page in a pool worker.  Anything printed while processing
+    the page is captured and handed back so that the parent can replay
+    it in page order.
+    '''
+    pagenum, linenum, xml, cached = page
+    log = StringIO()
+    stdout = sys.stdout
+    sys.stdout = log
+    try:
+        start = time.time()
+        page = ET.fromstring(xml)
+        parsed = time.time() - start
+        html, columns, pagemetrics = renderpage(_transform, page, pagenum, _volume,
+                                               cached, _corrector)
+        pagemetrics['time']['parse'] = parsed
+    finally:
+        sys.stdout = stdout
+    return pagenum, linenum, log.getvalue(), html, columns, pagemetrics
+
+
+def makecorrector(lexicon):
+    '''
+    Return a Corrector for a lexicon file, or None if there isn't one
+    '''
+    if not lexicon:
+        return None
+    import correct
+    return correct.Corrector(correct.Lexicon.load(lexicon))
+
+
+def buildversion(engine, lexicon=None):
+    '''
+    Hash of everything apart from the page itself that goes into a rendered
+    page and the metrics carried forward for it - the stylesheet, CSS,
+    lexicon and the code which post-processes it and extracts its headwords.
+    '''
+    import entries
+    import manifest
+    modules = [sys.modules[__name__], abbyy2hocr, entries, geometry, headwords,
+               layout, metrics, volumes]
+    paths = ['abbyy2hocr.xsl', '3column.css'] + map(manifest.sourcefile, modules)
+    if lexicon:
+        import correct
+        paths += [manifest.sourcefile(correct), lexicon]
+    return '%s-%s' % (engine, manifest.filedigest(paths))
+
+
+def checkorder(pagemetrics, previous):
+    '''
+    Flag a page whose headwords are out of alphabetical order, carrying on
+    from the last headword before it.  Returns the last headword so far.
+    '''
+    if 'disorder' in pagemetrics['flags']:
+        pagemetrics['flags'].remove('disorder')
+    pagemetrics.pop('disorder', None)
+    # main words should be in alphabetical order right through the volume
+    words = pagemetrics.get('headwords', [])
+    disorder = headwords.disorder(words, previous)
+    if disorder:
+        pagemetrics.flag('disorder')
+        pagemetrics['disorder'] = disorder
+    return words[-1] if words else previous
+
+
+def recheckorder(records):
+    '''
+    Check the order of the headwords of a list of page records in page order
+    '''
+    lastword = None
+    for record in records:
+        lastword = checkorder(record, lastword)
+
+
+def saveheadwords(records, path):
+    headwords.HeadwordIndex((word, record['page']) for record in records
+                            for word in record.get('headwords', [])).save(path)
+
+
+def processfile(volume, jobs=1, start=None, limit=None, index=False,
+                engine='xslt', incremental=False, fulltext=False,
+                assemble=False, shard=None, lexicon=None, bundled=False,
+                indexpages=True):
+    '''
+    Process the pages of a volume from start to limit (by default its
+    usual range), or the given (i, n) shard of them.  Shards keep their own
+    metrics, manifest, headword & entry files which merge() combines.
+    If a lexicon file is given the pages are corrected against it.  If
+    bundled the pages are written to the volume's bundle rather than to
+    separate files.  If the volume has to be indexed and indexpages is False
+    only the page table is written, not the copy of the pages.
+    '''
+    localfile = volume.localfile
+    if not os.path.exists(localfile):
+        download(volume.url, localfile)
+    start = volume.start if start is None else start
+    limit = volume.limit if limit is None else limit
+
+    # Incremental builds need the per page hashes from the index and we
+    # need the number of pages to shard a volume of unknown length
+    if ((index or incremental or (shard and limit is None))
+            and not abbyyindex.isindexed(localfile)):
+        print 'Indexing %s' % localfile
+        print 'Indexed %d pages' % abbyyindex.buildindex(localfile, indexpages)
+    if limit is None:
+        limit = sys.maxint
+        if abbyyindex.isindexed(localfile):
+            pageindex = abbyyindex.PageIndex(localfile)
+            limit = pageindex.lastpage
+            pageindex.close()
+    if shard:
+        start, limit = volumes.shardrange(start, limit, shard)
+        print 'Shard %d of %d: pages %d-%d' % (shard + (start, limit))
+
+    pagebundle = None
+    if bundled:
+        import bundle
+        pagebundle = bundle.Bundle(volume.output('pages.gz', shard), 'a')
+    copystylesheet(pagebundle)
 
     # Old code to just read a few MB over the network & decompress it
     #    r = requests.get(f, stream=True)
@@ -460,45 +838,289 @@ def processfile(filename):
     #    zd = zlib.decompressobj(16+zlib.MAX_WBITS)
     #    lines = zd.decompress(buf).split('\n')
 
-    print 'Opening %s' % localfile
-    pagenum = 0
-    linenum = 0
-    with gzip.open(localfile, 'rb') as f:
-        for line in f:
-                linenum += 1
-                if line.startswith('<page'):
-                    pagenum += 1
-                    if pagenum < PAGESTART:
-                            continue
-                    if pagenum > PAGELIMIT:
-                        break
-                    xml = list(HEADER)
-                    while not line.startswith('</page'):
-                        xml.append(line)
-                        linenum += 1
-                        line = f.next()
-                    xml.append(line)
-            #        xml.append('</document>')
-
-            # Our extracted XML file if it's interesting for debugging
-                    #with file(XMLTEMPLATE % pagenum, 'w') as of:
-                    #    of.write('\n'.join(xml))
-
-                    dom = ET.fromstring('\n'.join(xml))
-
-                    # Transform to hOCR
-                    newdom = transform(dom)
-
-                    newdom = postprocess(newdom)
+    cache = layout.ColumnCache()
+    builds = None
+    skip = None
+    if incremental:
+        import manifest
+        builds = manifest.Manifest(volume.output('manifest.txt', shard))
+        version = buildversion(engine, lexicon)
+        keys = {}
+
+        def skip(pagenum, digest):
+            keys[pagenum] = manifest.pagekey(version, digest, cache.layout(pagenum))
+            if not builds.current(pagenum, keys[pagenum]):
+                return False
+            if pagebundle is not None:
+                return volume.pagename(pagenum) in pagebundle
+            return os.path.exists(volume.htmlfile(pagenum))
+
+    log = metrics.MetricsLog(volume.output('metrics.jsonl', shard))
+    readtimes = {}
+    lines = None
+    if fulltext:
+        import search
+        lines = search.SearchIndex(SEARCHDB)
+    entrylog = None
+    if assemble:
+        import entries
+        # carries on from the checkpoint for the page before start (if any),
+        # and the entries of the pages after the run are kept
+        entrylog = entries.EntryLog(volume.output('entries.jsonl', shard), start,
+                                    lambda pagenum: StringIO(readpage(volume, pagenum,
+                                                                      pagebundle)))
+
+    def finish(pagenum, linenum, html, columns, pagemetrics):
+        readtime = readtimes.pop(pagenum)
+        if html is None:
+            print 'Page %d is up to date' % pagenum
+            columns = builds.columns(pagenum)
+            pagemetrics = log.previous(pagenum)
+            pagemetrics['columns'] = columns
+            pagemetrics['uptodate'] = True
+        else:
+            pagemetrics['time']['read'] = readtime
+            with pagemetrics.timer('write'):
+                writepage(volume, pagenum, linenum, html, pagebundle)
+            if lines:
+                with pagemetrics.timer('search'):
+                    lines.addpage(volume.name, pagenum,
+                                  os.path.basename(volume.htmlfile(pagenum)), html)
+            if builds:
+                builds.update(pagenum, keys[pagenum], columns)
+        pagemetrics['line'] = linenum
+        if entrylog:
+            with pagemetrics.timer('entries'):
+                if html is None:
+                    html = readpage(volume, pagenum, pagebundle)
+                dom = ET.fromstring(html)
+                entrylog.feed(pagenum, dom)
+        log.write(pagemetrics)
+        cache.learn(pagenum, columns)
 
-		    # number page and add next/previous page link
-                    newdom = numberandlink(newdom, pagenum)
+    print 'Opening %s' % localfile
+    pages = metrics.timedpages(readpages(localfile, start, limit, skip, jobs > 1),
+                               readtimes)
+    try:
+        if jobs <= 1:
+            transform = maketransform(engine)
+            corrector = makecorrector(lexicon)
+            for pagenum, linenum, page in pages:
+                html, columns, pagemetrics = None, None, None
+                if page is not None:
+                    html, columns, pagemetrics = renderpage(
+                        transform, page, pagenum, volume, cache.layout(pagenum),
+                        corrector)
+                finish(pagenum, linenum, html, columns, pagemetrics)
+        else:
+            processparallel(pages, jobs, engine, volume, cache, finish, lexicon)
+    finally:
+        log.close()
+        if builds:
+            builds.save()
+        if lines:
+            lines.close()
+        if entrylog:
+            entrylog.close()
+            print 'Wrote %d entries' % entrylog.count
+        if pagebundle is not None:
+            waste = pagebundle.waste()
+            pagebundle.close()
+            # rewritten pages leave their old copies behind
+            if waste > os.path.getsize(pagebundle.path) / 2:
+                print 'Compacted %s, saving %d bytes' % (
+                    pagebundle.path, bundle.compact(pagebundle.path))
+    # the log now has the pages either side of the range from earlier runs
+    # too, so the order can be checked right through and the headword table
+    # covers the whole volume
+    recheckorder(log.records)
+    metrics.save(log.path, log.records)
+    saveheadwords(log.records, volume.output('headwords.txt', shard))
+    for line in metrics.summary(log.records):
+        print line
+
+
+def merge(vols, fulltext=False):
+    '''
+    Combine the output of sharded runs of a list of volumes - the metrics,
+    headword table & entries of each volume - and fix up the links between
+    pages across shard & volume boundaries.
+    '''
+    for volume in vols:
+        shards = volume.shardfiles('pages.gz')
+        if shards:
+            import bundle
+            pagebundle = bundle.Bundle(volume.output('pages.gz'), 'a')
+            for path in shards:
+                shard = bundle.Bundle(path)
+                for name in shard.names():
+                    pagebundle.copy(shard, name)
+                shard.close()
+                os.remove(path)
+                os.remove(bundle.indexfile(path))
+            print 'Merged %d bundles into %s' % (len(shards), pagebundle.path)
+            pagebundle.close()
+        shards = volume.shardfiles('metrics.jsonl')
+        path = volume.output('metrics.jsonl')
+        if shards:
+            print 'Merging %d shards of %s' % (len(shards), volume.name)
+            records = metrics.merge([path] + shards)
+            # recheck the order of the headwords across the shard boundaries
+            recheckorder(records)
+            metrics.save(path, records)
+            saveheadwords(records, volume.output('headwords.txt'))
+            for filename in shards + volume.shardfiles('headwords.txt'):
+                os.remove(filename)
+            for line in metrics.summary(records):
+                print line
+        shards = volume.shardfiles('entries.jsonl')
+        if shards:
+            import entries
+            pagebundle = openbundle(volume)
+            pagefile = volume.htmlfile
+            if pagebundle is not None:
+                pagefile = lambda pagenum: StringIO(readpage(volume, pagenum, pagebundle))
+            count = entries.mergeshards(shards, volume.output('entries.jsonl'),
+                                        pagefile)
+            if pagebundle is not None:
+                pagebundle.close()
+            print 'Merged %d entries' % count
+            for filename in shards:
+                os.remove(filename)
+                os.remove(filename + '.checkpoints')
+    print 'Fixed links on %d pages' % fixlinks(vols)
+    if fulltext:
+        import search
+        print 'Indexed %d pages' % search.indexpages(SEARCHDB, readoutput(vols))
+
+
+def readoutput(vols):
+    '''
+    Generator yielding (filename, html) for the output pages of volumes
+    '''
+    for volume in vols:
+        pagebundle = openbundle(volume)
+        try:
+            for pagenum in outputpages(volume, pagebundle):
+                yield volume.htmlfile(pagenum), readpage(volume, pagenum, pagebundle)
+        finally:
+            if pagebundle is not None:
+                pagebundle.close()
+
+
+def processparallel(pages, jobs, engine, volume, cache, finish, lexicon=None):
+    '''
+    Render pages in a pool of worker processes.
+    '''
+    # Keep a bounded window of pages in flight and collect them in the
+    # order they were read so output & log are the same as a serial run
+    pool = multiprocessing.Pool(jobs, _initworker, (engine, volume, lexicon))
+    pending = deque()
+
+    def drain(limit):
+        while len(pending) > limit:
+            result = pending.popleft()
+            if not isinstance(result, tuple):
+                result = result.get()
+            pagenum, linenum, log, html, columns, pagemetrics = result
+            sys.stdout.write(log)
+            finish(pagenum, linenum, html, columns, pagemetrics)
+
+    try:
+        for pagenum, linenum, page in pages:
+            if page is None:
+                # up to date, nothing to do
+                pending.append((pagenum, linenum, '', None, None, None))
+            else:
+                # Workers get their own copy of the page as XML text, which
+                # is just as it was read from an indexed volume
+                if not isinstance(page, basestring):
+                    page = ET.tostring(page)
+                task = (pagenum, linenum, page, cache.layout(pagenum))
+                pending.append(pool.apply_async(_renderworker, (task,)))
+            # While the column layout is being learnt each page has to wait
+            # for the ones before it, so that we learn the same thing as a
+            # serial run would
+            drain(2 * jobs if cache.ready() else 0)
+        drain(0)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
 
-                    print 'Writing page %d - %d XML lines processed' % (pagenum,linenum)
-                    with file(HTMLTEMPLATE % pagenum, 'w') as of:
-                        of.write(ET.tostring(newdom, pretty_print=True))
 
 def main():
-    processfile(FILENAME)
-
-main()
+    usage = \
+'''%prog [options]
+
+Convert ABBYY FineReader XML to hOCR pages.
+
+A full run can be split into shards, eg on four machines:
+
+    %prog -v all --shard 1/4
+    ...
+    %prog -v all --shard 4/4
+
+and once the output directories have been gathered together:
+
+    %prog -v all --merge'''
+    parser = optparse.OptionParser(usage)
+    parser.add_option('-v', '--volume', default='1',
+                      help='comma separated volumes to process (%s) or all '
+                      '[default: %%default]' % ','.join(v.key for v in volumes.VOLUMES))
+    parser.add_option('-j', '--jobs', type='int', default=1,
+                      help='number of pages to process in parallel [default: %default]')
+    parser.add_option('-p', '--pages', metavar='N[-M]',
+                      help='page or range of pages to process [default: '
+                      'the pages of the dictionary in each volume]')
+    parser.add_option('--shard', metavar='I/N',
+                      help='only process the I\'th of N equal slices of the pages')
+    parser.add_option('--merge', action='store_true', default=False,
+                      help='merge the output of sharded runs & fix up page links')
+    parser.add_option('-i', '--index', action='store_true', default=False,
+                      help='build a random access page index for the volume if needed')
+    parser.add_option('--no-pages', dest='indexpages', action='store_false', default=True,
+                      help='index the volume without the copy of its pages, which '
+                      'is about as big as the volume, reading pages by inflating it')
+    parser.add_option('--incremental', action='store_true', default=False,
+                      help='only rebuild pages whose input, stylesheet or code have changed')
+    parser.add_option('-s', '--search', action='store_true', default=False,
+                      help='add the pages to the full text search index %s' % SEARCHDB)
+    parser.add_option('--entries', action='store_true', default=False,
+                      help='assemble dictionary entries into output/<volume>_entries.jsonl')
+    parser.add_option('-e', '--engine', type='choice', choices=['xslt', 'native'],
+                      default='xslt',
+                      help='hOCR transform to use: xslt or native [default: %default]')
+    parser.add_option('-b', '--bundle', action='store_true', default=False,
+                      help='write the pages to one compressed bundle per volume, '
+                      'output/<volume>_pages.gz, instead of separate files')
+    parser.add_option('-c', '--correct', metavar='LEXICON',
+                      help='correct low confidence words against a lexicon '
+                      'built by correct.py, eg output/oed-lexicon.txt')
+    options, args = parser.parse_args()
+    try:
+        vols = volumes.lookup(options.volume)
+        shard = volumes.parseshard(options.shard) if options.shard else None
+    except ValueError as e:
+        parser.error(str(e))
+    if shard and options.search:
+        # shards may run concurrently against the same database
+        parser.error('add sharded runs to the search index with --merge --search')
+    if options.merge:
+        merge(vols, options.search)
+        return
+    start, limit = None, None
+    if options.pages:
+        first, _, last = options.pages.partition('-')
+        start = int(first)
+        limit = int(last or first)
+    for volume in vols:
+        processfile(volume, options.jobs, start, limit, options.index,
+                    options.engine, options.incremental, options.search,
+                    options.entries, shard, options.correct, options.bundle,
+                    options.indexpages)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,335 @@
+'''
+Local web server which renders the hOCR pages of the volumes on request.
+
+Rather than rerunning the batch over a whole volume to look at one page, each
+page is pulled out of the ABBYY file through its page index, transformed and
+post-processed when it's asked for.  Rendered pages are kept in an LRU cache
+bounded by their total size, and the pages either side of the one requested
+are rendered in the background so that paging through a volume doesn't have
+to wait.  The cache is emptied (and the stylesheet recompiled) whenever
+abbyy2hocr.xsl or 3column.css change, so they can be edited and the page
+reloaded.
+
+Pages are served at the same names as the batch writes them, eg
+/oed-vol1_p0026.html, and their previous & next links go to the neighbouring
+pages of the index, carrying on into the next volume that's available.  If a
+batch run has left a metrics file for a volume, the column layout learnt by
+that run is used, so pages come out as they would from the batch.
+
+Usage:
+    python pageserver.py [-v volumes] [-p port] [-e engine] [-m MB]
+'''
+import BaseHTTPServer
+from collections import OrderedDict
+import optparse
+import os
+import Queue
+import re
+import SocketServer
+from StringIO import StringIO
+import sys
+import threading
+
+import lxml.etree as ET
+
+import abbyyindex
+import layout
+import metrics
+import oedabby
+import volumes
+
+PORT = 8088
+MAXBYTES = 64 * 1024 * 1024
+PREFETCH = 2     # pages either side of the one requested to render ahead
+QUEUESIZE = 32   # pending prefetches, older ones are dropped
+WATCHED = ('abbyy2hocr.xsl', '3column.css')
+STYLESHEET = '3column.css'
+PAGEPATH = re.compile(r'^/(?P<volume>[^/]+)_p(?P<page>\d+)\.html$')
+
+
+class PageCache():
+    '''
+    Least recently used cache of rendered pages, bounded by the total
+    number of bytes of HTML rather than the number of pages.
+    '''
+
+    def __init__(self, maxbytes=MAXBYTES):
+        self.maxbytes = maxbytes
+        self.pages = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.pages)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.pages
+
+    def get(self, key):
+        with self.lock:
+            html = self.pages.pop(key, None)
+            if html is None:
+                self.misses += 1
+                return None
+            # move to the most recently used end
+            self.pages[key] = html
+            self.hits += 1
+            return html
+
+    def put(self, key, html):
+        with self.lock:
+            old = self.pages.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.pages[key] = html
+            self.size += len(html)
+            while self.size > self.maxbytes and len(self.pages) > 1:
+                key, old = self.pages.popitem(last=False)
+                self.size -= len(old)
+
+    def clear(self):
+        with self.lock:
+            self.pages.clear()
+            self.size = 0
+
+
+class PageRenderer():
+    '''
+    Renders pages of a set of volumes through their page indexes, caching
+    the results and prefetching the neighbours of each page asked for.
+    '''
+
+    def __init__(self, vols, engine='xslt', maxbytes=MAXBYTES, prefetch=PREFETCH):
+        self.engine = engine
+        self.cache = PageCache(maxbytes)
+        self.prefetch = prefetch
+        self.indexes = {}
+        self.layouts = {}
+        self.volumes = []
+        for volume in vols:
+            if not os.path.exists(volume.localfile):
+                print 'Skipping %s - no %s' % (volume.name, volume.localfile)
+                continue
+            if not abbyyindex.isindexed(volume.localfile):
+                print 'Indexing %s' % volume.localfile
+                abbyyindex.buildindex(volume.localfile)
+            self.indexes[volume.key] = abbyyindex.PageIndex(volume.localfile)
+            self.layouts[volume.key] = learntlayout(volume.output('metrics.jsonl'))
+            self.volumes.append(volume)
+        self.byname = dict((volume.name, volume) for volume in self.volumes)
+        # the transform & page files aren't safe to share between threads
+        self.renderlock = threading.Lock()
+        self.transform = oedabby.maketransform(engine)
+        self.stamp = watchstamp()
+        self.queue = Queue.LifoQueue(QUEUESIZE)
+        worker = threading.Thread(target=self._prefetcher)
+        worker.daemon = True
+        worker.start()
+
+    def close(self):
+        for index in self.indexes.values():
+            index.close()
+
+    def checkstale(self):
+        '''
+        Throw away the rendered pages if the stylesheet or CSS have changed
+        '''
+        stamp = watchstamp()
+        if stamp == self.stamp:
+            return False
+        with self.renderlock:
+            print 'Stylesheet changed, emptying the page cache'
+            self.transform = oedabby.maketransform(self.engine)
+            self.cache.clear()
+            self.stamp = stamp
+        return True
+
+    def lastpage(self, volume):
+        return self.indexes[volume.key].lastpage
+
+    def neighbours(self, volume, pagenum):
+        '''
+        Return the (volume, pagenum) of the previous & next pages, going on
+        into the volumes either side.  The ends link to the page itself.
+        '''
+        i = self.volumes.index(volume)
+        prev = nxt = (volume, pagenum)
+        if pagenum > 1:
+            prev = (volume, pagenum - 1)
+        elif i > 0:
+            prev = (self.volumes[i - 1], self.lastpage(self.volumes[i - 1]))
+        if pagenum < self.lastpage(volume):
+            nxt = (volume, pagenum + 1)
+        elif i < len(self.volumes) - 1:
+            nxt = (self.volumes[i + 1], 1)
+        return prev, nxt
+
+    def render(self, volume, pagenum):
+        '''
+        Render a page (or take it from the cache if another thread has
+        just rendered it)
+        '''
+        key = (volume.key, pagenum)
+        with self.renderlock:
+            if key in self.cache:
+                return self.cache.get(key)
+            # the post-processing is chatty
+            stdout = sys.stdout
+            sys.stdout = StringIO()
+            try:
+                page = ET.fromstring(self.indexes[volume.key].page(pagenum))
+                html, columns, pagemetrics = oedabby.renderpage(
+                    self.transform, page, pagenum, volume,
+                    self.layouts[volume.key](pagenum))
+            finally:
+                sys.stdout = stdout
+            html = oedabby.relink(html, *[os.path.basename(v.htmlfile(n))
+                                          for v, n in self.neighbours(volume, pagenum)])
+            self.cache.put(key, html)
+        return html
+
+    def page(self, volume, pagenum):
+        '''
+        Return the HTML of a page, rendering it if need be, and queue its
+        neighbours to be rendered in the background.
+        '''
+        self.checkstale()
+        html = self.cache.get((volume.key, pagenum))
+        if html is None:
+            html = self.render(volume, pagenum)
+        # furthest first, since the queue is last in first out
+        for distance in range(self.prefetch, 0, -1):
+            for n in (pagenum - distance, pagenum + distance):
+                if 1 <= n <= self.lastpage(volume):
+                    try:
+                        self.queue.put_nowait((volume, n))
+                    except Queue.Full:
+                        pass
+        return html
+
+    def _prefetcher(self):
+        while True:
+            volume, pagenum = self.queue.get()
+            if (volume.key, pagenum) not in self.cache:
+                try:
+                    self.render(volume, pagenum)
+                except Exception as e:
+                    print 'Prefetch of %s page %d failed: %s' % (volume.name, pagenum, e)
+
+
+def watchstamp():
+    return [os.path.getmtime(path) if os.path.exists(path) else None
+            for path in WATCHED]
+
+
+def learntlayout(path):
+    '''
+    Return a callable giving the cached column layout the batch used for a
+    page, learnt from its metrics file, or None for every page if there's
+    no metrics file.
+    '''
+    cache = layout.ColumnCache()
+    learnt = [None, None]  # the page each side's layout was learnt from
+    if os.path.exists(path):
+        for record in sorted(metrics.load(path), key=lambda r: r['page']):
+            cache.learn(record['page'], record.get('columns'))
+            parity = record['page'] % 2
+            if learnt[parity] is None and cache.layout(record['page']) is not None:
+                learnt[parity] = record['page']
+
+    def layoutfor(pagenum):
+        first = learnt[pagenum % 2]
+        return cache.layout(pagenum) if first is not None and pagenum > first else None
+    return layoutfor
+
+
+class PageHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        renderer = self.server.renderer
+        path = self.path.split('?')[0]
+        if path == '/':
+            return self.reply(contents(renderer))
+        if path == '/' + STYLESHEET:
+            with open(STYLESHEET) as f:
+                return self.reply(f.read(), 'text/css')
+        m = PAGEPATH.match(path)
+        volume = renderer.byname.get(m.group('volume')) if m else None
+        if not volume or not 1 <= int(m.group('page')) <= renderer.lastpage(volume):
+            return self.send_error(404)
+        try:
+            html = renderer.page(volume, int(m.group('page')))
+        except Exception as e:
+            return self.send_error(500, str(e))
+        self.reply(html)
+
+    def reply(self, body, contenttype='text/html'):
+        self.send_response(200)
+        self.send_header('Content-Type', contenttype)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class PageServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def contents(renderer):
+    '''
+    Home page linking to the first page of the dictionary in each volume
+    '''
+    html = ET.Element('html')
+    ET.SubElement(ET.SubElement(html, 'head'), 'title').text = 'OED pages'
+    body = ET.SubElement(html, 'body')
+    ul = ET.SubElement(body, 'ul')
+    for volume in renderer.volumes:
+        first = min(volume.start, renderer.lastpage(volume))
+        li = ET.SubElement(ul, 'li')
+        ET.SubElement(li, 'a', href='/' + os.path.basename(volume.htmlfile(first))
+                      ).text = volume.name
+        li[-1].tail = ' (%d pages)' % renderer.lastpage(volume)
+    cache = renderer.cache
+    ET.SubElement(body, 'p').text = (
+        'Cache: %d pages, %d KB of %d KB, %d hits, %d misses'
+        % (len(cache), cache.size / 1024, cache.maxbytes / 1024, cache.hits,
+           cache.misses))
+    return ET.tostring(html, pretty_print=True, method='html')
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('-v', '--volume', default='all',
+                      help='comma separated volumes to serve [default: %default]')
+    parser.add_option('-p', '--port', type='int', default=PORT,
+                      help='port to listen on [default: %default]')
+    parser.add_option('-e', '--engine', type='choice', choices=['xslt', 'native'],
+                      default='xslt', help='hOCR transform [default: %default]')
+    parser.add_option('-m', '--memory', type='int', default=MAXBYTES / 1024 / 1024,
+                      metavar='MB', help='size of the page cache [default: %default]')
+    options, args = parser.parse_args()
+    try:
+        vols = volumes.lookup(options.volume)
+    except ValueError as e:
+        parser.error(str(e))
+    renderer = PageRenderer(vols, options.engine, options.memory * 1024 * 1024)
+    if not renderer.volumes:
+        parser.error('none of the volumes have been downloaded')
+    server = PageServer(('localhost', options.port), PageHandler)
+    server.renderer = renderer
+    print 'Serving %s on http://localhost:%d/' % (
+        ', '.join(volume.name for volume in renderer.volumes), options.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        renderer.close()
+
+if __name__ == '__main__':
+    main()
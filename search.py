@@ -0,0 +1,209 @@
+'''
+Full text search over the generated hOCR pages.
+
+Every line of every page goes into an SQLite FTS5 index along with the
+volume, page, column, line number and bbox, so a hit can link straight to
+the line in the HTML page (each line has an id of line_<column>_<line>) and
+to the Internet Archive source image for the page.  One database can hold
+any number of volumes.
+
+We keep an MD5 of each page's HTML so pages are only reindexed when they've
+changed, which makes it cheap to update the index after a rebuild.
+
+Usage:
+    python search.py index output/oed-search.sqlite output/*.html
+    python search.py query output/oed-search.sqlite 'abandon NEAR obs'
+'''
+import hashlib
+import os
+import re
+import sqlite3
+import sys
+
+import lxml.etree as ET
+
+from geometry import anchor, columnblocks, numberlines
+
+LINEXPATH = "span[@class='ocr_line']"
+PAGEFILE = re.compile(r'(?P<volume>[^/]+)_p(?P<page>\d+)\.html$')
+LIMIT = 20
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS pages (
+    volume TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    href TEXT,
+    image TEXT,
+    digest TEXT,
+    PRIMARY KEY (volume, page)
+);
+CREATE TABLE IF NOT EXISTS lines (
+    id INTEGER PRIMARY KEY,
+    volume TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    col INTEGER NOT NULL,
+    line INTEGER NOT NULL,
+    anchor TEXT,
+    bbox TEXT,
+    text TEXT
+);
+CREATE INDEX IF NOT EXISTS lines_page ON lines (volume, page);
+CREATE VIRTUAL TABLE IF NOT EXISTS linetext USING fts5 (
+    text, content='lines', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 1'
+);
+CREATE TRIGGER IF NOT EXISTS lines_insert AFTER INSERT ON lines BEGIN
+    INSERT INTO linetext (rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS lines_delete AFTER DELETE ON lines BEGIN
+    INSERT INTO linetext (linetext, rowid, text)
+        VALUES ('delete', old.id, old.text);
+END;
+'''
+
+
+def pagelines(dom):
+    '''
+    Generator yielding (col, line, anchor, bbox, text) for the numbered
+    lines on a page.
+    '''
+    for col, block in enumerate(columnblocks(dom), 1):
+        for line, el in enumerate(block.iterfind('p/' + LINEXPATH), 1):
+            bbox = el.get('title', '').replace('bbox ', '', 1)
+            text = u' '.join(u''.join(el.itertext()).split())
+            yield col, line, el.get('id'), bbox, text
+
+
+class SearchIndex():
+    '''
+    On disk line index for one or more volumes.
+    '''
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        try:
+            self.db.executescript(SCHEMA)
+        except sqlite3.OperationalError as e:
+            raise sqlite3.OperationalError(
+                'SQLite %s without FTS5 support? %s' % (sqlite3.sqlite_version, e))
+
+    def current(self, volume, pagenum, digest):
+        '''
+        Returns True if the page has already been indexed with this digest
+        '''
+        row = self.db.execute('SELECT digest FROM pages WHERE volume = ? AND page = ?',
+                              (volume, pagenum)).fetchone()
+        return row is not None and row[0] == digest
+
+    def removepage(self, volume, pagenum):
+        self.db.execute('DELETE FROM lines WHERE volume = ? AND page = ?',
+                        (volume, pagenum))
+        self.db.execute('DELETE FROM pages WHERE volume = ? AND page = ?',
+                        (volume, pagenum))
+
+    def addpage(self, volume, pagenum, href, html):
+        '''
+        (Re)index a page given its serialized HTML, unless it's unchanged.
+        Returns True if the page was indexed.
+        '''
+        digest = hashlib.md5(html).hexdigest()
+        if self.current(volume, pagenum, digest):
+            return False
+        dom = ET.fromstring(html)
+        orig = dom.find(".//a[@id='orig']")
+        image = orig.get('href') if orig is not None else None
+        self.removepage(volume, pagenum)
+        self.db.executemany(
+            'INSERT INTO lines (volume, page, col, line, anchor, bbox, text) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            ((volume, pagenum) + row for row in pagelines(dom)))
+        self.db.execute('INSERT INTO pages (volume, page, href, image, digest) '
+                        'VALUES (?, ?, ?, ?, ?)',
+                        (volume, pagenum, href, image, digest))
+        return True
+
+    def search(self, query, limit=LIMIT, volume=None):
+        '''
+        Return up to limit of the best matching lines for an FTS5 query as
+        a list of dicts with the volume, page, col, line, bbox, text with
+        the matches highlighted, link to the line & source image link.
+        '''
+        sql = ('SELECT l.volume, l.page, l.col, l.line, l.bbox, '
+               "highlight(linetext, 0, '[', ']'), p.href, l.anchor, p.image "
+               'FROM linetext JOIN lines l ON l.id = linetext.rowid '
+               'JOIN pages p ON p.volume = l.volume AND p.page = l.page '
+               'WHERE linetext MATCH ?')
+        args = [query]
+        if volume:
+            sql += ' AND l.volume = ?'
+            args.append(volume)
+        sql += ' ORDER BY rank LIMIT ?'
+        args.append(limit)
+        hits = []
+        for row in self.db.execute(sql, args):
+            volume_, pagenum, col, line, bbox, text, href, anchor_, image = row
+            hits.append({'volume': volume_, 'page': pagenum, 'col': col,
+                         'line': line, 'bbox': bbox, 'text': text,
+                         'link': '%s#%s' % (href, anchor_), 'image': image})
+        return hits
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+def indexpages(path, pages):
+    '''
+    Index pages given as (filename, html) where the file is named
+    <volume>_p<page>.html, skipping those which haven't changed.  Returns
+    the number of pages (re)indexed.
+    '''
+    index = SearchIndex(path)
+    count = 0
+    try:
+        for filename, html in pages:
+            m = PAGEFILE.search(filename)
+            if not m:
+                continue
+            if index.addpage(m.group('volume'), int(m.group('page')),
+                             os.path.basename(filename), html):
+                count += 1
+    finally:
+        index.close()
+    return count
+
+
+def readfiles(filenames):
+    for filename in filenames:
+        with open(filename, 'rb') as f:
+            yield filename, f.read()
+
+
+def indexfiles(path, filenames):
+    '''
+    Index HTML page files, skipping those which haven't changed.  Returns
+    the number of pages (re)indexed.
+    '''
+    return indexpages(path, readfiles(f for f in filenames if PAGEFILE.search(f)))
+
+
+def main():
+    if len(sys.argv) < 4 or sys.argv[1] not in ('index', 'query'):
+        print __doc__
+        sys.exit(1)
+    command, path = sys.argv[1:3]
+    if command == 'index':
+        print 'Indexed %d pages' % indexfiles(path, sys.argv[3:])
+    else:
+        index = SearchIndex(path)
+        for hit in index.search(' '.join(sys.argv[3:])):
+            print ('%(volume)s p%(page)d col %(col)d line %(line)d\t%(text)s'
+                   % hit).encode('utf-8')
+            print '\t%(link)s\t%(image)s' % hit
+        index.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,347 @@
+'''
+OCR page images with tesseract and convert its hOCR to the structure that
+abbyy2hocr.xsl produces, so the pages can be post-processed (and everything
+downstream of that) exactly like the ABBYY ones.
+
+tesseract is run as a separate process per job from a bounded pool.  When we
+know a page's column gutters (eg from the metrics of an ABBYY run over the
+same scans, which share its pixel coordinates) each of the three columns is
+cropped out and recognized as a job of its own, which both spreads a page
+over more cores and saves tesseract from having to find the layout itself.
+Each column then becomes one text block.  Without gutters the whole page is
+one job and each of tesseract's text areas becomes a block.
+
+tesseract's output for each job is cached under cache/hocr keyed by the MD5
+of the image, the crop and the tesseract version & options, so rerunning a
+page (say after changing the conversion) doesn't OCR it again.
+
+Word confidences (x_wconf) are mapped onto the same low_confidence and
+very_low_confidence classes as ABBYY's character confidences and, where
+tesseract reports them, bold and italic words are wrapped in <b> and <em>.
+
+Usage:
+    python tess2hocr.py [-j jobs] [-m metrics.jsonl] image.tif [image.tif ...]
+'''
+import hashlib
+from multiprocessing.pool import ThreadPool
+import multiprocessing
+import optparse
+import os
+import re
+import subprocess
+import sys
+
+import lxml.etree as ET
+
+import abbyy2hocr
+from geometry import parsebbox
+import volumes
+
+TESSERACT = 'tesseract'
+CONVERT = 'convert'
+LANG = 'eng'
+PAGESEG = '3'    # fully automatic page segmentation
+COLUMNSEG = '4'  # single column of text of variable sizes
+CACHEDIR = 'cache/hocr'
+MARGIN = 20      # crop columns this far to the left of the gutters
+LEAFNUM = re.compile(r'_(\d+)\.tiff?$')  # jp2 scans, eg oed01arch_0025.tif
+PAGENUM = re.compile(r'(\d+)\.tiff?$')   # pdf pages, eg oed01arch-0026.tif
+WCONF = re.compile(r'x_wconf\s+(\d+)')
+LINECLASSES = ('ocr_line', 'ocr_textfloat', 'ocr_header', 'ocr_caption')
+
+
+class OCRError(Exception):
+    pass
+
+
+_version = []
+
+
+def version():
+    '''
+    tesseract's version string (part of the cache key)
+    '''
+    if not _version:
+        try:
+            p = subprocess.Popen([TESSERACT, '--version'], stdout=subprocess.PIPE,
+                                 stderr=subprocess.STDOUT)
+        except OSError as e:
+            raise OCRError('Unable to run %s: %s' % (TESSERACT, e))
+        _version.append(p.communicate()[0].split('\n')[0].strip())
+    return _version[0]
+
+
+def filedigest(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), ''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def crops(columns):
+    '''
+    Return the (left, right) strips to OCR for a page - one per column if
+    we know the gutters, otherwise the whole page as (0, None).
+    '''
+    if not columns:
+        return [(0, None)]
+    lefts = [max(0, gutter - MARGIN) for gutter in columns]
+    return zip([0] + lefts[1:], lefts[1:] + [None])
+
+
+def ocr(task):
+    '''
+    OCR a strip of an image, returning (image, crop, hOCR).  Runs in a pool
+    thread - the work is done by the tesseract (and convert) processes.
+    '''
+    image, digest, crop = task
+    left, right = crop
+    pageseg = PAGESEG if crop == (0, None) else COLUMNSEG
+    key = hashlib.md5('%s %s %s %s %s' % (digest, crop, version(), LANG,
+                                          pageseg)).hexdigest()
+    cachefile = os.path.join(CACHEDIR, key[:2], key + '.hocr')
+    if os.path.exists(cachefile):
+        with open(cachefile, 'rb') as f:
+            return image, crop, f.read()
+
+    data = None
+    source = image
+    if crop != (0, None):
+        # height is clipped to the image
+        geometry = '%dx1000000+%d+0' % ((right or 1000000) - left, left)
+        p = subprocess.Popen([CONVERT, image, '-crop', geometry, '+repage', 'png:-'],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        data, err = p.communicate()
+        if p.returncode:
+            raise OCRError('Unable to crop %s: %s' % (image, err.strip()))
+        source = 'stdin'
+    # tesseract's own threads would only fight with the pool's
+    env = dict(os.environ, OMP_THREAD_LIMIT='1')
+    p = subprocess.Popen([TESSERACT, source, 'stdout', '-l', LANG, '--psm', pageseg,
+                          'hocr'], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE, env=env)
+    hocr, err = p.communicate(data)
+    if p.returncode or not hocr.strip():
+        raise OCRError('tesseract failed on %s %s: %s' % (image, crop, err.strip()))
+
+    if not os.path.exists(os.path.dirname(cachefile)):
+        os.makedirs(os.path.dirname(cachefile))
+    with open(cachefile + '.tmp', 'wb') as f:
+        f.write(hocr)
+    os.rename(cachefile + '.tmp', cachefile)
+    return image, crop, hocr
+
+
+def parsehocr(hocr):
+    '''
+    Parse tesseract's XHTML, dropping the namespace
+    '''
+    root = ET.fromstring(hocr, ET.XMLParser(recover=True))
+    for el in root.iter(ET.Element):
+        if el.tag[0] == '{':
+            el.tag = el.tag.split('}', 1)[1]
+    return root
+
+
+def hocrclass(el, name):
+    return name in el.get('class', '').split()
+
+
+def shift(title, dx):
+    '''
+    bbox of an element moved right by dx, in our title format
+    '''
+    bbox = parsebbox(title)
+    return 'bbox %d %d %d %d' % (bbox.left + dx, bbox.top, bbox.right + dx, bbox.bottom)
+
+
+def wordclass(word):
+    '''
+    CSS class for a low confidence word or None
+    '''
+    m = WCONF.search(word.get('title', ''))
+    if not m:
+        return None
+    conf = int(m.group(1))
+    if conf < abbyy2hocr.VERYLOW:
+        return 'very_low_confidence'
+    if conf < abbyy2hocr.LOW:
+        return 'low_confidence'
+    return None
+
+
+def addline(p, line, dx):
+    '''
+    Append one of tesseract's lines to our paragraph p
+    '''
+    span = ET.SubElement(p, 'span')
+    span.set('class', 'ocr_line')
+    span.set('title', shift(line.get('title'), dx))
+    span.tail = ' '
+    words = [w for w in line.iter('span') if hocrclass(w, 'ocrx_word')]
+    for i, word in enumerate(words):
+        text = u''.join(word.itertext())
+        if i < len(words) - 1:
+            text += u' '
+        parent = span
+        if word.find('.//strong') is not None or word.find('.//b') is not None:
+            parent = ET.SubElement(parent, 'b')
+        if word.find('.//em') is not None or word.find('.//i') is not None:
+            parent = ET.SubElement(parent, 'em')
+        cls = wordclass(word)
+        if cls:
+            ET.SubElement(parent, 'span', {'class': cls}).text = text
+        elif parent is span:
+            abbyy2hocr.appendtext(span, text)
+        else:
+            parent.text = text
+
+
+def addblock(container, careas, dx, width):
+    '''
+    Add a text block for tesseract's text areas (all of those in a column
+    strip, or just one)
+    '''
+    div = ET.SubElement(container, 'div')
+    pars = [p for carea in careas for p in carea.iter('p') if hocrclass(p, 'ocr_par')]
+    boxes = [parsebbox(carea.get('title')) for carea in careas]
+    left = min(b.left for b in boxes) + dx
+    div.set('title', 'blockType: Text bbox %d %d %d %d'
+            % (left, min(b.top for b in boxes),
+               max(b.right for b in boxes) + dx, max(b.bottom for b in boxes)))
+    # same column classes as the stylesheet
+    if left < width / 4.0:
+        div.set('class', 'ocr_carea column col_left')
+    elif left > width * 55 / 100.0:
+        div.set('class', 'ocr_carea column col_right')
+    else:
+        div.set('class', 'ocr_carea column col_center')
+    for par in pars:
+        p = ET.SubElement(div, 'p', {'class': 'ocr_par'})
+        for line in par.iter('span'):
+            if any(hocrclass(line, name) for name in LINECLASSES):
+                addline(p, line, dx)
+
+
+def buildpage(results):
+    '''
+    Build an hOCR document in the abbyy2hocr structure from a list of
+    ((left, right), hocr) results for the strips of a page.
+    '''
+    root = ET.fromstring(abbyy2hocr.SKELETON)
+    root.find(".//meta[@name='ocr-system']").set('content', version())
+    body = root.find('body')
+    body.append(ET.fromstring(abbyy2hocr.HEADER))
+    pages = [((left, right), parsehocr(hocr).find(".//div[@class='ocr_page']"))
+             for (left, right), hocr in results]
+    # the page size is the extent of the strips
+    (left, right), last = pages[-1]
+    lastbox = parsebbox(last.get('title'))
+    width = left + lastbox.width()
+    height = lastbox.height()
+    container = ET.SubElement(body, 'div')
+    container.set('class', 'ocr_page')
+    container.set('id', 'container')
+    container.set('title', 'bbox 0 0 %d %d; ' % (width, height))
+    for (left, right), page in pages:
+        careas = [div for div in page.iter('div') if hocrclass(div, 'ocr_carea')
+                  and parsebbox(div.get('title')).width() > 0]
+        if right is None and left == 0:
+            for carea in careas:
+                addblock(container, [carea], 0, width)
+        elif careas:
+            addblock(container, careas, left, width)
+    footer = ET.SubElement(body, 'div', id='footer')
+    footer.text = 'footer placeholder'
+    return root.getroottree()
+
+
+def ocrpages(images, layout=None, jobs=None):
+    '''
+    Generator which OCRs images in a pool of jobs and yields (image, dom)
+    for each in order.  layout is an optional callable returning the column
+    gutters for an image (or None).
+    '''
+    version()  # fail early if there's no tesseract
+    if not os.path.exists(CACHEDIR):
+        os.makedirs(CACHEDIR)
+    jobs = jobs or multiprocessing.cpu_count()
+    pool = ThreadPool(jobs)
+
+    def tasks():
+        for image in images:
+            digest = filedigest(image)
+            for crop in crops(layout(image) if layout else None):
+                yield image, digest, crop
+
+    try:
+        page = []
+        for image, crop, hocr in pool.imap(ocr, tasks()):
+            page.append((crop, hocr))
+            if crop[1] is None:
+                # last strip of the page
+                yield image, buildpage(page)
+                page = []
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def imagepage(image):
+    '''
+    ABBYY page number of an image from the number at the end of its file
+    name, or None if it hasn't one.  The tiffs of the jp2 scans are numbered
+    by leaf (oed01arch_0025.tif is page 26) and those of the pdf by page
+    (oed01arch-0026.tif).
+    '''
+    m = LEAFNUM.search(image)
+    if m:
+        return volumes.leafpage(int(m.group(1)))
+    m = PAGENUM.search(image)
+    return int(m.group(1)) if m else None
+
+
+def metricslayout(path):
+    '''
+    Return a layout callable giving the column gutters for an image from the
+    metrics of an ABBYY run, matching the image to its ABBYY page.
+    '''
+    import metrics
+    columns = dict((record['page'], record.get('columns'))
+                   for record in metrics.load(path))
+
+    def layout(image):
+        pagenum = imagepage(image)
+        if columns.get(pagenum) is None:
+            print 'No column gutters for %s (page %s) in %s' % (image, pagenum, path)
+            return None
+        return columns[pagenum]
+    return layout
+
+
+def hocrfile(image):
+    return os.path.join(CACHEDIR, os.path.splitext(os.path.basename(image))[0] + '.html')
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options] image [image ...]')
+    parser.add_option('-j', '--jobs', type='int', default=None,
+                      help='number of tesseract processes [default: one per core]')
+    parser.add_option('-m', '--metrics', metavar='METRICS',
+                      help='OCR columns separately using the gutters in an ABBYY '
+                      'metrics file, eg output/oed-vol1_metrics.jsonl')
+    options, args = parser.parse_args()
+    if not args:
+        parser.print_help()
+        sys.exit(1)
+    layout = metricslayout(options.metrics) if options.metrics else None
+    for image, dom in ocrpages(args, layout, options.jobs):
+        print 'Writing %s' % hocrfile(image)
+        dom.write(hocrfile(image), pretty_print=True)
+
+if __name__ == '__main__':
+    main()
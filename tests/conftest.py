@@ -0,0 +1,77 @@
+'''
+The modules live at the top of the repository and read their stylesheet,
+CSS & output paths relative to the working directory, so pipeline tests run
+in a scratch directory laid out the same way with a synthetic volume.
+'''
+import json
+import os
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import fixtures
+import volumes
+
+PAGES = 14
+
+
+@pytest.fixture
+def volume(tmpdir, monkeypatch):
+    '''
+    A synthetic volume of PAGES pages in input/ of a scratch working
+    directory
+    '''
+    for name in ('abbyy2hocr.xsl', '3column.css'):
+        shutil.copy(os.path.join(ROOT, name), str(tmpdir))
+    tmpdir.mkdir('input')
+    tmpdir.mkdir('output')
+    monkeypatch.chdir(tmpdir)
+    volume = volumes.Volume('t', 'testarch', 1, PAGES)
+    fixtures.writevolume(volume.localfile, PAGES)
+    return volume
+
+
+def outputfiles(directory='output'):
+    '''
+    name -> contents of the files in the output directory, apart from the
+    metrics, which have timings in them.  Page bundles are read back as the
+    files in them, since the order of their members depends on how they
+    were written.
+    '''
+    import bundle
+    files = {}
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if 'metrics' in name or name.endswith('_pages.idx'):
+            continue
+        if name.endswith('_pages.gz'):
+            pages = bundle.Bundle(path)
+            for page in pages.names():
+                files[name + ':' + page] = pages.read(page)
+            pages.close()
+        else:
+            with open(path, 'rb') as f:
+                files[name] = f.read()
+    return files
+
+
+def loadmetrics(path):
+    '''
+    The records of a metrics file without their timings
+    '''
+    records = []
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            del record['time']
+            records.append(record)
+    return records
+
+
+def cleanoutput():
+    shutil.rmtree('output')
+    os.mkdir('output')
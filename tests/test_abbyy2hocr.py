@@ -0,0 +1,49 @@
+'''
+The native builder has to produce exactly what the stylesheet does.
+'''
+import copy
+import os
+
+import lxml.etree as ET
+import pytest
+
+import abbyy2hocr
+import fixtures
+import oedabby
+from conftest import ROOT
+
+PAGE = os.path.join(os.path.dirname(__file__), 'data', 'abbyy_page.xml')
+
+
+@pytest.fixture(scope='module')
+def xslt():
+    return ET.XSLT(ET.parse(os.path.join(ROOT, 'abbyy2hocr.xsl')))
+
+
+def pages():
+    # read the same way as the pipeline, which strips the namespace (and
+    # clears each page once it's done with it)
+    with open(PAGE, 'rb') as f:
+        for pagenum, linenum, page in oedabby.iterpages(f):
+            yield copy.deepcopy(page)
+    for pagenum in (1, 2, 26):
+        yield ET.fromstring(fixtures.page(pagenum))
+
+
+@pytest.mark.parametrize('page', list(pages()))
+def test_unmerged_identical(xslt, page):
+    assert (ET.tostring(abbyy2hocr.transform(page, merge=False))
+            == ET.tostring(xslt(page)))
+
+
+@pytest.mark.parametrize('page', list(pages()))
+def test_merged_same_text(xslt, page):
+    assert (abbyy2hocr.transform(page).xpath('string()')
+            == xslt(page).xpath('string()'))
+
+
+def test_fixture_page_read():
+    page = next(pages())
+    assert len(page.findall('block')) == 6
+    text = abbyy2hocr.transform(page).xpath('string()')
+    assert u"Aba'se" in text and u'\xe6\u2020\u2016' in text
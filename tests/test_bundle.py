@@ -0,0 +1,65 @@
+'''
+Pages written to a bundle read back the same as the loose files.
+'''
+import gzip
+import os
+
+import bundle
+import oedabby
+from conftest import cleanoutput, outputfiles
+
+
+def test_roundtrip(tmpdir):
+    path = str(tmpdir.join('pages.gz'))
+    pages = bundle.Bundle(path, 'a')
+    assert pages.add('a.html', 'first')
+    assert pages.add('b.html', 'second')
+    assert not pages.add('a.html', 'first')
+    assert pages.add('a.html', 'replaced')
+    assert pages.waste() > 0
+    pages.close()
+
+    pages = bundle.Bundle(path)
+    assert pages.names() == ['a.html', 'b.html']
+    assert pages.read('a.html') == 'replaced'
+    assert pages.read('b.html') == 'second'
+    assert pages.size('a.html') == len('replaced')
+    pages.close()
+    # every member is a gzip member, so the whole bundle is one gzip file
+    assert gzip.open(path).read() == 'firstsecondreplaced'
+
+    assert bundle.compact(path) > 0
+    pages = bundle.Bundle(path)
+    assert pages.waste() == 0
+    assert [pages.read(name) for name in pages.names()] == ['replaced', 'second']
+    pages.close()
+
+
+def test_diff(tmpdir):
+    a = bundle.Bundle(str(tmpdir.join('a.gz')), 'a')
+    b = bundle.Bundle(str(tmpdir.join('b.gz')), 'a')
+    for name, data in (('same', 'x'), ('changed', 'y'), ('onlya', 'z')):
+        a.add(name, data)
+    for name, data in (('same', 'x'), ('changed', 'Y'), ('onlyb', 'z')):
+        b.add(name, data)
+    assert bundle.diff(a, b) == (['onlya'], ['onlyb'], ['changed'])
+    a.close()
+    b.close()
+
+
+def test_bundled_run(volume):
+    oedabby.processfile(volume)
+    loose = dict((key, data) for key, data in outputfiles().items()
+                 if key.endswith(('.html', '.css')))
+    cleanoutput()
+    oedabby.processfile(volume, bundled=True)
+    name = os.path.basename(volume.output('pages.gz'))
+    assert not volume.pages()
+    bundled = dict((key[len(name) + 1:], data)
+                   for key, data in outputfiles().items() if key.startswith(name))
+    assert bundled == loose
+
+    # a rerun writes the same pages, which aren't added again
+    size = os.path.getsize(volume.output('pages.gz'))
+    oedabby.processfile(volume, bundled=True)
+    assert os.path.getsize(volume.output('pages.gz')) == size
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+import lxml.etree as ET
+
+import correct
+
+PAGE = '''<html><body>
+<div title="blockType: Text bbox 55 200 775 3200" class="ocr_carea column col_left">
+<p class="ocr_par"><span class="ocr_line" title="bbox 55 200 775 238" id="line_1_1"><span>%s</span></span></p>
+</div></body></html>'''
+LOW = '<span class="low_confidence">%s</span>'
+
+
+def lexicon():
+    lexicon = correct.Lexicon()
+    for word in (u'bare', u'abandon', u'abase'):
+        lexicon.add('headword', word)
+    return lexicon
+
+
+def corrected(line):
+    dom = ET.fromstring(PAGE % line)
+    corrections = correct.Corrector(lexicon()).correct(dom)
+    return corrections, ''.join(dom.find('.//span[@class="ocr_line"]').itertext())
+
+
+def test_plain_word_left_alone():
+    corrections, text = corrected('the word ra' + LOW % 'r' + 'e in prose')
+    assert corrections == []
+    assert text == 'the word rare in prose'
+
+
+def test_bold_word_corrected():
+    corrections, text = corrected('<b>Aban' + LOW % 'b' + 'on</b> to give up')
+    assert corrections == [('line_1_1', 'Abanbon', 'Abandon')]
+    assert text == 'Abandon to give up'
@@ -0,0 +1,32 @@
+'''
+Entry assembly carries on from its checkpoints as if it had been one run.
+'''
+import os
+
+import oedabby
+from conftest import PAGES, cleanoutput, outputfiles
+
+
+def entryfiles(volume):
+    name = os.path.basename(volume.output('entries.jsonl'))
+    files = outputfiles()
+    return files[name], files[name + '.checkpoints']
+
+
+def test_resume(volume):
+    oedabby.processfile(volume, assemble=True)
+    full = entryfiles(volume)
+    assert len(full[1].splitlines()) == PAGES
+    cleanoutput()
+    oedabby.processfile(volume, assemble=True, limit=7)
+    oedabby.processfile(volume, assemble=True, start=8)
+    assert entryfiles(volume) == full
+
+
+def test_rerun_middle(volume):
+    # the pages after the rerun are spliced back on
+    oedabby.processfile(volume, assemble=True)
+    full = entryfiles(volume)
+    oedabby.processfile(volume, assemble=True, start=5, limit=8)
+    assert entryfiles(volume) == full
+
@@ -0,0 +1,42 @@
+'''
+An incremental rerun skips the pages which haven't changed.
+'''
+import oedabby
+from conftest import PAGES, loadmetrics, outputfiles
+
+
+def uptodate(volume):
+    return [record['page'] for record in loadmetrics(volume.output('metrics.jsonl'))
+            if record.get('uptodate')]
+
+
+def test_rerun_skips_pages(volume):
+    oedabby.processfile(volume, incremental=True)
+    first = outputfiles()
+    records = loadmetrics(volume.output('metrics.jsonl'))
+    assert uptodate(volume) == []
+
+    oedabby.processfile(volume, incremental=True)
+    assert uptodate(volume) == range(1, PAGES + 1)
+    assert outputfiles() == first
+    # the skipped pages keep their headwords & columns
+    for old, new in zip(records, loadmetrics(volume.output('metrics.jsonl'))):
+        assert new['headwords'] == old['headwords']
+        assert new['columns'] == old['columns']
+
+
+def test_changed_css_rebuilds(volume):
+    oedabby.processfile(volume, incremental=True)
+    with open('3column.css', 'a') as f:
+        f.write('\n')
+    oedabby.processfile(volume, incremental=True)
+    assert uptodate(volume) == []
+
+
+def test_range_rerun(volume):
+    oedabby.processfile(volume, incremental=True)
+    first = outputfiles()
+    oedabby.processfile(volume, start=5, limit=8, incremental=True)
+    assert uptodate(volume) == range(5, 9)
+    assert outputfiles() == first
+    assert len(loadmetrics(volume.output('metrics.jsonl'))) == PAGES
@@ -0,0 +1,22 @@
+'''
+Rendering pages in a pool gives the same output as a serial run.
+'''
+import pytest
+
+import abbyyindex
+import oedabby
+from conftest import PAGES, cleanoutput, loadmetrics, outputfiles
+
+
+@pytest.mark.parametrize('indexed', [False, True])
+def test_jobs_same_as_serial(volume, indexed):
+    if indexed:
+        abbyyindex.buildindex(volume.localfile)
+    oedabby.processfile(volume, jobs=1)
+    serial = outputfiles()
+    assert len([name for name in serial if name.endswith('.html')]) == PAGES
+    metrics = loadmetrics(volume.output('metrics.jsonl'))
+    cleanoutput()
+    oedabby.processfile(volume, jobs=3)
+    assert outputfiles() == serial
+    assert loadmetrics(volume.output('metrics.jsonl')) == metrics
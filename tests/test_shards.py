@@ -0,0 +1,40 @@
+'''
+Sharded runs merged together give the same output as one full run.
+'''
+import os
+
+import pytest
+
+import oedabby
+from conftest import cleanoutput, loadmetrics, outputfiles
+
+
+@pytest.mark.parametrize('bundled', [False, True])
+def test_merge_same_as_full_run(volume, bundled):
+    # merge also joins up the links at the ends of the volume, which it
+    # does whether or not it was sharded
+    oedabby.processfile(volume, assemble=True, bundled=bundled)
+    oedabby.merge([volume])
+    full = outputfiles()
+    metrics = loadmetrics(volume.output('metrics.jsonl'))
+    cleanoutput()
+    for i in (1, 2, 3):
+        oedabby.processfile(volume, assemble=True, shard=(i, 3), bundled=bundled)
+    oedabby.merge([volume])
+    merged = outputfiles()
+    assert sorted(merged) == sorted(full)
+    assert merged == full
+    assert loadmetrics(volume.output('metrics.jsonl')) == metrics
+
+
+def test_resume_after_merge(volume):
+    # the merged checkpoints let a later run pick up part way through
+    oedabby.processfile(volume, assemble=True)
+    full = outputfiles()
+    cleanoutput()
+    for i in (1, 2):
+        oedabby.processfile(volume, assemble=True, shard=(i, 2))
+    oedabby.merge([volume])
+    oedabby.processfile(volume, assemble=True, start=6, limit=9)
+    name = os.path.basename(volume.output('entries.jsonl'))
+    assert outputfiles()[name] == full[name]
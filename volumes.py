@@ -0,0 +1,181 @@
+'''
+The volumes of the dictionary on the Internet Archive and where each one's
+input & output files go.
+
+Each volume is a separate archive.org item with its own ABBYY FineReader
+file.  The pages of the dictionary proper start after the front matter, so
+each volume has a default range of pages to process and the offset from the
+scan page number to the printed page number, which is what the archive.org
+book reader uses in its links.  Where we haven't yet checked a volume's
+front matter we process every page and link to the scan page instead.
+
+A range of pages can also be split into shards, contiguous slices which can
+be processed independently (on separate cores or machines) and merged
+afterwards.  Each shard writes its own metrics, manifest & entry files.
+
+Usage:
+    python volumes.py [volume ...]
+'''
+import glob
+import os
+import re
+import sys
+
+IADOWNLOAD = 'https://archive.org/download/%s/%s_abbyy.gz'
+IASTREAM = 'https://archive.org/stream/%s#page/%s/mode/1up'
+HTMLTEMPLATE = 'output/%s_p%04d.html'
+OUTPUTTEMPLATE = 'output/%s_%s.%s'
+
+
+class Volume():
+    '''
+    One archive.org item.  start & limit are the default page range and
+    offset the number of scan pages before printed page 1, or None if we
+    don't know it yet.
+    '''
+
+    def __init__(self, key, identifier, start=1, limit=None, offset=None):
+        self.key = key
+        self.identifier = identifier
+        self.start = start
+        self.limit = limit
+        self.offset = offset
+        self.name = 'oed-vol%s' % key
+        self.url = IADOWNLOAD % (identifier, identifier)
+        self.localfile = 'input/' + self.url.split('/')[-1]
+
+    def __repr__(self):
+        return 'Volume(%r, %r)' % (self.key, self.identifier)
+
+    def htmlfile(self, pagenum):
+        return HTMLTEMPLATE % (self.name, pagenum)
+
+    def pagename(self, pagenum):
+        '''
+        File name of a page, which is also its name in the volume's bundle
+        '''
+        return os.path.basename(self.htmlfile(pagenum))
+
+    def image(self, pagenum):
+        '''
+        Link to the scan of a page in the archive.org book reader
+        '''
+        if self.offset is None:
+            return IASTREAM % (self.identifier, 'n%d' % leaf(pagenum))
+        return IASTREAM % (self.identifier, pagenum - self.offset)
+
+    def output(self, kind, shard=None):
+        '''
+        Path of one of the volume's output files, eg output('metrics.jsonl'),
+        or of a shard's copy of it if shard is given as (i, n).
+        '''
+        base, ext = kind.split('.', 1)
+        if shard:
+            base += '-%dof%d' % shard
+        return OUTPUTTEMPLATE % (self.name, base, ext)
+
+    def shardfiles(self, kind):
+        '''
+        Existing shard copies of an output file, in shard order
+        '''
+        base, ext = kind.split('.', 1)
+        pattern = re.compile(r'-(\d+)of(\d+)\.%s$' % re.escape(ext))
+        shards = []
+        for path in glob.glob(OUTPUTTEMPLATE % (self.name, base + '-*of*', ext)):
+            m = pattern.search(path)
+            if m:
+                shards.append((int(m.group(2)), int(m.group(1)), path))
+        if len(set(n for n, i, path in shards)) > 1:
+            raise ValueError('%s has shards from runs with different numbers '
+                             'of shards' % self.output(kind))
+        return [path for n, i, path in sorted(shards)]
+
+    def pages(self, names=None):
+        '''
+        Page numbers of the HTML pages in the output directory, or of those
+        in a list of names (eg of the files in a bundle)
+        '''
+        pattern = re.compile(r'^%s_p(\d+)\.html$' % re.escape(self.name))
+        directory = os.path.dirname(HTMLTEMPLATE)
+        if names is None:
+            names = os.listdir(directory) if os.path.isdir(directory) else []
+        return sorted(int(m.group(1)) for m in map(pattern.match, names) if m)
+
+
+VOLUMES = [
+    Volume('1', 'oed01arch', 26, 1275, 24),
+    Volume('2', 'oed02arch'),
+    Volume('3', 'oed03arch'),
+    Volume('4', 'oed04arch'),
+    Volume('5', 'newenglishdict05murrmiss'),
+    Volume('6a', 'oed6aarch'),
+    Volume('6b', 'oed6barch'),
+]
+
+
+def leaf(pagenum):
+    '''
+    Number of the scan of an ABBYY page.  The scans (the jp2 images and the
+    book reader's n<leaf> pages) count from 0, the ABBYY pages from 1.
+    '''
+    return pagenum - 1
+
+
+def leafpage(leaf):
+    '''
+    ABBYY page number of a scan, the inverse of leaf()
+    '''
+    return leaf + 1
+
+
+def lookup(keys):
+    '''
+    Return the volumes for a comma separated list of keys (or archive.org
+    identifiers) in volume order, or all of them for 'all'.
+    '''
+    if keys == 'all':
+        return list(VOLUMES)
+    wanted = keys.split(',')
+    result = [v for v in VOLUMES if v.key in wanted or v.identifier in wanted]
+    known = set(v.key for v in result) | set(v.identifier for v in result)
+    unknown = [key for key in wanted if key not in known]
+    if unknown:
+        raise ValueError('Unknown volume %s - expected one of %s or all'
+                         % (', '.join(unknown), ', '.join(v.key for v in VOLUMES)))
+    return result
+
+
+def parseshard(text):
+    '''
+    Parse a shard given as i/N, for the i'th of N shards (counting from 1)
+    '''
+    i, _, n = text.partition('/')
+    try:
+        shard = int(i), int(n)
+    except ValueError:
+        raise ValueError('Shard should be i/N, not %s' % text)
+    if not 1 <= shard[0] <= shard[1]:
+        raise ValueError('Shard %s out of range' % text)
+    return shard
+
+
+def shardrange(start, limit, shard):
+    '''
+    Return the (start, limit) of the pages in a shard of a page range.
+    Shards are contiguous and as equal in size as possible, so the column
+    layout & entries only have to be picked up at the shard boundaries.
+    The range is empty (start > limit) if there are more shards than pages.
+    '''
+    i, n = shard
+    size = -(-(limit - start + 1) // n)
+    first = start + (i - 1) * size
+    return first, min(limit, first + size - 1)
+
+
+def main():
+    for volume in lookup(','.join(sys.argv[1:]) or 'all'):
+        print '%s\t%s\t%s-%s\t%s' % (volume.key, volume.identifier, volume.start,
+                                     volume.limit or '', volume.url)
+
+if __name__ == '__main__':
+    main()